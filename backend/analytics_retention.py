@@ -0,0 +1,43 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend import db as dbmod
+from backend.db import archive_analytics_events, init_db
+
+
+def _retention_days() -> int:
+    raw = (os.getenv("ANALYTICS_RETENTION_DAYS") or "180").strip()
+    try:
+        days = int(raw)
+    except Exception:
+        days = 180
+    # Keep at least yesterday hot so late events still land next to their rollup day.
+    return max(2, days)
+
+
+def main() -> int:
+    init_db()
+    if "--vacuum" in sys.argv[1:]:
+        # One-off: switch an existing DB to incremental auto-vacuum so purges give pages back.
+        with dbmod.conn() as c:
+            c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            c.execute("VACUUM")
+        print("database vacuumed (auto_vacuum=incremental)")
+
+    # Reports keep reading archived days from the rollup; a partial-day window over one counts the whole day.
+    before_day = (datetime.now(timezone.utc) - timedelta(days=_retention_days())).date().isoformat()
+    out = archive_analytics_events(before_day)
+    print(f"archived analytics events before {before_day}: {out['moved']}")
+    for month, cnt in sorted(out["months"].items()):
+        print(f"- {month}: {cnt}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,13 +1,23 @@
 import asyncio
+import gc
+import gzip
+import json
 import os
 import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import httpx
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 from backend import app as appmod
 from backend import db as dbmod
+from backend import metrics as metricsmod
+from backend import mvp_billing as mvpmod
 from backend.worker import process_job
 
 
@@ -27,6 +37,37 @@ def _lead_payload(email: str = "john@example.com", phone: str = "+48 500 600 700
     }
 
 
+# Hot DAL reads that must stay index seeks; each entry is called against a seeded DB.
+_HOT_QUERIES = [
+    lambda: dbmod.booking_target("LEAD-X", "token"),
+    lambda: dbmod.count_recent_leads_by_ip("127.0.0.1", "2026-02-01T00:00:00+00:00"),
+    lambda: dbmod.count_events_between("2026-01-01T05:00:00+00:00", "2026-02-10T12:00:00+00:00", "page_view"),
+    lambda: dbmod.count_form_submit_by_form_between("2026-01-01T05:00:00+00:00", "2026-02-10T12:00:00+00:00"),
+    lambda: dbmod.top_cta_labels_between("2026-01-01T05:00:00+00:00", "2026-02-10T12:00:00+00:00"),
+    lambda: dbmod.top_events_between("2026-01-01T05:00:00+00:00", "2026-02-10T12:00:00+00:00"),
+    lambda: dbmod.funnel_count_between("2026-01-01T05:00:00+00:00", "2026-02-10T12:00:00+00:00", "/"),
+    lambda: dbmod.list_analytics_events_between("2026-01-01", "2026-02-10", event_name="cta_click"),
+    lambda: dbmod.list_recent_leads(limit=20, status="new", include_test=False, include_spam=False),
+    lambda: dbmod.list_leads_between("2026-01-01", "2026-02-10", include_test=False, include_spam=False),
+    lambda: dbmod.list_leads_for_backfill(limit=100, after_id="", include_test=False, include_spam=False),
+    lambda: dbmod.count_leads_by_status_between("2026-01-01", "2026-02-10"),
+    lambda: dbmod.list_due_followup_candidates(24, "2026-02-10T00:00:00+00:00"),
+    lambda: dbmod.list_due_followups("2026-02-10T00:00:00+00:00"),
+    lambda: dbmod.list_due_sequence_tasks("2026-02-10T00:00:00+00:00"),
+    lambda: dbmod.leads_pending_touch(),
+    lambda: dbmod.get_lead_by_id("LEAD-X"),
+]
+
+
+def _full_scans(plan_rows: list) -> list:
+    out = []
+    for row in plan_rows:
+        detail = str(row[3])
+        if detail.startswith("SCAN ") and "USING" not in detail and "(subquery" not in detail:
+            out.append(detail)
+    return out
+
+
 class RolloutApiTests(unittest.TestCase):
     def setUp(self) -> None:
         fd, temp_path = tempfile.mkstemp(prefix="dz_api_", suffix=".sqlite3")
@@ -49,6 +90,7 @@ class RolloutApiTests(unittest.TestCase):
 
     def tearDown(self) -> None:
         self.client.close()
+        dbmod.close_all_connections()
 
     def _create_lead(self) -> str:
         res = self.client.post("/api/leads", json=_lead_payload())
@@ -153,6 +195,233 @@ class RolloutApiTests(unittest.TestCase):
         self.assertFalse(bool(flags.get("AUTOPILOT_ENABLED", True)))
         self.assertFalse(bool(flags.get("ROI_ENABLED", True)))
 
+    def test_db_connection_pooled_with_wal(self) -> None:
+        first = dbmod.conn()
+        self.assertIs(first, dbmod.conn())
+        mode = str(first.execute("PRAGMA journal_mode").fetchone()[0]).lower()
+        self.assertEqual(mode, "wal")
+        dbmod.close_all_connections()
+        self.assertIsNot(first, dbmod.conn())
+
+        worker = threading.Thread(target=dbmod.conn)
+        worker.start()
+        worker.join()
+        gc.collect()  # the statement cache keeps a connection in a reference cycle
+        self.assertEqual(list(dbmod._POOL_ALL), [dbmod.conn()])
+
+    def test_transaction_commits_once_or_rolls_back(self) -> None:
+        now = appmod.now_iso()
+        with self.assertRaises(RuntimeError):
+            with dbmod.transaction() as tx:
+                dbmod.insert_lead("LEAD-TX-1", "kontakt", "{}", "/kontakt.html", "127.0.0.1", "ua", now, tx=tx)
+                dbmod.upsert_lead_value("LEAD-TX-1", 100.0, now)
+                raise RuntimeError("abort")
+        self.assertIsNone(dbmod.get_lead_by_id("LEAD-TX-1"))
+
+        with dbmod.transaction() as tx:
+            dbmod.insert_lead("LEAD-TX-2", "kontakt", "{}", "/kontakt.html", "127.0.0.1", "ua", now, tx=tx)
+            dbmod.upsert_lead_value("LEAD-TX-2", 250.0, now)
+        row = dbmod.get_lead_by_id("LEAD-TX-2") or {}
+        self.assertEqual(float(row.get("deal_value") or 0), 250.0)
+
+    def test_writer_thread_group_commits_concurrent_writes(self) -> None:
+        writers, per_writer = 8, 5
+        writer = dbmod.start_writer_thread(max_batch=writers, max_wait_ms=5)
+        try:
+            now = appmod.now_iso()
+            # Hold the writer on one item so every concurrent write is queued before it commits.
+            gate = threading.Event()
+            blocker = dbmod.submit_write(gate.wait, 5)
+
+            def _write(w: int) -> list:
+                return [
+                    dbmod.submit_write(dbmod.insert_lead, f"LEAD-W-{w}-{i}", "kontakt", "{}", "/kontakt.html", "127.0.0.1", "ua", now)
+                    for i in range(per_writer)
+                ]
+
+            with ThreadPoolExecutor(max_workers=writers) as pool:
+                futures = [fut for batch in pool.map(_write, range(writers)) for fut in batch]
+            gate.set()
+            self.assertTrue(blocker.result(timeout=5))
+            for fut in futures:
+                fut.result(timeout=5)
+            batches = writer.stats["batches"]
+            failing = dbmod.submit_write(dbmod.insert_lead, "LEAD-W-0-0", "kontakt", "{}", "/", "127.0.0.1", "ua", now)
+            with self.assertRaises(Exception):
+                failing.result(timeout=5)
+        finally:
+            dbmod.stop_writer_thread()
+        total = writers * per_writer
+        self.assertEqual(dbmod.count_leads_between("0000", "9999"), total)
+        self.assertEqual(writer.stats["writes"], total + 1)
+        self.assertEqual(writer.stats["failed"], 1)
+        # The blocker's batch plus full max_batch groups for the queued writes.
+        self.assertLessEqual(batches, 1 + -(-total // writers))
+
+    def test_init_db_is_versioned_and_idempotent(self) -> None:
+        self.assertEqual(dbmod.init_db(), 0)
+        latest = dbmod.SQLITE_MIGRATIONS[-1][0]
+        self.assertEqual(dbmod._schema_version(dbmod.conn()), latest)
+
+        fd, legacy_path = tempfile.mkstemp(prefix="dz_legacy_", suffix=".sqlite3")
+        os.close(fd)
+        dbmod.DB_PATH = Path(legacy_path)
+        with dbmod.conn() as c:
+            c.execute("CREATE TABLE lead_meta (lead_id TEXT PRIMARY KEY, status TEXT NOT NULL DEFAULT 'new', notes TEXT NOT NULL DEFAULT '', follow_up_at TEXT, updated_at TEXT NOT NULL)")
+        self.assertEqual(dbmod.init_db(), len(dbmod.SQLITE_MIGRATIONS))
+        self.assertIn("win_probability", dbmod._table_columns(dbmod.conn(), "lead_meta"))
+
+    def test_analytics_rollup_matches_raw_scan(self) -> None:
+        def ev(name: str, label: str, path: str, created_at: str) -> tuple:
+            return (name, label, path, "", "s1", "granted", "{}", "127.0.0.1", "ua", created_at)
+
+        dbmod.insert_analytics_events(
+            [
+                ev("page_view", "", "/oferta.html", "2026-02-09T22:15:00+00:00"),
+                ev("page_view", "", "/oferta.html", "2026-02-10T08:00:00+00:00"),
+                ev("cta_click", "Umow audyt", "/", "2026-02-10T09:00:00+00:00"),
+                ev("cta_click", "Umow audyt", "/", "2026-02-11T09:00:00+00:00"),
+                ev("form_submit", "Formularz audyt", "/audyt.html", "2026-02-11T10:00:00+00:00"),
+                ev("form_submit", "Kontakt", "/kontakt.html", "2026-02-12T07:30:00+00:00"),
+                ev("form_submit", "Kontakt", "/kontakt.html", "2026-02-12T18:30:00+00:00"),
+            ]
+        )
+        with dbmod.conn() as c:
+            rolled = c.execute("SELECT COALESCE(SUM(cnt), 0) AS cnt FROM analytics_daily_rollup").fetchone()["cnt"]
+        self.assertEqual(int(rolled), 7)
+
+        # Unaligned edges are scanned raw, whole days come from the rollup.
+        s, e = "2026-02-09T23:00:00+00:00", "2026-02-12T12:00:00+00:00"
+        self.assertEqual(dbmod._rollup_windows(s, e)[1], ("2026-02-10", "2026-02-12"))
+        self.assertEqual(dbmod.count_events_between(s, e), 5)
+        self.assertEqual(dbmod.count_events_between(s, e, "cta_click"), 2)
+        self.assertEqual(dbmod.count_form_submit_between(s, e), 2)
+        self.assertEqual(dbmod.funnel_count_between(s, e, "/oferta.html"), 1)
+        self.assertEqual(dbmod.count_form_submit_by_form_between(s, e), {"audyt": 1, "kontakt": 1, "other": 0})
+        self.assertEqual(dbmod.top_cta_labels_between(s, e), [{"label": "Umow audyt", "cnt": 2}])
+        self.assertEqual(dbmod.count_events_between("2026-02-09T00:00:00+00:00", "2026-02-13T00:00:00+00:00"), 7)
+        self.assertEqual(dbmod.count_events_between("2026-02-12T08:00:00+00:00", "2026-02-12T19:00:00+00:00"), 1)
+        dbmod.insert_analytics_events(
+            [
+                ("cta_click", None, "/", "", "s1", "granted", "{}", "127.0.0.1", "ua", "2026-02-10T11:00:00+00:00"),
+                ("cta_click", None, "/", "", "s1", "granted", "{}", "127.0.0.1", "ua", "2026-02-10T12:00:00+00:00"),
+                ("cta_click", None, "/", "", "s1", "granted", "{}", "127.0.0.1", "ua", "2026-02-12T09:00:00+00:00"),
+            ]
+        )
+        self.assertEqual(
+            dbmod.top_cta_labels_between(s, e),
+            [{"label": "(no-label)", "cnt": 3}, {"label": "Umow audyt", "cnt": 2}],
+        )
+
+    def test_payload_fields_extracted_into_columns(self) -> None:
+        payload = _lead_payload(email=" Anna@Firma.pl ")
+        payload.update({"utm_source": "google", "utm_campaign": "wiosna", "session_id": "sess-1"})
+        res = self.client.post("/api/leads", json=payload)
+        self.assertEqual(res.status_code, 200, res.text)
+        res = self.client.post(
+            "/api/analytics/events",
+            json={"events": [{"event_name": "cta_click", "label": "Umow audyt", "payload": {"page_type": "home", "cta_area": "hero", "cta_kind": "primary"}}]},
+        )
+        self.assertEqual(res.status_code, 200, res.text)
+
+        now = appmod.now_iso()
+        lead = dbmod.list_leads_between("2000-01-01", now + "~")[0]
+        self.assertEqual(
+            (lead["email"], lead["utm_source"], lead["utm_campaign"], lead["session_id"], lead["budget"]),
+            ("Anna@Firma.pl", "google", "wiosna", "sess-1", "500-2000 PLN"),
+        )
+        self.assertEqual(appmod._lead_channel(lead), "google")
+        event = dbmod.list_analytics_events_between("2000-01-01", now + "~")[0]
+        self.assertEqual((event["page_type"], event["cta_area"], event["cta_kind"]), ("home", "hero", "primary"))
+
+    def test_leads_backfill_resumes_from_cursor(self) -> None:
+        lead_ids = sorted(self._create_lead() for _ in range(3))
+
+        res = self.client.post("/api/admin/leads/backfill", headers=self.admin_headers, json={"limit": 2, "include_test": True})
+        self.assertEqual(res.status_code, 200, res.text)
+        first = res.json()
+        self.assertEqual((first["processed"], first["autopilot_updates"], first["win_updates"]), (2, 2, 2))
+        self.assertFalse(first["done"])
+        self.assertEqual(first["next_cursor"], lead_ids[1])
+
+        res = self.client.post(
+            "/api/admin/leads/backfill",
+            headers=self.admin_headers,
+            json={"limit": 2, "include_test": True, "cursor": first["next_cursor"]},
+        )
+        self.assertEqual(res.status_code, 200, res.text)
+        second = res.json()
+        self.assertEqual(second["processed"], 1)
+        self.assertTrue(second["done"])
+        self.assertEqual(second["next_cursor"], "")
+
+    def test_hot_queries_do_not_full_scan(self) -> None:
+        for _ in range(3):
+            self._create_lead()
+        dbmod.insert_analytics_events(
+            [("page_view", "", "/", "", "s1", "granted", "{}", "127.0.0.1", "ua", f"2026-01-{d:02d}T10:00:00+00:00") for d in range(1, 29)]
+        )
+
+        c = dbmod.conn()
+        statements: list = []
+        c.set_trace_callback(statements.append)
+        try:
+            for call in _HOT_QUERIES:
+                call()
+        finally:
+            c.set_trace_callback(None)
+
+        selects = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+        self.assertGreaterEqual(len(selects), len(_HOT_QUERIES))
+        for sql in selects:
+            plan = c.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            self.assertEqual(_full_scans(plan), [], " ".join(sql.split()))
+
+    def test_analytics_archive_moves_old_days(self) -> None:
+        archive_dir = tempfile.mkdtemp(prefix="dz_archive_")
+        os.environ["ANALYTICS_ARCHIVE_DIR"] = archive_dir
+        self.addCleanup(os.environ.pop, "ANALYTICS_ARCHIVE_DIR", None)
+        stamps = ["2026-01-20T10:00:00+00:00", "2026-01-31T23:00:00+00:00", "2026-02-03T08:00:00+00:00", "2026-02-20T09:00:00+00:00"]
+        dbmod.insert_analytics_events([("page_view", "", "/", "", "s1", "granted", "{}", "127.0.0.1", "ua", ts) for ts in stamps])
+
+        out = dbmod.archive_analytics_events("2026-02-15")
+        self.assertEqual(out["moved"], 3)
+        self.assertEqual(out["months"], {"2026-01": 2, "2026-02": 1})
+        self.assertTrue(out["incremental_vacuum"])
+        self.assertTrue(Path(archive_dir, "analytics-2026-01.sqlite3").exists())
+        self.assertEqual(dbmod.archive_analytics_events("2026-02-15")["moved"], 0)
+
+        hot = dbmod.list_analytics_events_between("2026-01-01", "2026-03-01")
+        self.assertEqual([e["created_at"] for e in hot], stamps[3:])
+        # Whole-day rollups still cover archived days.
+        self.assertEqual(dbmod.count_events_between("2026-01-01T00:00:00+00:00", "2026-03-01T00:00:00+00:00"), 4)
+        # Partial-day edges over archived days snap to the whole rollup day.
+        self.assertEqual(dbmod.count_events_between("2026-01-31T12:00:00+00:00", "2026-02-03T12:00:00+00:00"), 2)
+        self.assertEqual(dbmod.count_events_between("2026-01-20T09:00:00+00:00", "2026-01-20T11:00:00+00:00"), 1)
+        self.assertEqual(dbmod.count_events_between("2026-02-03T12:00:00+00:00", "2026-02-04T06:00:00+00:00"), 1)
+        self.assertEqual(dbmod.count_events_between("2026-02-20T10:00:00+00:00", "2026-02-20T12:00:00+00:00"), 0)
+        history = dbmod.list_archived_analytics_events_between("2026-01-01", "2026-03-01")
+        self.assertEqual([e["created_at"] for e in history], stamps)
+
+    def test_admin_export_streams_ndjson_and_gzip_csv(self) -> None:
+        lead_ids = {self._create_lead() for _ in range(2)}
+
+        res = self.client.get("/api/admin/export/leads", headers=self.admin_headers)
+        self.assertEqual(res.status_code, 200, res.text)
+        rows = [json.loads(line) for line in res.text.splitlines()]
+        self.assertEqual({r["id"] for r in rows}, lead_ids)
+
+        res = self.client.get("/api/admin/export/leads?fmt=csv&gzip=true&since=2000-01-01", headers=self.admin_headers)
+        self.assertEqual(res.status_code, 200, res.text)
+        lines = gzip.decompress(res.content).decode("utf-8").splitlines()
+        self.assertTrue(lines[0].startswith("id,form_type,payload_json"))
+        self.assertEqual(len(lines), 3)
+
+        res = self.client.get("/api/admin/export/leads?since=2999-01-01", headers=self.admin_headers)
+        self.assertEqual(res.text, "")
+        res = self.client.get("/api/admin/export/sqlite_master", headers=self.admin_headers)
+        self.assertEqual(res.status_code, 404)
+
     def test_worker_process_job_marks_done(self) -> None:
         job_id = "JOB-TEST-1"
         now = appmod.now_iso()
@@ -162,6 +431,279 @@ class RolloutApiTests(unittest.TestCase):
         self.assertIsNotNone(row)
         self.assertEqual(str((row or {}).get("status") or ""), "done")
 
+    def test_replicate_predictions_share_one_poller(self) -> None:
+        polls: dict = {}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.method == "POST":
+                pid = f"p{len(polls)}"
+                polls[pid] = 0
+                return httpx.Response(201, json={"id": pid, "status": "starting"})
+            pid = request.url.path.rsplit("/", 1)[-1]
+            polls[pid] += 1
+            status = "succeeded" if polls[pid] >= 3 else "processing"
+            return httpx.Response(200, json={"id": pid, "status": status, "output": [pid]})
+
+        async def run() -> list:
+            mvpmod._PROVIDER_STATE["client"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            mvpmod._PROVIDER_STATE["loop"] = asyncio.get_running_loop()
+            mvpmod._REPLICATE_POLL["ticks"] = 0
+            try:
+                jobs = [
+                    {"provider": "replicate", "input_json": {"version": "v1", "input": {"n": i}}}
+                    for i in range(100)
+                ]
+                return await asyncio.gather(*(mvpmod._run_provider(job) for job in jobs))
+            finally:
+                await mvpmod.close_provider_client()
+
+        old = {k: os.environ.get(k) for k in ("REPLICATE_API_TOKEN", "REPLICATE_POLL_INTERVAL_SECONDS")}
+        os.environ["REPLICATE_API_TOKEN"] = "test"
+        os.environ["REPLICATE_POLL_INTERVAL_SECONDS"] = "0.01"
+        try:
+            results = asyncio.run(run())
+        finally:
+            for key, value in old.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+        self.assertEqual(len(results), 100)
+        self.assertEqual({r[1]["status"] for r in results}, {"succeeded"})
+        self.assertEqual(sorted(r[0] for r in results), sorted(polls))
+        # Three polls per prediction, batched into a handful of ticks rather than 300 sleeps.
+        self.assertLessEqual(int(mvpmod._REPLICATE_POLL["ticks"]), 5)
+        self.assertEqual(mvpmod._REPLICATE_POLL["pending"], {})
+
+    def test_replicate_webhook_only_wakes_the_poller(self) -> None:
+        loop = asyncio.new_event_loop()
+        fut = loop.create_future()
+        wake = asyncio.Event()
+        mvpmod._REPLICATE_POLL["pending"]["p-hook"] = fut
+        mvpmod._REPLICATE_POLL["loop"] = loop
+        mvpmod._REPLICATE_POLL["wake"] = wake
+        os.environ["REPLICATE_WEBHOOK_TOKEN"] = "hook-token"
+        try:
+            res = self.client.post(
+                "/api/providers/replicate/webhook?token=hook-token",
+                json={"id": "p-hook", "status": "succeeded", "output": ["forged"]},
+            )
+            loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            os.environ.pop("REPLICATE_WEBHOOK_TOKEN", None)
+            mvpmod._REPLICATE_POLL["pending"].pop("p-hook", None)
+            mvpmod._REPLICATE_POLL["loop"] = None
+            mvpmod._REPLICATE_POLL["wake"] = None
+            loop.close()
+        self.assertEqual(res.status_code, 200, res.text)
+        self.assertEqual(res.json()["delivered"], "local")
+        # The body never becomes the result; the poller is woken to fetch it from the API.
+        self.assertFalse(fut.done())
+        self.assertTrue(wake.is_set())
+
+    def test_job_stream_hub_fans_out_one_refresh_to_all_subscribers(self) -> None:
+        calls: list = []
+
+        def fake_delta(job_id: str, after_id: int, user_id=None):
+            calls.append(after_id)
+            events = [{"id": i, "event_type": "started", "payload": {}} for i in (1, 2) if i > after_id]
+            return {"id": job_id, "status": "running", "attempt_count": 1}, events
+
+        async def run() -> list:
+            subs = [mvpmod._job_stream_subscribe("job-1", 0), mvpmod._job_stream_subscribe("job-1", 1)]
+            try:
+                for _ in range(5):
+                    mvpmod._job_stream_poke("job-1")
+                    mvpmod._job_stream_poke("job-other")
+                for _ in range(20):
+                    await asyncio.sleep(0.01)
+                return [[sub["queue"].get_nowait() for _ in range(sub["queue"].qsize())] for sub in subs]
+            finally:
+                for sub in subs:
+                    mvpmod._job_stream_unsubscribe("job-1", sub)
+
+        original = mvpmod._job_stream_delta
+        mvpmod._job_stream_delta = fake_delta
+        try:
+            received = asyncio.run(run())
+        finally:
+            mvpmod._job_stream_delta = original
+
+        # Five notifications collapse into at most two shared queries, read from the oldest cursor.
+        self.assertLessEqual(len(calls), 2)
+        self.assertEqual(calls[0], 0)
+        first = [e["id"] for _, events in received[0] for e in events]
+        second = [e["id"] for _, events in received[1] for e in events]
+        self.assertEqual(first, [1, 2])
+        self.assertEqual(second, [2])
+        self.assertEqual(mvpmod._JOB_STREAM["subscribers"], {})
+        self.assertEqual(mvpmod._sse("status", {"a": 1}, 7), 'id: 7\nevent: status\ndata: {"a": 1}\n\n')
+
+    def test_job_batch_rejects_oversized_and_duplicate_keys_before_db(self) -> None:
+        item = {"provider": "mock", "operation": "image.generate"}
+        os.environ["MVP_JOB_BATCH_MAX"] = "2"
+        try:
+            with self.assertRaises(HTTPException) as ctx:
+                mvpmod._create_jobs_batch("u", [mvpmod.JobCreateIn(**item)] * 3)
+            self.assertEqual(ctx.exception.status_code, 400)
+        finally:
+            os.environ.pop("MVP_JOB_BATCH_MAX", None)
+        dupes = [mvpmod.JobCreateIn(**item, idempotency_key="k"), mvpmod.JobCreateIn(**item, idempotency_key="k")]
+        with self.assertRaises(HTTPException) as ctx:
+            mvpmod._create_jobs_batch("u", dupes)
+        self.assertIn("duplicate idempotency key", str(ctx.exception.detail))
+        # A batch key covers unkeyed items by position; explicit item keys collide with it too.
+        with self.assertRaises(HTTPException):
+            mvpmod._create_jobs_batch("u", [mvpmod.JobCreateIn(**item), mvpmod.JobCreateIn(**item, idempotency_key="b:0")], "b")
+
+    def test_fair_share_is_weighted_round_robin_within_caps(self) -> None:
+        users = [
+            {"user_id": "heavy", "pass": 0.0, "weight": 1, "running": 0, "max_running": 2},
+            {"user_id": "gold", "pass": 0.0, "weight": 3, "running": 0, "max_running": 50},
+            {"user_id": "small", "pass": 0.5, "weight": 1, "running": 0, "max_running": 50},
+        ]
+        self.assertEqual(mvpmod._fair_share(users, 8), {"gold": 5, "heavy": 2, "small": 1})
+        self.assertEqual(sum(mvpmod._fair_share(users, 3).values()), 3)
+        capped = [{"user_id": "a", "pass": 0.0, "weight": 1, "running": 1, "max_running": 2}]
+        self.assertEqual(mvpmod._fair_share(capped, 10), {"a": 1})
+
+    def test_result_cache_key_is_canonical_and_opt_in(self) -> None:
+        os.environ["MVP_RESULT_CACHE_OPERATIONS"] = "image.generate=600, replicate:image.upscale, video.render=0"
+        os.environ["MVP_RESULT_CACHE_TTL_SECONDS"] = "7200"
+        try:
+            self.assertEqual(mvpmod._result_cache_ttl("mock", "image.generate"), 600)
+            self.assertEqual(mvpmod._result_cache_ttl("Replicate", "image.upscale"), 7200)
+            self.assertEqual(mvpmod._result_cache_ttl("mock", "image.upscale"), 0)
+            self.assertEqual(mvpmod._result_cache_ttl("mock", "video.render"), 0)
+            a = mvpmod._result_cache_key("mock", "image.generate", {"prompt": "x", "opts": {"w": 1, "h": 2}})
+            b = mvpmod._result_cache_key("mock", "Image.Generate", {"opts": {"h": 2, "w": 1}, "prompt": "x"})
+            c = mvpmod._result_cache_key("replicate", "image.generate", {"prompt": "x", "opts": {"w": 1, "h": 2}})
+            self.assertEqual(a, b)
+            self.assertEqual(len(a), 64)
+            self.assertNotEqual(a, c)
+            self.assertEqual(mvpmod._result_cache_key("mock", "image.upscale", {"prompt": "x"}), "")
+        finally:
+            os.environ.pop("MVP_RESULT_CACHE_OPERATIONS", None)
+            os.environ.pop("MVP_RESULT_CACHE_TTL_SECONDS", None)
+
+    def test_password_hash_pool_sheds_load_and_flags_rehash(self) -> None:
+        gate = threading.Event()
+
+        async def run() -> int:
+            blocked = [asyncio.ensure_future(mvpmod._run_password_work(gate.wait, 5)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(HTTPException) as ctx:
+                await mvpmod._run_password_work(mvpmod._hash_password, "Secret123")
+            gate.set()
+            await asyncio.gather(*blocked)
+            return ctx.exception.status_code
+
+        old = os.environ.get("AUTH_HASH_MAX_QUEUE")
+        os.environ["AUTH_HASH_MAX_QUEUE"] = "2"
+        try:
+            self.assertEqual(asyncio.run(run()), 503)
+        finally:
+            if old is None:
+                os.environ.pop("AUTH_HASH_MAX_QUEUE", None)
+            else:
+                os.environ["AUTH_HASH_MAX_QUEUE"] = old
+
+        weak = mvpmod._hash_password("Secret123", iterations=100000)
+        self.assertTrue(mvpmod._verify_password("Secret123", weak))
+        self.assertTrue(mvpmod._password_needs_rehash(weak))
+        self.assertFalse(mvpmod._password_needs_rehash(mvpmod._hash_password("Secret123")))
+
+    def test_login_throttle_locks_and_expires_per_shard(self) -> None:
+        env = {"AUTH_LOGIN_MAX_ATTEMPTS": "2", "AUTH_LOGIN_WINDOW_SECONDS": "60", "AUTH_LOGIN_LOCK_SECONDS": "60"}
+        old = {k: os.environ.get(k) for k in [*env, "AUTH_LOGIN_THROTTLE_STORE"]}
+        os.environ.update(env)
+        os.environ.pop("AUTH_LOGIN_THROTTLE_STORE", None)
+        try:
+            email, ip = "throttle@example.com", "10.0.0.1"
+            mvpmod._register_login_failure(email, ip)
+            mvpmod._assert_login_allowed(email, ip)
+            mvpmod._register_login_failure(email, ip)
+            with self.assertRaises(HTTPException) as ctx:
+                mvpmod._assert_login_allowed(email, ip)
+            self.assertEqual(ctx.exception.status_code, 429)
+            mvpmod._assert_login_allowed(email, "10.0.0.2")
+
+            shard = mvpmod._login_shard(mvpmod._login_key(email, ip))
+            with shard["lock"]:
+                mvpmod._expire_login_shard(shard, mvpmod.time.monotonic() + 61, 60)
+            self.assertNotIn(mvpmod._login_key(email, ip), shard["attempts"])
+            self.assertNotIn(mvpmod._login_key(email, ip), shard["locked"])
+            self.assertEqual(len(shard["attempt_expiry"]), 0)
+        finally:
+            for key, value in old.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    def test_job_duration_histogram_quantile(self) -> None:
+        self.assertIsNone(mvpmod._histogram_quantile({}, 0.95))
+        self.assertEqual(mvpmod._duration_bucket_label(0.3), "1")
+        self.assertEqual(mvpmod._duration_bucket_label(7), "10")
+        self.assertEqual(mvpmod._duration_bucket_label(99999), "+Inf")
+        hist = {"1": 50, "5": 40, "30": 10}
+        self.assertAlmostEqual(mvpmod._histogram_quantile(hist, 0.5), 1.0)
+        self.assertAlmostEqual(mvpmod._histogram_quantile(hist, 0.95), 10.0 + 20.0 * 0.5)
+        self.assertEqual(mvpmod._histogram_quantile({"+Inf": 3}, 0.95), 1800.0)
+
+    def test_prometheus_metrics_merge_app_and_worker_processes(self) -> None:
+        res = self.client.get("/api/health")
+        self.assertEqual(res.status_code, 200, res.text)
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        os.environ["METRICS_TOKEN"] = "metrics-test-token"
+        self.addCleanup(os.environ.pop, "METRICS_TOKEN", None)
+        headers = {"Authorization": "Bearer metrics-test-token"}
+        self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401)
+        dbmod.count_recent_leads_by_ip("127.0.0.1", "2026-02-01T00:00:00+00:00")
+        text = self.client.get("/metrics", headers=headers).text
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/api/health",status="200",le="+Inf"}', text)
+        self.assertIn('sqlite_session_seconds_count{kind="session",outcome="commit"}', text)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            worker = {
+                "mvp_provider_seconds": {
+                    "kind": "histogram",
+                    "help": "Provider call latency, by provider and outcome.",
+                    "buckets": list(metricsmod.DEFAULT_BUCKETS),
+                    "series": [[{"provider": "mock", "outcome": "ok"}, {
+                        "counts": [0] * 5 + [3] + [0] * 10, "sum": 0.6, "count": 3,
+                    }]],
+                },
+                "mvp_worker_in_flight": {"kind": "gauge", "help": "x", "buckets": [], "series": [[{}, 2.0]]},
+            }
+            Path(tmp, "worker-1.json").write_text(json.dumps({"at": time.time(), "metrics": worker}), encoding="utf-8")
+            Path(tmp, "worker-2.json").write_text(json.dumps({"at": time.time(), "metrics": worker}), encoding="utf-8")
+            Path(tmp, "worker-3.json").write_text(json.dumps({"at": 0, "metrics": worker}), encoding="utf-8")
+            os.environ["METRICS_MULTIPROC_DIR"] = tmp
+            try:
+                text = self.client.get("/metrics", headers=headers).text
+                # The exited worker-3 is folded into the retired totals; counters do not drop.
+                self.assertFalse(Path(tmp, "worker-3.json").exists())
+                self.assertTrue(Path(tmp, "_retired.json").exists())
+                again = self.client.get("/metrics", headers=headers).text
+            finally:
+                os.environ.pop("METRICS_MULTIPROC_DIR", None)
+
+        # This process's own registry is merged in too, and other tests may have recorded mock calls.
+        local = [0] * (len(metricsmod.DEFAULT_BUCKETS) + 1)
+        for labels, value in metricsmod.snapshot()["mvp_provider_seconds"]["series"]:
+            if labels == {"provider": "mock", "outcome": "ok"}:
+                local = value["counts"]
+        for body in (text, again):
+            self.assertIn(f'mvp_provider_seconds_count{{outcome="ok",provider="mock"}} {sum(local) + 9}', body)
+            self.assertIn(f'mvp_provider_seconds_bucket{{outcome="ok",provider="mock",le="0.1"}} {sum(local[:5])}', body)
+            self.assertIn(f'mvp_provider_seconds_bucket{{outcome="ok",provider="mock",le="0.25"}} {sum(local[:6]) + 9}', body)
+            self.assertIn('mvp_worker_in_flight{process="worker-1"} 2', body)
+            self.assertNotIn('process="worker-3"', body)
+            self.assertIn(f'mvp_worker_in_flight{{process="app-{os.getpid()}"}}', body)
+
 
 if __name__ == "__main__":
     unittest.main()
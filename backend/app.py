@@ -17,19 +17,30 @@ from typing import Any, Dict, Optional, List, Tuple
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
 from .mvp_billing import (
     router as mvp_billing_router,
+    close_postgres_pool,
     install_mvp_observability,
     init_mvp_sentry,
     start_mvp_worker,
+    start_session_flusher,
+    stop_job_stream_hub,
     stop_mvp_worker,
+    stop_session_flusher,
 )
+from .metrics import start_metrics_dumper, stop_metrics_dumper
 from .db import (
     init_db,
+    lead_email,
+    close_all_connections,
+    transaction,
+    run_write,
+    start_writer_thread,
+    stop_writer_thread,
     insert_job,
     get_job,
     list_jobs,
@@ -46,10 +57,13 @@ from .db import (
     list_recent_leads,
     top_events_between,
     list_recent_events,
+    list_archived_analytics_events_between,
     upsert_lead_meta,
     upsert_lead_value,
     upsert_lead_autopilot,
+    upsert_lead_autopilot_many,
     upsert_lead_win_model,
+    upsert_lead_win_model_many,
     upsert_lead_enrichment,
     booking_target,
     confirm_lead_booking,
@@ -127,6 +141,7 @@ from .db import (
     list_autonomous_run_log,
 )
 from .worker import process_job
+from .export_stream import EXPORT_TABLES, export_columns, iter_csv, iter_export_rows, iter_gzip, iter_ndjson
 
 
 def now_iso() -> str:
@@ -298,7 +313,7 @@ def _booking_link(lead_id: str, token: str) -> str:
 
 def _detect_test_spam(data: "LeadIn", ip: str) -> Tuple[bool, bool, str]:
     payload = {"fields": data.fields or {}}
-    email = _lead_email(payload).lower()
+    email = lead_email(payload).lower()
     email_domain = _lead_email_domain(email)
 
     test_domains = set(_split_csv_env(
@@ -335,24 +350,13 @@ def _detect_test_spam(data: "LeadIn", ip: str) -> Tuple[bool, bool, str]:
         reasons.append("honeypot")
 
     return is_test, is_spam, ";".join(reasons)
-def _lead_email(payload: Dict[str, Any]) -> str:
-    fields = payload.get("fields") if isinstance(payload, dict) else {}
-    if not isinstance(fields, dict):
-        return ""
-    for key in ("email", "e-mail", "mail"):
-        val = fields.get(key)
-        if isinstance(val, str) and "@" in val:
-            return val.strip()
-    return ""
-
-
 def _lead_score(form_type: str, payload: Dict[str, Any], lead_status: str) -> int:
     score = 0
     fields = payload.get("fields") if isinstance(payload, dict) else {}
     if not isinstance(fields, dict):
         fields = {}
 
-    if _lead_email(payload):
+    if lead_email(payload):
         score += 30
     if isinstance(fields.get("telefon"), str) and fields.get("telefon", "").strip():
         score += 15
@@ -424,7 +428,7 @@ def _autopilot_decision(
     fields = payload.get("fields") if isinstance(payload, dict) else {}
     if not isinstance(fields, dict):
         fields = {}
-    has_email = bool(_lead_email(payload))
+    has_email = bool(lead_email(payload))
     has_phone = isinstance(fields.get("telefon"), str) and bool(fields.get("telefon", "").strip())
     touched = _safe_dt(str(last_contact_at or "")) is not None
 
@@ -454,7 +458,7 @@ def _autopilot_decision(
     }
 
 
-def _recompute_autopilot_for_row(row: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Optional[str]]:
+def _recompute_autopilot_for_row(row: Dict[str, Any], payload: Dict[str, Any], tx: Any = None) -> Dict[str, Optional[str]]:
     if not _autopilot_enabled():
         return {
             "priority": str(row.get("autopilot_priority") or "P3"),
@@ -477,6 +481,7 @@ def _recompute_autopilot_for_row(row: Dict[str, Any], payload: Dict[str, Any]) -
         next_action_due_at=decision.get("next_action_due_at"),
         owner_queue=str(decision.get("owner_queue") or "sales"),
         updated_at=now_iso(),
+        tx=tx,
     )
     return decision
 
@@ -515,7 +520,7 @@ def _win_model_snapshot(days: int = 120, include_test: bool = False, include_spa
         st = str(row.get("lead_status") or "")
         won_inc = 1 if st == "won" else 0
         form_key = str(row.get("form_type") or "other").strip().lower() or "other"
-        source_key = str(row.get("source_path") or payload.get("landing_path") or "(unknown)").strip().lower() or "(unknown)"
+        source_key = str(row.get("source_path") or row.get("landing_path") or "(unknown)").strip().lower() or "(unknown)"
         score = _lead_score(form_key, payload, str(row.get("lead_status") or "new"))
         tier = _lead_tier(score)
 
@@ -596,7 +601,12 @@ def _predict_win_probability(
     }
 
 
-def _refresh_win_snapshot_for_row(row: Dict[str, Any], payload: Dict[str, Any], model: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def _refresh_win_snapshot_for_row(
+    row: Dict[str, Any],
+    payload: Dict[str, Any],
+    model: Optional[Dict[str, Any]] = None,
+    tx: Any = None,
+) -> Dict[str, Any]:
     if not _win_model_enabled():
         return {}
     win_model = model or _win_model_snapshot(days=120, include_test=True, include_spam=True)
@@ -609,15 +619,23 @@ def _refresh_win_snapshot_for_row(row: Dict[str, Any], payload: Dict[str, Any],
         win_recommendation=str(pred.get("recommendation") or "nurture"),
         win_model_version=str(pred.get("model_version") or WIN_MODEL_VERSION),
         updated_at=now_iso(),
+        tx=tx,
     )
     return pred
 
 
-def _lead_channel(row: Dict[str, Any], payload: Dict[str, Any]) -> str:
-    utm_source = str(payload.get("utm_source") or "").strip().lower()
+def _lead_row_field(row: Dict[str, Any], payload: Optional[Dict[str, Any]], key: str) -> str:
+    # Lead rows from list_leads_between carry extracted payload columns; fall back to payload otherwise.
+    if key in row:
+        return str(row.get(key) or "")
+    return str((payload or {}).get(key) or "")
+
+
+def _lead_channel(row: Dict[str, Any], payload: Optional[Dict[str, Any]] = None) -> str:
+    utm_source = _lead_row_field(row, payload, "utm_source").strip().lower()
     if utm_source:
         return utm_source
-    src = str(row.get("source_path") or payload.get("landing_path") or "").strip().lower()
+    src = str(row.get("source_path") or _lead_row_field(row, payload, "landing_path")).strip().lower()
     if not src:
         return "unknown"
     if "google" in src or "ads" in src:
@@ -647,12 +665,7 @@ def _build_roi_report(days: int, include_test: bool, include_spam: bool) -> Dict
 
     stats: Dict[str, Dict[str, Any]] = {}
     for row in leads:
-        payload = {}
-        try:
-            payload = json.loads(row.get("payload_json") or "{}")
-        except Exception:
-            payload = {}
-        ch = _lead_channel(row, payload)
+        ch = _lead_channel(row)
         st = stats.setdefault(ch, {"channel": ch, "leads": 0, "won": 0, "lost": 0, "revenue": 0.0})
         st["leads"] += 1
         lead_status = str(row.get("lead_status") or "new")
@@ -839,12 +852,7 @@ def _build_forecast_report(
     global_won_count = 0
     channel_stats: Dict[str, Dict[str, Any]] = {}
     for row in leads:
-        payload = {}
-        try:
-            payload = json.loads(row.get("payload_json") or "{}")
-        except Exception:
-            payload = {}
-        ch = _lead_channel(row, payload)
+        ch = _lead_channel(row)
         st = channel_stats.setdefault(ch, {"leads": 0, "won": 0, "lost": 0, "won_revenue": 0.0})
         st["leads"] += 1
         status = str(row.get("lead_status") or "new")
@@ -1688,6 +1696,7 @@ def _sequence_ensure_for_lead(
     lead_status: str,
     is_test: bool,
     is_spam: bool,
+    tx: Any = None,
 ) -> None:
     if not lead_id:
         return
@@ -1704,9 +1713,10 @@ def _sequence_ensure_for_lead(
             updated_at=now_value,
             status="pending",
             note=label,
+            tx=tx,
         )
     if lead_status in {"won", "lost"}:
-        skip_pending_sequence_for_lead(lead_id=lead_id, updated_at=now_value, note=f"lead_{lead_status}")
+        skip_pending_sequence_for_lead(lead_id=lead_id, updated_at=now_value, note=f"lead_{lead_status}", tx=tx)
 
 
 def _sequence_step_codes() -> set:
@@ -2114,6 +2124,7 @@ class ChannelCostCsvImportIn(BaseModel):
 
 class LeadsBackfillIn(BaseModel):
     limit: int = Field(default=5000, ge=1, le=50_000)
+    cursor: str = Field(default="", max_length=64)
     include_test: bool = False
     include_spam: bool = False
     refresh_autopilot: bool = True
@@ -2240,6 +2251,8 @@ class TargetCommitCreateIn(BaseModel):
 @app.on_event("startup")
 async def startup() -> None:
     init_db()
+    if _env_flag("SQLITE_WRITER_THREAD_ENABLED", False):
+        start_writer_thread()
     try:
         _maybe_apply_postgres_migrations_on_startup()
     except Exception:
@@ -2248,11 +2261,19 @@ async def startup() -> None:
     if _env_flag("LEGACY_QUEUE_WORKER_ENABLED", True):
         asyncio.create_task(worker_loop())
     start_mvp_worker()
+    start_session_flusher()
+    start_metrics_dumper()
 
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
     await stop_mvp_worker()
+    await stop_session_flusher()
+    stop_job_stream_hub()
+    close_postgres_pool()
+    stop_metrics_dumper()
+    stop_writer_thread()
+    close_all_connections()
 
 
 async def worker_loop() -> None:
@@ -2408,56 +2429,69 @@ def create_lead(req: Request, data: LeadIn, bg: BackgroundTasks) -> Dict[str, An
     payload_json = json.dumps(data.model_dump(exclude={"website"}), ensure_ascii=False)
 
     is_test, is_spam, spam_reason = _detect_test_spam(data, ip)
+    payload = data.model_dump(exclude={"website"})
+    # Heavy read happens before the write transaction so the lock is held only for the inserts.
+    win_model = _win_model_snapshot(days=120, include_test=True, include_spam=True) if _win_model_enabled() else None
+
+    def _persist_lead() -> None:
+        with transaction() as tx:
+            insert_lead(
+                lead_id=lead_id,
+                form_type=data.form_type,
+                payload_json=payload_json,
+                source_path=(data.source_path or "")[:240],
+                ip=ip,
+                user_agent=ua,
+                created_at=created_at,
+                tx=tx,
+            )
 
-    insert_lead(
-        lead_id=lead_id,
-        form_type=data.form_type,
-        payload_json=payload_json,
-        source_path=(data.source_path or "")[:240],
-        ip=ip,
-        user_agent=ua,
-        created_at=created_at,
-    )
+            upsert_lead_enrichment(
+                lead_id=lead_id,
+                booking_token=booking_token,
+                is_test=is_test,
+                is_spam=is_spam,
+                spam_reason=spam_reason,
+                updated_at=created_at,
+                tx=tx,
+            )
 
-    upsert_lead_enrichment(
-        lead_id=lead_id,
-        booking_token=booking_token,
-        is_test=is_test,
-        is_spam=is_spam,
-        spam_reason=spam_reason,
-        updated_at=created_at,
-    )
+            if _autopilot_enabled():
+                _recompute_autopilot_for_row(
+                    {
+                        "id": lead_id,
+                        "form_type": data.form_type,
+                        "lead_status": "new",
+                        "is_test": 1 if is_test else 0,
+                        "is_spam": 1 if is_spam else 0,
+                        "last_contact_at": None,
+                    },
+                    payload=payload,
+                    tx=tx,
+                )
+            _refresh_win_snapshot_for_row(
+                {
+                    "id": lead_id,
+                    "form_type": data.form_type,
+                    "lead_status": "new",
+                    "is_test": 1 if is_test else 0,
+                    "is_spam": 1 if is_spam else 0,
+                    "source_path": data.source_path or "",
+                },
+                payload=payload,
+                model=win_model,
+                tx=tx,
+            )
+            _sequence_ensure_for_lead(
+                lead_id=lead_id,
+                created_at=created_at,
+                lead_status="new",
+                is_test=is_test,
+                is_spam=is_spam,
+                tx=tx,
+            )
 
-    if _autopilot_enabled():
-        _recompute_autopilot_for_row(
-            {
-                "id": lead_id,
-                "form_type": data.form_type,
-                "lead_status": "new",
-                "is_test": 1 if is_test else 0,
-                "is_spam": 1 if is_spam else 0,
-                "last_contact_at": None,
-            },
-            payload=data.model_dump(exclude={"website"}),
-        )
-    _refresh_win_snapshot_for_row(
-        {
-            "id": lead_id,
-            "form_type": data.form_type,
-            "lead_status": "new",
-            "is_test": 1 if is_test else 0,
-            "is_spam": 1 if is_spam else 0,
-            "source_path": data.source_path or "",
-        },
-        payload=data.model_dump(exclude={"website"}),
-    )
-    _sequence_ensure_for_lead(
-        lead_id=lead_id,
-        created_at=created_at,
-        lead_status="new",
-        is_test=is_test,
-        is_spam=is_spam,
-    )
+    run_write(_persist_lead)
 
     # For honeypot submissions keep accepted=False, but store row as spam for KPI hygiene.
     if (data.website or "").strip():
@@ -2496,7 +2530,7 @@ def public_booking_info(lead_id: str, token: str) -> Dict[str, Any]:
         "lead_status": target.get("lead_status") or "new",
         "booked_at": target.get("booked_at"),
         "booked_slot": target.get("booked_slot"),
-        "email": _lead_email(payload),
+        "email": lead_email(payload),
     }
 
 
@@ -2701,12 +2735,7 @@ def admin_summary(
     lost_missing_reason_count = 0
 
     for row in rows_window:
-        payload = {}
-        try:
-            payload = json.loads(row.get("payload_json") or "{}")
-        except Exception:
-            payload = {}
-        em = _lead_email(payload).lower()
+        em = str(row.get("email") or "").lower()
         if em:
             email_counts[em] = email_counts.get(em, 0) + 1
         form = str(row.get("form_type") or "other")
@@ -2742,7 +2771,7 @@ def admin_summary(
             lead_status=str(row.get("lead_status") or "new"),
         )
         tier_counts[_lead_tier(score)] += 1
-        em = _lead_email(payload).lower()
+        em = str(row.get("email") or "").lower()
         if em and email_counts.get(em, 0) > 1:
             duplicates_total += 1
 
@@ -4315,7 +4344,7 @@ def admin_leads(
             is_test=bool(int(row.get("is_test") or 0)),
             is_spam=bool(int(row.get("is_spam") or 0)),
         )
-        em = _lead_email(payload).lower()
+        em = lead_email(payload).lower()
         if em:
             email_counts[em] = email_counts.get(em, 0) + 1
     progress_map = sequence_progress_for_leads([str(x.get("id") or "") for x in rows if str(x.get("id") or "")])
@@ -4369,7 +4398,7 @@ def admin_leads(
             continue
         if win_reco_filter and str(win_pred.get("recommendation") or "") != win_reco_filter:
             continue
-        em = _lead_email(payload).lower()
+        em = lead_email(payload).lower()
         duplicate_count = email_counts.get(em, 0) if em else 0
         is_duplicate = duplicate_count > 1
         if duplicates_only and not is_duplicate:
@@ -4437,40 +4466,79 @@ def admin_leads_backfill(req: Request, data: LeadsBackfillIn, token: Optional[st
     processed = 0
     autopilot_updates = 0
     win_updates = 0
-    offset = 0
+    cursor = data.cursor.strip()
+    done = False
     while processed < limit:
-        batch = list_leads_for_backfill(limit=min(page, limit - processed), offset=offset, include_test=include_test, include_spam=include_spam)
+        want = min(page, limit - processed)
+        batch = list_leads_for_backfill(limit=want, after_id=cursor, include_test=include_test, include_spam=include_spam)
         if not batch:
+            done = True
             break
+        updated_at = now_iso()
+        autopilot_rows: List[Tuple[str, str, str, Optional[str], str, str]] = []
+        win_rows: List[Tuple[str, Optional[float], Optional[str], Optional[str], str]] = []
         for row in batch:
             payload = {}
             try:
                 payload = json.loads(row.get("payload_json") or "{}")
             except Exception:
                 payload = {}
+            lead_id = str(row.get("id") or "")
             if refresh_autopilot:
-                _recompute_autopilot_for_row(row, payload)
-                autopilot_updates += 1
+                decision = _autopilot_decision(
+                    form_type=str(row.get("form_type") or ""),
+                    payload=payload,
+                    lead_status=str(row.get("lead_status") or "new"),
+                    is_test=bool(int(row.get("is_test") or 0)),
+                    is_spam=bool(int(row.get("is_spam") or 0)),
+                    last_contact_at=row.get("last_contact_at"),
+                )
+                autopilot_rows.append(
+                    (
+                        lead_id,
+                        str(decision.get("priority") or "P3"),
+                        str(decision.get("next_action") or "review"),
+                        decision.get("next_action_due_at"),
+                        str(decision.get("owner_queue") or "sales"),
+                        updated_at,
+                    )
+                )
             if refresh_win:
                 score = _lead_score(str(row.get("form_type") or ""), payload, str(row.get("lead_status") or "new"))
                 tier = _lead_tier(score)
                 pred = _predict_win_probability(row=row, payload=payload, score=score, tier=tier, model=win_model)
-                upsert_lead_win_model(
-                    lead_id=str(row.get("id") or ""),
-                    win_probability=float(pred.get("probability_pct") or 0.0),
-                    win_recommendation=str(pred.get("recommendation") or "nurture"),
-                    win_model_version=str(pred.get("model_version") or WIN_MODEL_VERSION),
-                    updated_at=now_iso(),
+                win_rows.append(
+                    (
+                        lead_id,
+                        float(pred.get("probability_pct") or 0.0),
+                        str(pred.get("recommendation") or "nurture"),
+                        str(pred.get("model_version") or WIN_MODEL_VERSION),
+                        updated_at,
+                    )
                 )
-                win_updates += 1
+
+        def _write_chunk() -> None:
+            with transaction() as tx:
+                upsert_lead_autopilot_many(autopilot_rows, tx=tx)
+                upsert_lead_win_model_many(win_rows, tx=tx)
+
+        run_write(_write_chunk)
+        autopilot_updates += len(autopilot_rows)
+        win_updates += len(win_rows)
         processed += len(batch)
-        offset += len(batch)
+        cursor = str(batch[-1].get("id") or "")
+        if len(batch) < want:
+            done = True
+            break
 
     return {
         "ok": True,
         "processed": processed,
         "autopilot_updates": autopilot_updates,
         "win_updates": win_updates,
+        # Pass next_cursor back as `cursor` to resume; empty once every lead was visited.
+        "next_cursor": "" if done else cursor,
+        "done": done,
         "autopilot_enabled": _autopilot_enabled(),
         "win_model_enabled": _win_model_enabled(),
     }
@@ -4483,16 +4551,6 @@ def _safe_dt(value: str) -> Optional[datetime]:
         return None
 
 
-def _safe_json_dict(raw: Any) -> Dict[str, Any]:
-    if isinstance(raw, dict):
-        return raw
-    try:
-        data = json.loads(raw or "{}")
-    except Exception:
-        return {}
-    return data if isinstance(data, dict) else {}
-
-
 def _analytics_segments_from_events(events: List[Dict[str, Any]], limit: int = 12) -> Dict[str, Any]:
     area_counts: Dict[str, int] = {}
     kind_counts: Dict[str, int] = {}
@@ -4507,15 +4565,14 @@ def _analytics_segments_from_events(events: List[Dict[str, Any]], limit: int = 1
     for ev in events:
         total_events += 1
         event_name = str(ev.get("event_name") or "")
-        payload = _safe_json_dict(ev.get("payload_json"))
 
-        page_type = str(payload.get("page_type") or "unknown")
+        page_type = str(ev.get("page_type") or "unknown")
         page_type_counts[page_type] = page_type_counts.get(page_type, 0) + 1
 
         if event_name == "cta_click":
             total_cta += 1
-            area = str(payload.get("cta_area") or "unknown")
-            kind = str(payload.get("cta_kind") or "unknown")
+            area = str(ev.get("cta_area") or "unknown")
+            kind = str(ev.get("cta_kind") or "unknown")
             label = str(ev.get("label") or "(no-label)")
             area_counts[area] = area_counts.get(area, 0) + 1
             kind_counts[kind] = kind_counts.get(kind, 0) + 1
@@ -4524,7 +4581,7 @@ def _analytics_segments_from_events(events: List[Dict[str, Any]], limit: int = 1
 
         if event_name == "form_submit":
             total_submit += 1
-            form_name = str(payload.get("form_name") or ev.get("label") or "unknown")
+            form_name = str(ev.get("form_name") or ev.get("label") or "unknown")
             form_name_counts[form_name] = form_name_counts.get(form_name, 0) + 1
 
     def _top(counter: Dict[str, int], key_name: str) -> List[Dict[str, Any]]:
@@ -4573,13 +4630,7 @@ def build_pipeline_report(days: int = 1, include_test: bool = False, include_spa
         status = str(lead.get("lead_status") or "new")
         form_type = str(lead.get("form_type") or "other")
 
-        payload = {}
-        try:
-            payload = json.loads(lead.get("payload_json") or "{}")
-        except Exception:
-            payload = {}
-
-        source = str(lead.get("source_path") or payload.get("landing_path") or "(unknown)")
+        source = str(lead.get("source_path") or lead.get("landing_path") or "(unknown)")
         key = f"{source} -> {form_type} -> {status}"
         stage_rows[key] = stage_rows.get(key, 0) + 1
 
@@ -4590,7 +4641,7 @@ def build_pipeline_report(days: int = 1, include_test: bool = False, include_spa
         elif status == "lost":
             pstat["lost"] += 1
 
-        session = str(payload.get("session_id") or "").strip()
+        session = str(lead.get("session_id") or "").strip()
         cta_label = "(unattributed)"
         if session and session in cta_by_session:
             lead_dt = _safe_dt(str(lead.get("created_at") or ""))
@@ -4697,7 +4748,7 @@ def admin_cockpit_today(req: Request, limit: int = 120, token: Optional[str] = N
                 "autopilot_next_action": row.get("autopilot_next_action") or "review",
                 "autopilot_next_action_due_at": row.get("autopilot_next_action_due_at"),
                 "autopilot_owner_queue": row.get("autopilot_owner_queue") or "sales",
-                "email": _lead_email(payload),
+                "email": lead_email(payload),
                 "payload": payload,
             }
         )
@@ -5075,7 +5126,7 @@ def admin_sequence_due(req: Request, limit: int = 100, token: Optional[str] = No
                 "lead_status": row.get("lead_status") or "new",
                 "form_type": row.get("form_type") or "",
                 "created_at": row.get("created_at"),
-                "email": _lead_email(payload),
+                "email": lead_email(payload),
                 "lead_score": score,
                 "lead_tier": _lead_tier(score),
                 "overdue_hours": overdue_hours,
@@ -5240,6 +5291,56 @@ def admin_recent_events(req: Request, limit: int = 80, token: Optional[str] = No
     return {"ok": True, "events": list_recent_events(limit=limit)}
 
 
+@app.get("/api/admin/events/history")
+def admin_events_history(
+    req: Request,
+    start: str,
+    end: str,
+    event_name: str = "",
+    limit: int = 2000,
+    token: Optional[str] = None,
+) -> Dict[str, Any]:
+    if limit < 1 or limit > 20000:
+        raise HTTPException(status_code=400, detail="limit must be in range 1..20000")
+    _require_admin(req, token=token)
+    events = list_archived_analytics_events_between(start, end, event_name=event_name.strip(), limit=limit)
+    return {"ok": True, "count": len(events), "events": events}
+
+
+@app.get("/api/admin/export/{table}")
+def admin_export_table(
+    req: Request,
+    table: str,
+    fmt: str = "ndjson",
+    since: str = "",
+    gzip: bool = False,
+    token: Optional[str] = None,
+) -> StreamingResponse:
+    _require_admin(req, token=token)
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="table not exportable")
+    if fmt not in {"ndjson", "csv"}:
+        raise HTTPException(status_code=400, detail="fmt must be ndjson or csv")
+
+    rows = iter_export_rows(table, since=since.strip())
+    if fmt == "csv":
+        chunks: Any = iter_csv(export_columns(table), rows)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        chunks = iter_ndjson(rows)
+        media_type = "application/x-ndjson"
+    filename = f"{table}.{fmt}"
+    if gzip:
+        chunks = iter_gzip(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 def _is_report_authorized(req: Request, token: Optional[str]) -> bool:
     expected = os.getenv("WEEKLY_REPORT_TOKEN", "").strip()
     if expected:
@@ -1,17 +1,286 @@
+import functools
 import sqlite3
 import json
+import os
+import queue
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
 
 DB_PATH = Path(__file__).resolve().parent / "jobs.sqlite3"
 
+_POOL_LOCAL = threading.local()
+_POOL_LOCK = threading.Lock()
+# Weak, so a thread's connection is closed and dropped once the thread exits.
+_POOL_ALL: "weakref.WeakSet[sqlite3.Connection]" = weakref.WeakSet()
+_POOL_STATE: Dict[str, int] = {"generation": 0}
+# Label bucket for analytics events sent without one, in raw scans and in the daily rollup.
+_NO_LABEL = "(no-label)"
 
-def conn() -> sqlite3.Connection:
-    c = sqlite3.connect(DB_PATH)
+metrics.define_histogram("sqlite_session_seconds", "SQLite unit-of-work duration, by kind and outcome.")
+
+
+def _env_int(name: str, default: int, low: int, high: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    try:
+        value = int(raw) if raw else default
+    except Exception:
+        value = default
+    return max(low, min(high, value))
+
+
+class _PooledConnection(sqlite3.Connection):
+    # sqlite3.Connection itself cannot be weakly referenced.
+    pass
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    busy_ms = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000, 0, 120000)
+    c = sqlite3.connect(
+        path,
+        timeout=busy_ms / 1000.0,
+        check_same_thread=False,
+        factory=_PooledConnection,
+        cached_statements=_env_int("SQLITE_STATEMENT_CACHE", 256, 16, 4096),
+    )
     c.row_factory = sqlite3.Row
+    # Only takes effect on new files; existing DBs need one VACUUM (analytics_retention.py --vacuum).
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute(f"PRAGMA busy_timeout={busy_ms}")
+    c.execute(f"PRAGMA cache_size=-{_env_int('SQLITE_CACHE_SIZE_KB', 16384, 512, 1048576)}")
+    c.execute(f"PRAGMA mmap_size={_env_int('SQLITE_MMAP_SIZE_MB', 128, 0, 4096) * 1024 * 1024}")
+    c.execute("PRAGMA temp_store=MEMORY")
     return c
 
 
+def open_connection() -> sqlite3.Connection:
+    # Unpooled tuned connection to DB_PATH; the caller closes it.
+    return _open_connection(str(DB_PATH))
+
+
+def conn() -> sqlite3.Connection:
+    # One tuned connection per thread and DB_PATH; `with conn()` commits but keeps it open for reuse.
+    key = (str(DB_PATH), _POOL_STATE["generation"])
+    cached = getattr(_POOL_LOCAL, "conn", None)
+    if cached is not None and getattr(_POOL_LOCAL, "key", None) == key:
+        return cached
+    if cached is not None:
+        _discard_connection(cached)
+    c = _open_connection(key[0])
+    _POOL_LOCAL.conn = c
+    _POOL_LOCAL.key = key
+    with _POOL_LOCK:
+        _POOL_ALL.add(c)
+    return c
+
+
+def _discard_connection(c: sqlite3.Connection) -> None:
+    with _POOL_LOCK:
+        _POOL_ALL.discard(c)
+    try:
+        c.close()
+    except Exception:
+        pass
+
+
+def close_thread_connection() -> None:
+    cached = getattr(_POOL_LOCAL, "conn", None)
+    _POOL_LOCAL.conn = None
+    _POOL_LOCAL.key = None
+    if cached is not None:
+        _discard_connection(cached)
+
+
+def close_all_connections() -> int:
+    with _POOL_LOCK:
+        pooled = list(_POOL_ALL)
+        _POOL_ALL.clear()
+        _POOL_STATE["generation"] += 1
+    for c in pooled:
+        try:
+            c.close()
+        except Exception:
+            pass
+    return len(pooled)
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    # Unit of work: DAL calls made inside (same thread or via `tx=`) share one BEGIN IMMEDIATE ... COMMIT.
+    active = getattr(_POOL_LOCAL, "tx", None)
+    if active is not None:
+        yield active
+        return
+    c = conn()
+    started = time.perf_counter()
+    c.execute("BEGIN IMMEDIATE")
+    _POOL_LOCAL.tx = c
+    outcome = "commit"
+    try:
+        yield c
+        c.commit()
+    except BaseException:
+        outcome = "rollback"
+        c.rollback()
+        raise
+    finally:
+        _POOL_LOCAL.tx = None
+        metrics.observe("sqlite_session_seconds", time.perf_counter() - started, kind="transaction", outcome=outcome)
+
+
+@contextmanager
+def _session(tx: Optional[sqlite3.Connection] = None) -> Iterator[sqlite3.Connection]:
+    joined = tx if tx is not None else getattr(_POOL_LOCAL, "tx", None)
+    if joined is not None:
+        yield joined
+        return
+    started = time.perf_counter()
+    outcome = "commit"
+    try:
+        with conn() as c:
+            yield c
+    except BaseException:
+        outcome = "rollback"
+        raise
+    finally:
+        metrics.observe("sqlite_session_seconds", time.perf_counter() - started, kind="session", outcome=outcome)
+
+
+class _SqliteWriter(threading.Thread):
+    # Single writer: callers enqueue closures, the thread group-commits up to max_batch of them per transaction.
+    def __init__(self, max_batch: int, max_wait_s: float) -> None:
+        super().__init__(name="sqlite-writer", daemon=True)
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self.inbox: "queue.Queue[Optional[Tuple[Future, Callable[..., Any], tuple, dict]]]" = queue.Queue()
+        self.stats: Dict[str, int] = {"batches": 0, "writes": 0, "failed": 0}
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        fut: Future = Future()
+        self.inbox.put((fut, fn, args, kwargs))
+        return fut
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self.inbox.put(None)
+        self.join(timeout=timeout)
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self.inbox.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    nxt = self.inbox.get(timeout=remaining) if remaining > 0 else self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stopping = True
+                    break
+                batch.append(nxt)
+            self._commit_batch(batch)
+        close_thread_connection()
+
+    def _commit_batch(self, batch: List[Tuple[Future, Callable[..., Any], tuple, dict]]) -> None:
+        done: List[Tuple[Future, bool, Any]] = []
+        try:
+            with transaction() as tx:
+                for fut, fn, args, kwargs in batch:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    tx.execute("SAVEPOINT writer_item")
+                    try:
+                        value = fn(*args, **kwargs)
+                    except BaseException as exc:
+                        tx.execute("ROLLBACK TO writer_item")
+                        tx.execute("RELEASE writer_item")
+                        done.append((fut, False, exc))
+                    else:
+                        tx.execute("RELEASE writer_item")
+                        done.append((fut, True, value))
+        except BaseException as exc:
+            done = [(item[0], False, exc) for item in batch if not item[0].cancelled()]
+        self.stats["batches"] += 1
+        for fut, ok, value in done:
+            if ok:
+                self.stats["writes"] += 1
+                fut.set_result(value)
+            else:
+                self.stats["failed"] += 1
+                fut.set_exception(value)
+
+
+_WRITER_STATE: Dict[str, Optional[_SqliteWriter]] = {"writer": None}
+
+
+def start_writer_thread(max_batch: Optional[int] = None, max_wait_ms: Optional[int] = None) -> _SqliteWriter:
+    current = _WRITER_STATE["writer"]
+    if current is not None and current.is_alive():
+        return current
+    batch = max_batch if max_batch is not None else _env_int("SQLITE_WRITER_BATCH_SIZE", 64, 1, 10000)
+    wait_ms = max_wait_ms if max_wait_ms is not None else _env_int("SQLITE_WRITER_BATCH_MS", 2, 0, 1000)
+    writer = _SqliteWriter(max_batch=max(1, int(batch)), max_wait_s=max(0, int(wait_ms)) / 1000.0)
+    writer.start()
+    _WRITER_STATE["writer"] = writer
+    return writer
+
+
+def stop_writer_thread() -> None:
+    writer = _WRITER_STATE["writer"]
+    _WRITER_STATE["writer"] = None
+    if writer is not None and writer.is_alive():
+        writer.stop()
+
+
+def _writer_bypass(writer: Optional[_SqliteWriter]) -> bool:
+    if writer is None or not writer.is_alive():
+        return True
+    return threading.current_thread() is writer or getattr(_POOL_LOCAL, "tx", None) is not None
+
+
+def submit_write(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    writer = _WRITER_STATE["writer"]
+    if not _writer_bypass(writer):
+        return writer.submit(fn, *args, **kwargs)
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except BaseException as exc:
+        fut.set_exception(exc)
+    return fut
+
+
+def run_write(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    writer = _WRITER_STATE["writer"]
+    if _writer_bypass(writer):
+        return fn(*args, **kwargs)
+    return writer.submit(fn, *args, **kwargs).result()
+
+
+def _mutating(fn: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if kwargs.get("tx") is not None:
+            return fn(*args, **kwargs)
+        return run_write(fn, *args, **kwargs)
+
+    return wrapper
+
+
 def _table_columns(c: sqlite3.Connection, table_name: str) -> set:
     rows = c.execute(f"PRAGMA table_info({table_name})").fetchall()
     return {str(r["name"]) for r in rows}
@@ -23,472 +292,637 @@ def _ensure_column(c: sqlite3.Connection, table_name: str, column_name: str, ddl
         return
     c.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl_tail}")
 
-def init_db() -> None:
-    with conn() as c:
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS jobs (
-              id TEXT PRIMARY KEY,
-              status TEXT NOT NULL,
-              payload_json TEXT NOT NULL,
-              result_json TEXT,
-              created_at TEXT NOT NULL,
-              updated_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS leads (
-              id TEXT PRIMARY KEY,
-              form_type TEXT NOT NULL,
-              payload_json TEXT NOT NULL,
-              source_path TEXT,
-              ip TEXT,
-              user_agent TEXT,
-              created_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS analytics_events (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              event_name TEXT NOT NULL,
-              label TEXT,
-              path TEXT,
-              href TEXT,
-              session_id TEXT,
-              consent_state TEXT,
-              payload_json TEXT,
-              source_ip TEXT,
-              user_agent TEXT,
-              created_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS lead_meta (
-              lead_id TEXT PRIMARY KEY,
-              status TEXT NOT NULL DEFAULT 'new',
-              notes TEXT NOT NULL DEFAULT '',
-              follow_up_at TEXT,
-              updated_at TEXT NOT NULL,
-              booking_token TEXT,
-              booked_at TEXT,
-              booked_slot TEXT,
-              is_test INTEGER NOT NULL DEFAULT 0,
-              is_spam INTEGER NOT NULL DEFAULT 0,
-              spam_reason TEXT NOT NULL DEFAULT '',
-              last_contact_at TEXT,
-              lost_reason TEXT NOT NULL DEFAULT ''
-            )
-            """
-        )
-        _ensure_column(c, "lead_meta", "booking_token", "TEXT")
-        _ensure_column(c, "lead_meta", "booked_at", "TEXT")
-        _ensure_column(c, "lead_meta", "booked_slot", "TEXT")
-        _ensure_column(c, "lead_meta", "is_test", "INTEGER NOT NULL DEFAULT 0")
-        _ensure_column(c, "lead_meta", "is_spam", "INTEGER NOT NULL DEFAULT 0")
-        _ensure_column(c, "lead_meta", "spam_reason", "TEXT NOT NULL DEFAULT ''")
-        _ensure_column(c, "lead_meta", "last_contact_at", "TEXT")
-        _ensure_column(c, "lead_meta", "lost_reason", "TEXT NOT NULL DEFAULT ''")
-        _ensure_column(c, "lead_meta", "autopilot_priority", "TEXT NOT NULL DEFAULT 'P3'")
-        _ensure_column(c, "lead_meta", "autopilot_next_action", "TEXT NOT NULL DEFAULT 'review'")
-        _ensure_column(c, "lead_meta", "autopilot_next_action_due_at", "TEXT")
-        _ensure_column(c, "lead_meta", "autopilot_owner_queue", "TEXT NOT NULL DEFAULT 'sales'")
-        _ensure_column(c, "lead_meta", "autopilot_updated_at", "TEXT")
-        _ensure_column(c, "lead_meta", "deal_value", "REAL NOT NULL DEFAULT 0")
-        _ensure_column(c, "lead_meta", "win_probability", "REAL")
-        _ensure_column(c, "lead_meta", "win_recommendation", "TEXT")
-        _ensure_column(c, "lead_meta", "win_model_version", "TEXT")
-        _ensure_column(c, "lead_meta", "win_updated_at", "TEXT")
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS followup_templates (
-              step_hours INTEGER PRIMARY KEY,
-              subject_template TEXT NOT NULL,
-              body_template TEXT NOT NULL,
-              updated_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS followup_log (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              lead_id TEXT NOT NULL,
-              step_hours INTEGER NOT NULL,
-              to_email TEXT NOT NULL,
-              subject TEXT NOT NULL,
-              body TEXT NOT NULL,
-              status TEXT NOT NULL,
-              sent_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS lead_sequence_tasks (
-              lead_id TEXT NOT NULL,
-              step_code TEXT NOT NULL,
-              due_at TEXT NOT NULL,
-              status TEXT NOT NULL DEFAULT 'pending',
-              done_at TEXT,
-              note TEXT NOT NULL DEFAULT '',
-              updated_at TEXT NOT NULL,
-              PRIMARY KEY (lead_id, step_code)
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS channel_cost_daily (
-              date_iso TEXT NOT NULL,
-              channel TEXT NOT NULL,
-              cost REAL NOT NULL DEFAULT 0,
-              updated_at TEXT NOT NULL,
-              PRIMARY KEY (date_iso, channel)
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS budget_plans (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              created_at TEXT NOT NULL,
-              days INTEGER NOT NULL,
-              spend_change_pct REAL NOT NULL,
-              status TEXT NOT NULL DEFAULT 'proposed',
-              note TEXT NOT NULL DEFAULT ''
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS budget_plan_items (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              plan_id INTEGER NOT NULL,
-              channel TEXT NOT NULL,
-              action TEXT NOT NULL,
-              reason TEXT NOT NULL DEFAULT '',
-              current_cost REAL NOT NULL DEFAULT 0,
-              proposed_cost REAL NOT NULL DEFAULT 0,
-              delta_cost REAL NOT NULL DEFAULT 0,
-              expected_profit_delta REAL NOT NULL DEFAULT 0,
-              status TEXT NOT NULL DEFAULT 'pending',
-              applied_at TEXT,
-              updated_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS budget_plan_cost_runs (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              plan_id INTEGER NOT NULL,
-              item_id INTEGER NOT NULL,
-              date_iso TEXT NOT NULL,
-              channel TEXT NOT NULL,
-              prev_cost REAL NOT NULL DEFAULT 0,
-              new_cost REAL NOT NULL DEFAULT 0,
-              applied_at TEXT NOT NULL,
-              reverted_at TEXT
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS guardrail_incidents (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              fingerprint TEXT NOT NULL UNIQUE,
-              created_at TEXT NOT NULL,
-              updated_at TEXT NOT NULL,
-              severity TEXT NOT NULL,
-              incident_type TEXT NOT NULL,
-              channel TEXT NOT NULL DEFAULT '',
-              title TEXT NOT NULL,
-              details_json TEXT NOT NULL DEFAULT '{}',
-              status TEXT NOT NULL DEFAULT 'open',
-              acknowledged_at TEXT,
-              resolved_at TEXT
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS incident_tasks (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              incident_id INTEGER NOT NULL,
-              created_at TEXT NOT NULL,
-              updated_at TEXT NOT NULL,
-              due_at TEXT NOT NULL,
-              owner TEXT NOT NULL DEFAULT 'sales',
-              priority TEXT NOT NULL DEFAULT 'P2',
-              title TEXT NOT NULL,
-              action_type TEXT NOT NULL,
-              payload_json TEXT NOT NULL DEFAULT '{}',
-              status TEXT NOT NULL DEFAULT 'pending',
-              done_at TEXT,
-              overdue_since TEXT,
-              retry_count INTEGER NOT NULL DEFAULT 0,
-              reopen_count INTEGER NOT NULL DEFAULT 0,
-              last_sla_alert_bucket TEXT,
-              last_sla_alert_at TEXT
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS incident_task_audit (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              task_id INTEGER NOT NULL,
-              actor TEXT NOT NULL DEFAULT 'system',
-              action TEXT NOT NULL DEFAULT 'update',
-              change_json TEXT NOT NULL DEFAULT '{}',
-              created_at TEXT NOT NULL
-            )
-            """
-        )
-        _ensure_column(c, "incident_tasks", "priority", "TEXT NOT NULL DEFAULT 'P2'")
-        _ensure_column(c, "incident_tasks", "overdue_since", "TEXT")
-        _ensure_column(c, "incident_tasks", "retry_count", "INTEGER NOT NULL DEFAULT 0")
-        _ensure_column(c, "incident_tasks", "reopen_count", "INTEGER NOT NULL DEFAULT 0")
-        _ensure_column(c, "incident_tasks", "last_sla_alert_bucket", "TEXT")
-        _ensure_column(c, "incident_tasks", "last_sla_alert_at", "TEXT")
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS scenario_snapshots (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              created_at TEXT NOT NULL,
-              name TEXT NOT NULL,
-              days INTEGER NOT NULL,
-              history_days INTEGER NOT NULL,
-              horizon_days INTEGER NOT NULL,
-              target_revenue REAL NOT NULL DEFAULT 0,
-              budget_change_pct REAL NOT NULL DEFAULT 0,
-              conv_uplift_pct REAL NOT NULL DEFAULT 0,
-              spend_change_pct REAL NOT NULL DEFAULT 0,
-              include_test INTEGER NOT NULL DEFAULT 0,
-              include_spam INTEGER NOT NULL DEFAULT 0,
-              summary_json TEXT NOT NULL DEFAULT '{}'
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS execution_connectors (
-              channel TEXT PRIMARY KEY,
-              provider TEXT NOT NULL DEFAULT 'simulator',
-              mode TEXT NOT NULL DEFAULT 'simulate',
-              status TEXT NOT NULL DEFAULT 'enabled',
-              daily_change_limit_pct REAL NOT NULL DEFAULT 20,
-              last_sync_at TEXT,
-              last_result_json TEXT NOT NULL DEFAULT '{}',
-              updated_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS approvals (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              entity_type TEXT NOT NULL,
-              entity_id TEXT NOT NULL,
-              action TEXT NOT NULL,
-              payload_json TEXT NOT NULL DEFAULT '{}',
-              threshold_value REAL NOT NULL DEFAULT 0,
-              status TEXT NOT NULL DEFAULT 'pending',
-              requested_by TEXT NOT NULL DEFAULT 'system',
-              decided_by TEXT,
-              note TEXT NOT NULL DEFAULT '',
-              created_at TEXT NOT NULL,
-              decided_at TEXT
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS execution_runs (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              connector_channel TEXT NOT NULL,
-              plan_id INTEGER,
-              item_id INTEGER,
-              action TEXT NOT NULL,
-              status TEXT NOT NULL DEFAULT 'pending',
-              request_json TEXT NOT NULL DEFAULT '{}',
-              response_json TEXT NOT NULL DEFAULT '{}',
-              created_at TEXT NOT NULL,
-              finished_at TEXT
-            )
-            """
-        )
+
+def _migration_0001_baseline(c: sqlite3.Connection) -> None:
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+          id TEXT PRIMARY KEY,
+          status TEXT NOT NULL,
+          payload_json TEXT NOT NULL,
+          result_json TEXT,
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leads (
+          id TEXT PRIMARY KEY,
+          form_type TEXT NOT NULL,
+          payload_json TEXT NOT NULL,
+          source_path TEXT,
+          ip TEXT,
+          user_agent TEXT,
+          created_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_events (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          event_name TEXT NOT NULL,
+          label TEXT,
+          path TEXT,
+          href TEXT,
+          session_id TEXT,
+          consent_state TEXT,
+          payload_json TEXT,
+          source_ip TEXT,
+          user_agent TEXT,
+          created_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lead_meta (
+          lead_id TEXT PRIMARY KEY,
+          status TEXT NOT NULL DEFAULT 'new',
+          notes TEXT NOT NULL DEFAULT '',
+          follow_up_at TEXT,
+          updated_at TEXT NOT NULL,
+          booking_token TEXT,
+          booked_at TEXT,
+          booked_slot TEXT,
+          is_test INTEGER NOT NULL DEFAULT 0,
+          is_spam INTEGER NOT NULL DEFAULT 0,
+          spam_reason TEXT NOT NULL DEFAULT '',
+          last_contact_at TEXT,
+          lost_reason TEXT NOT NULL DEFAULT ''
+        )
+        """
+    )
+    _ensure_column(c, "lead_meta", "booking_token", "TEXT")
+    _ensure_column(c, "lead_meta", "booked_at", "TEXT")
+    _ensure_column(c, "lead_meta", "booked_slot", "TEXT")
+    _ensure_column(c, "lead_meta", "is_test", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(c, "lead_meta", "is_spam", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(c, "lead_meta", "spam_reason", "TEXT NOT NULL DEFAULT ''")
+    _ensure_column(c, "lead_meta", "last_contact_at", "TEXT")
+    _ensure_column(c, "lead_meta", "lost_reason", "TEXT NOT NULL DEFAULT ''")
+    _ensure_column(c, "lead_meta", "autopilot_priority", "TEXT NOT NULL DEFAULT 'P3'")
+    _ensure_column(c, "lead_meta", "autopilot_next_action", "TEXT NOT NULL DEFAULT 'review'")
+    _ensure_column(c, "lead_meta", "autopilot_next_action_due_at", "TEXT")
+    _ensure_column(c, "lead_meta", "autopilot_owner_queue", "TEXT NOT NULL DEFAULT 'sales'")
+    _ensure_column(c, "lead_meta", "autopilot_updated_at", "TEXT")
+    _ensure_column(c, "lead_meta", "deal_value", "REAL NOT NULL DEFAULT 0")
+    _ensure_column(c, "lead_meta", "win_probability", "REAL")
+    _ensure_column(c, "lead_meta", "win_recommendation", "TEXT")
+    _ensure_column(c, "lead_meta", "win_model_version", "TEXT")
+    _ensure_column(c, "lead_meta", "win_updated_at", "TEXT")
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS followup_templates (
+          step_hours INTEGER PRIMARY KEY,
+          subject_template TEXT NOT NULL,
+          body_template TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS followup_log (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          lead_id TEXT NOT NULL,
+          step_hours INTEGER NOT NULL,
+          to_email TEXT NOT NULL,
+          subject TEXT NOT NULL,
+          body TEXT NOT NULL,
+          status TEXT NOT NULL,
+          sent_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lead_sequence_tasks (
+          lead_id TEXT NOT NULL,
+          step_code TEXT NOT NULL,
+          due_at TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'pending',
+          done_at TEXT,
+          note TEXT NOT NULL DEFAULT '',
+          updated_at TEXT NOT NULL,
+          PRIMARY KEY (lead_id, step_code)
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_cost_daily (
+          date_iso TEXT NOT NULL,
+          channel TEXT NOT NULL,
+          cost REAL NOT NULL DEFAULT 0,
+          updated_at TEXT NOT NULL,
+          PRIMARY KEY (date_iso, channel)
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS budget_plans (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          created_at TEXT NOT NULL,
+          days INTEGER NOT NULL,
+          spend_change_pct REAL NOT NULL,
+          status TEXT NOT NULL DEFAULT 'proposed',
+          note TEXT NOT NULL DEFAULT ''
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS budget_plan_items (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          plan_id INTEGER NOT NULL,
+          channel TEXT NOT NULL,
+          action TEXT NOT NULL,
+          reason TEXT NOT NULL DEFAULT '',
+          current_cost REAL NOT NULL DEFAULT 0,
+          proposed_cost REAL NOT NULL DEFAULT 0,
+          delta_cost REAL NOT NULL DEFAULT 0,
+          expected_profit_delta REAL NOT NULL DEFAULT 0,
+          status TEXT NOT NULL DEFAULT 'pending',
+          applied_at TEXT,
+          updated_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS budget_plan_cost_runs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          plan_id INTEGER NOT NULL,
+          item_id INTEGER NOT NULL,
+          date_iso TEXT NOT NULL,
+          channel TEXT NOT NULL,
+          prev_cost REAL NOT NULL DEFAULT 0,
+          new_cost REAL NOT NULL DEFAULT 0,
+          applied_at TEXT NOT NULL,
+          reverted_at TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS guardrail_incidents (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          fingerprint TEXT NOT NULL UNIQUE,
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL,
+          severity TEXT NOT NULL,
+          incident_type TEXT NOT NULL,
+          channel TEXT NOT NULL DEFAULT '',
+          title TEXT NOT NULL,
+          details_json TEXT NOT NULL DEFAULT '{}',
+          status TEXT NOT NULL DEFAULT 'open',
+          acknowledged_at TEXT,
+          resolved_at TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS incident_tasks (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          incident_id INTEGER NOT NULL,
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL,
+          due_at TEXT NOT NULL,
+          owner TEXT NOT NULL DEFAULT 'sales',
+          priority TEXT NOT NULL DEFAULT 'P2',
+          title TEXT NOT NULL,
+          action_type TEXT NOT NULL,
+          payload_json TEXT NOT NULL DEFAULT '{}',
+          status TEXT NOT NULL DEFAULT 'pending',
+          done_at TEXT,
+          overdue_since TEXT,
+          retry_count INTEGER NOT NULL DEFAULT 0,
+          reopen_count INTEGER NOT NULL DEFAULT 0,
+          last_sla_alert_bucket TEXT,
+          last_sla_alert_at TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS incident_task_audit (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          task_id INTEGER NOT NULL,
+          actor TEXT NOT NULL DEFAULT 'system',
+          action TEXT NOT NULL DEFAULT 'update',
+          change_json TEXT NOT NULL DEFAULT '{}',
+          created_at TEXT NOT NULL
+        )
+        """
+    )
+    _ensure_column(c, "incident_tasks", "priority", "TEXT NOT NULL DEFAULT 'P2'")
+    _ensure_column(c, "incident_tasks", "overdue_since", "TEXT")
+    _ensure_column(c, "incident_tasks", "retry_count", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(c, "incident_tasks", "reopen_count", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(c, "incident_tasks", "last_sla_alert_bucket", "TEXT")
+    _ensure_column(c, "incident_tasks", "last_sla_alert_at", "TEXT")
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scenario_snapshots (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          created_at TEXT NOT NULL,
+          name TEXT NOT NULL,
+          days INTEGER NOT NULL,
+          history_days INTEGER NOT NULL,
+          horizon_days INTEGER NOT NULL,
+          target_revenue REAL NOT NULL DEFAULT 0,
+          budget_change_pct REAL NOT NULL DEFAULT 0,
+          conv_uplift_pct REAL NOT NULL DEFAULT 0,
+          spend_change_pct REAL NOT NULL DEFAULT 0,
+          include_test INTEGER NOT NULL DEFAULT 0,
+          include_spam INTEGER NOT NULL DEFAULT 0,
+          summary_json TEXT NOT NULL DEFAULT '{}'
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS execution_connectors (
+          channel TEXT PRIMARY KEY,
+          provider TEXT NOT NULL DEFAULT 'simulator',
+          mode TEXT NOT NULL DEFAULT 'simulate',
+          status TEXT NOT NULL DEFAULT 'enabled',
+          daily_change_limit_pct REAL NOT NULL DEFAULT 20,
+          last_sync_at TEXT,
+          last_result_json TEXT NOT NULL DEFAULT '{}',
+          updated_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS approvals (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          entity_type TEXT NOT NULL,
+          entity_id TEXT NOT NULL,
+          action TEXT NOT NULL,
+          payload_json TEXT NOT NULL DEFAULT '{}',
+          threshold_value REAL NOT NULL DEFAULT 0,
+          status TEXT NOT NULL DEFAULT 'pending',
+          requested_by TEXT NOT NULL DEFAULT 'system',
+          decided_by TEXT,
+          note TEXT NOT NULL DEFAULT '',
+          created_at TEXT NOT NULL,
+          decided_at TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS execution_runs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          connector_channel TEXT NOT NULL,
+          plan_id INTEGER,
+          item_id INTEGER,
+          action TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'pending',
+          request_json TEXT NOT NULL DEFAULT '{}',
+          response_json TEXT NOT NULL DEFAULT '{}',
+          created_at TEXT NOT NULL,
+          finished_at TEXT
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS experiments (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          name TEXT NOT NULL,
+          scope TEXT NOT NULL DEFAULT 'landing',
+          status TEXT NOT NULL DEFAULT 'draft',
+          metric_primary TEXT NOT NULL DEFAULT 'win_rate',
+          allocation_mode TEXT NOT NULL DEFAULT 'equal',
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS experiment_arms (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          experiment_id INTEGER NOT NULL,
+          arm_key TEXT NOT NULL,
+          label TEXT NOT NULL,
+          weight REAL NOT NULL DEFAULT 1,
+          config_json TEXT NOT NULL DEFAULT '{}',
+          UNIQUE(experiment_id, arm_key)
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS experiment_events (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          experiment_id INTEGER NOT NULL,
+          arm_key TEXT NOT NULL,
+          event_type TEXT NOT NULL,
+          value REAL NOT NULL DEFAULT 1,
+          session_id TEXT,
+          lead_id TEXT,
+          created_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS target_commits (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          period_start TEXT NOT NULL,
+          period_end TEXT NOT NULL,
+          target_revenue REAL NOT NULL,
+          owner TEXT NOT NULL DEFAULT 'ops',
+          status TEXT NOT NULL DEFAULT 'active',
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS target_daily_snapshots (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          commit_id INTEGER NOT NULL,
+          day_iso TEXT NOT NULL,
+          actual_revenue REAL NOT NULL DEFAULT 0,
+          expected_revenue REAL NOT NULL DEFAULT 0,
+          gap REAL NOT NULL DEFAULT 0,
+          risk_level TEXT NOT NULL DEFAULT 'low',
+          recommendations_json TEXT NOT NULL DEFAULT '[]',
+          created_at TEXT NOT NULL,
+          UNIQUE(commit_id, day_iso)
+        )
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS autonomous_run_log (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          run_type TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'ok',
+          summary_json TEXT NOT NULL DEFAULT '{}',
+          created_at TEXT NOT NULL
+        )
+        """
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_created_at ON analytics_events(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_name_created_at ON analytics_events(event_name, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_followup_log_lead_step ON followup_log(lead_id, step_hours)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_followup_log_sent_at ON followup_log(sent_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_status ON lead_meta(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_flags ON lead_meta(is_test, is_spam)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_booking_token ON lead_meta(booking_token)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_autopilot_due ON lead_meta(autopilot_next_action_due_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_autopilot_priority ON lead_meta(autopilot_priority)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_win_recommendation ON lead_meta(win_recommendation)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sequence_due_status ON lead_sequence_tasks(due_at, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_channel_cost_daily_date ON channel_cost_daily(date_iso)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_channel_cost_daily_channel ON channel_cost_daily(channel)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plans_created ON budget_plans(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plans_status ON budget_plans(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_items_plan ON budget_plan_items(plan_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_items_status ON budget_plan_items(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_runs_item ON budget_plan_cost_runs(item_id, reverted_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_runs_plan ON budget_plan_cost_runs(plan_id, applied_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_guardrail_status_updated ON guardrail_incidents(status, updated_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_guardrail_severity ON guardrail_incidents(severity)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_status_due ON incident_tasks(status, due_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_incident ON incident_tasks(incident_id, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_priority_status ON incident_tasks(priority, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_overdue_since ON incident_tasks(overdue_since)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_incident_task_audit_task_created ON incident_task_audit(task_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_scenario_snapshots_created ON scenario_snapshots(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_approvals_status_created ON approvals(status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_execution_runs_channel_created ON execution_runs(connector_channel, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_experiment_events_exp_arm ON experiment_events(experiment_id, arm_key, event_type)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_target_commits_status ON target_commits(status, period_start)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_target_snapshots_commit_day ON target_daily_snapshots(commit_id, day_iso)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_autonomous_run_log_type_created ON autonomous_run_log(run_type, created_at)")
+
+    # Default follow-up templates (editable from admin panel)
+    c.execute(
+        """
+        INSERT OR IGNORE INTO followup_templates (step_hours, subject_template, body_template, updated_at)
+        VALUES
+          (24, 'Follow-up po 24h - {{form_type}}', 'Czesc, wracam po 24h w sprawie Twojego formularza {{form_type}}. Daj znac, czy dzialamy dalej.', datetime('now')),
+          (72, 'Follow-up po 72h - {{form_type}}', 'Hej, to drugie przypomnienie po 72h. Jesli temat jest aktualny, odpisz i jedziemy dalej.', datetime('now'))
+        """
+    )
+    c.execute(
+        """
+        INSERT OR IGNORE INTO execution_connectors
+        (channel, provider, mode, status, daily_change_limit_pct, last_sync_at, last_result_json, updated_at)
+        VALUES
+          ('google_ads', 'simulator', 'simulate', 'enabled', 20, NULL, '{}', datetime('now')),
+          ('meta_ads', 'simulator', 'simulate', 'enabled', 20, NULL, '{}', datetime('now')),
+          ('linkedin', 'simulator', 'simulate', 'enabled', 15, NULL, '{}', datetime('now'))
+        """
+    )
+
+
+def _migration_0002_analytics_daily_rollup(c: sqlite3.Connection) -> None:
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_daily_rollup (
+          day TEXT NOT NULL,
+          event_name TEXT NOT NULL,
+          path TEXT NOT NULL,
+          label TEXT NOT NULL,
+          cnt INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (day, event_name, path, label)
+        )
+        """
+    )
+    c.execute(
+        f"""
+        INSERT INTO analytics_daily_rollup (day, event_name, path, label, cnt)
+        SELECT substr(created_at, 1, 10), event_name, COALESCE(path, ''), COALESCE(label, '{_NO_LABEL}'), COUNT(*)
+        FROM analytics_events
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+
+
+def lead_email(payload: Dict[str, Any]) -> str:
+    # Shared with app.py so the extracted leads.email column matches what the API reads.
+    fields = payload.get("fields") if isinstance(payload, dict) else {}
+    if not isinstance(fields, dict):
+        return ""
+    for key in ("email", "e-mail", "mail"):
+        val = fields.get(key)
+        if isinstance(val, str) and "@" in val:
+            return val.strip()
+    return ""
+
+
+def _lead_payload_columns(payload_json: str) -> Tuple[str, str, str, str, str, str]:
+    try:
+        payload = json.loads(payload_json or "{}")
+    except Exception:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    fields = payload.get("fields")
+    if not isinstance(fields, dict):
+        fields = {}
+    budget = fields.get("budzet") if isinstance(fields.get("budzet"), str) else ""
+    return (
+        lead_email(payload),
+        str(payload.get("utm_source") or "").strip(),
+        str(payload.get("utm_campaign") or "").strip(),
+        str(payload.get("session_id") or "").strip(),
+        str(payload.get("landing_path") or "").strip(),
+        budget.strip(),
+    )
+
+
+def _event_payload_columns(payload_json: str) -> Tuple[str, str, str, str]:
+    try:
+        payload = json.loads(payload_json or "{}")
+    except Exception:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    return (
+        str(payload.get("page_type") or ""),
+        str(payload.get("cta_area") or ""),
+        str(payload.get("cta_kind") or ""),
+        str(payload.get("form_name") or ""),
+    )
+
+
+def _migration_0003_extracted_payload_columns(c: sqlite3.Connection) -> None:
+    for col in ("email", "utm_source", "utm_campaign", "session_id", "landing_path", "budget"):
+        _ensure_column(c, "leads", col, "TEXT NOT NULL DEFAULT ''")
+    for col in ("page_type", "cta_area", "cta_kind", "form_name"):
+        _ensure_column(c, "analytics_events", col, "TEXT NOT NULL DEFAULT ''")
+
+    rows = c.execute("SELECT id, payload_json FROM leads").fetchall()
+    c.executemany(
+        """
+        UPDATE leads
+        SET email=?, utm_source=?, utm_campaign=?, session_id=?, landing_path=?, budget=?
+        WHERE id=?
+        """,
+        [(*_lead_payload_columns(r["payload_json"]), r["id"]) for r in rows],
+    )
+    rows = c.execute("SELECT id, payload_json FROM analytics_events").fetchall()
+    c.executemany(
+        "UPDATE analytics_events SET page_type=?, cta_area=?, cta_kind=?, form_name=? WHERE id=?",
+        [(*_event_payload_columns(r["payload_json"]), r["id"]) for r in rows],
+    )
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_email ON leads(email)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_utm_source_created ON leads(utm_source, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_utm_campaign_created ON leads(utm_campaign, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_session_id ON leads(session_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_session_created ON analytics_events(session_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_form_name_created ON analytics_events(form_name, created_at)")
+
+
+def _migration_0004_lead_meta_index_seeks(c: sqlite3.Connection) -> None:
+    # Lead filters compare lead_meta columns directly, so every lead needs its meta row.
+    c.execute(
+        """
+        INSERT OR IGNORE INTO lead_meta (lead_id, status, notes, follow_up_at, updated_at)
+        SELECT id, 'new', '', NULL, created_at FROM leads
+        """
+    )
+    # Flag-only and status-only indexes are superseded by the composite one below.
+    c.execute("DROP INDEX IF EXISTS idx_lead_meta_status")
+    c.execute("DROP INDEX IF EXISTS idx_lead_meta_flags")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_status_flags ON lead_meta(status, is_test, is_spam)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_follow_up ON lead_meta(follow_up_at) WHERE follow_up_at IS NOT NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leads_ip_created ON leads(ip, created_at)")
+
+
+def _migration_0005_export_order_indexes(c: sqlite3.Connection) -> None:
+    # Streaming exports walk each table in timestamp order without a sort step.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_updated_at ON lead_meta(updated_at)")
+
+
+# Numbered, append-only steps; each runs once and is recorded in schema_version.
+SQLITE_MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline", _migration_0001_baseline),
+    (2, "analytics_daily_rollup", _migration_0002_analytics_daily_rollup),
+    (3, "extracted_payload_columns", _migration_0003_extracted_payload_columns),
+    (4, "lead_meta_index_seeks", _migration_0004_lead_meta_index_seeks),
+    (5, "export_order_indexes", _migration_0005_export_order_indexes),
+]
+
+
+def _schema_version(c: sqlite3.Connection) -> int:
+    try:
+        row = c.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row["version"] or 0) if row else 0
+
+
+def init_db() -> int:
+    if _schema_version(conn()) >= SQLITE_MIGRATIONS[-1][0]:
+        return 0
+    applied = 0
+    with transaction() as c:
         c.execute(
             """
-            CREATE TABLE IF NOT EXISTS experiments (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INTEGER PRIMARY KEY,
               name TEXT NOT NULL,
-              scope TEXT NOT NULL DEFAULT 'landing',
-              status TEXT NOT NULL DEFAULT 'draft',
-              metric_primary TEXT NOT NULL DEFAULT 'win_rate',
-              allocation_mode TEXT NOT NULL DEFAULT 'equal',
-              created_at TEXT NOT NULL,
-              updated_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS experiment_arms (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              experiment_id INTEGER NOT NULL,
-              arm_key TEXT NOT NULL,
-              label TEXT NOT NULL,
-              weight REAL NOT NULL DEFAULT 1,
-              config_json TEXT NOT NULL DEFAULT '{}',
-              UNIQUE(experiment_id, arm_key)
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS experiment_events (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              experiment_id INTEGER NOT NULL,
-              arm_key TEXT NOT NULL,
-              event_type TEXT NOT NULL,
-              value REAL NOT NULL DEFAULT 1,
-              session_id TEXT,
-              lead_id TEXT,
-              created_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS target_commits (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              period_start TEXT NOT NULL,
-              period_end TEXT NOT NULL,
-              target_revenue REAL NOT NULL,
-              owner TEXT NOT NULL DEFAULT 'ops',
-              status TEXT NOT NULL DEFAULT 'active',
-              created_at TEXT NOT NULL,
-              updated_at TEXT NOT NULL
-            )
-            """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS target_daily_snapshots (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              commit_id INTEGER NOT NULL,
-              day_iso TEXT NOT NULL,
-              actual_revenue REAL NOT NULL DEFAULT 0,
-              expected_revenue REAL NOT NULL DEFAULT 0,
-              gap REAL NOT NULL DEFAULT 0,
-              risk_level TEXT NOT NULL DEFAULT 'low',
-              recommendations_json TEXT NOT NULL DEFAULT '[]',
-              created_at TEXT NOT NULL,
-              UNIQUE(commit_id, day_iso)
+              applied_at TEXT NOT NULL
             )
             """
         )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS autonomous_run_log (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              run_type TEXT NOT NULL,
-              status TEXT NOT NULL DEFAULT 'ok',
-              summary_json TEXT NOT NULL DEFAULT '{}',
-              created_at TEXT NOT NULL
+        current = _schema_version(c)
+        for version, name, step in SQLITE_MIGRATIONS:
+            if version <= current:
+                continue
+            step(c)
+            c.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, datetime('now'))",
+                (version, name),
             )
-            """
-        )
-        c.execute("CREATE INDEX IF NOT EXISTS idx_events_created_at ON analytics_events(created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_events_name_created_at ON analytics_events(event_name, created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads(created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_followup_log_lead_step ON followup_log(lead_id, step_hours)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_followup_log_sent_at ON followup_log(sent_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_status ON lead_meta(status)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_flags ON lead_meta(is_test, is_spam)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_booking_token ON lead_meta(booking_token)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_autopilot_due ON lead_meta(autopilot_next_action_due_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_autopilot_priority ON lead_meta(autopilot_priority)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lead_meta_win_recommendation ON lead_meta(win_recommendation)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_sequence_due_status ON lead_sequence_tasks(due_at, status)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_channel_cost_daily_date ON channel_cost_daily(date_iso)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_channel_cost_daily_channel ON channel_cost_daily(channel)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plans_created ON budget_plans(created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plans_status ON budget_plans(status)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_items_plan ON budget_plan_items(plan_id)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_items_status ON budget_plan_items(status)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_runs_item ON budget_plan_cost_runs(item_id, reverted_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_budget_plan_runs_plan ON budget_plan_cost_runs(plan_id, applied_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_guardrail_status_updated ON guardrail_incidents(status, updated_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_guardrail_severity ON guardrail_incidents(severity)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_status_due ON incident_tasks(status, due_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_incident ON incident_tasks(incident_id, status)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_priority_status ON incident_tasks(priority, status)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_incident_tasks_overdue_since ON incident_tasks(overdue_since)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_incident_task_audit_task_created ON incident_task_audit(task_id, created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_scenario_snapshots_created ON scenario_snapshots(created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_approvals_status_created ON approvals(status, created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_execution_runs_channel_created ON execution_runs(connector_channel, created_at)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_experiment_events_exp_arm ON experiment_events(experiment_id, arm_key, event_type)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_target_commits_status ON target_commits(status, period_start)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_target_snapshots_commit_day ON target_daily_snapshots(commit_id, day_iso)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_autonomous_run_log_type_created ON autonomous_run_log(run_type, created_at)")
-
-        # Default follow-up templates (editable from admin panel)
-        c.execute(
-            """
-            INSERT OR IGNORE INTO followup_templates (step_hours, subject_template, body_template, updated_at)
-            VALUES
-              (24, 'Follow-up po 24h - {{form_type}}', 'Czesc, wracam po 24h w sprawie Twojego formularza {{form_type}}. Daj znac, czy dzialamy dalej.', datetime('now')),
-              (72, 'Follow-up po 72h - {{form_type}}', 'Hej, to drugie przypomnienie po 72h. Jesli temat jest aktualny, odpisz i jedziemy dalej.', datetime('now'))
-            """
-        )
-        c.execute(
-            """
-            INSERT OR IGNORE INTO execution_connectors
-            (channel, provider, mode, status, daily_change_limit_pct, last_sync_at, last_result_json, updated_at)
-            VALUES
-              ('google_ads', 'simulator', 'simulate', 'enabled', 20, NULL, '{}', datetime('now')),
-              ('meta_ads', 'simulator', 'simulate', 'enabled', 20, NULL, '{}', datetime('now')),
-              ('linkedin', 'simulator', 'simulate', 'enabled', 15, NULL, '{}', datetime('now'))
-            """
-        )
-        c.commit()
+            applied += 1
+    return applied
 
 
-def insert_job(job_id: str, status: str, payload_json: str, now_iso: str) -> None:
-    with conn() as c:
+@_mutating
+def insert_job(job_id: str, status: str, payload_json: str, now_iso: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             "INSERT INTO jobs (id,status,payload_json,created_at,updated_at) VALUES (?,?,?,?,?)",
             (job_id, status, payload_json, now_iso, now_iso),
         )
-        c.commit()
 
 
-def update_job(job_id: str, status: str, result_json: Optional[str], now_iso: str) -> None:
-    with conn() as c:
+@_mutating
+def update_job(job_id: str, status: str, result_json: Optional[str], now_iso: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             "UPDATE jobs SET status=?, result_json=?, updated_at=? WHERE id=?",
             (status, result_json, now_iso, job_id),
         )
-        c.commit()
 
 
-def get_job(job_id: str) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_job(job_id: str, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
         return dict(row) if row else None
 
 
-def list_jobs(limit: int = 30) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_jobs(limit: int = 30, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?",
             (limit,),
@@ -496,6 +930,7 @@ def list_jobs(limit: int = 30) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
+@_mutating
 def insert_lead(
     lead_id: str,
     form_type: str,
@@ -504,14 +939,17 @@ def insert_lead(
     ip: str,
     user_agent: str,
     created_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
-            INSERT INTO leads (id, form_type, payload_json, source_path, ip, user_agent, created_at)
-            VALUES (?,?,?,?,?,?,?)
+            INSERT INTO leads
+            (id, form_type, payload_json, source_path, ip, user_agent, created_at,
+             email, utm_source, utm_campaign, session_id, landing_path, budget)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
             """,
-            (lead_id, form_type, payload_json, source_path, ip, user_agent, created_at),
+            (lead_id, form_type, payload_json, source_path, ip, user_agent, created_at, *_lead_payload_columns(payload_json)),
         )
         c.execute(
             """
@@ -520,11 +958,11 @@ def insert_lead(
             """,
             (lead_id, created_at),
         )
-        c.commit()
 
 
-def upsert_lead_meta(lead_id: str, status: str, notes: str, follow_up_at: Optional[str], updated_at: str) -> None:
-    with conn() as c:
+@_mutating
+def upsert_lead_meta(lead_id: str, status: str, notes: str, follow_up_at: Optional[str], updated_at: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO lead_meta (lead_id, status, notes, follow_up_at, updated_at)
@@ -537,12 +975,12 @@ def upsert_lead_meta(lead_id: str, status: str, notes: str, follow_up_at: Option
             """,
             (lead_id, status, notes, follow_up_at, updated_at),
         )
-        c.commit()
 
 
-def upsert_lead_value(lead_id: str, deal_value: float, updated_at: str) -> None:
+@_mutating
+def upsert_lead_value(lead_id: str, deal_value: float, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> None:
     safe_value = float(deal_value if deal_value is not None else 0.0)
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO lead_meta (lead_id, status, notes, follow_up_at, updated_at, deal_value)
@@ -553,9 +991,23 @@ def upsert_lead_value(lead_id: str, deal_value: float, updated_at: str) -> None:
             """,
             (lead_id, updated_at, safe_value),
         )
-        c.commit()
 
 
+_UPSERT_LEAD_AUTOPILOT_SQL = """
+    INSERT INTO lead_meta
+    (lead_id, status, notes, follow_up_at, updated_at, autopilot_priority, autopilot_next_action, autopilot_next_action_due_at, autopilot_owner_queue, autopilot_updated_at)
+    VALUES (?, 'new', '', NULL, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(lead_id) DO UPDATE SET
+      autopilot_priority=excluded.autopilot_priority,
+      autopilot_next_action=excluded.autopilot_next_action,
+      autopilot_next_action_due_at=excluded.autopilot_next_action_due_at,
+      autopilot_owner_queue=excluded.autopilot_owner_queue,
+      autopilot_updated_at=excluded.autopilot_updated_at,
+      updated_at=excluded.updated_at
+"""
+
+
+@_mutating
 def upsert_lead_autopilot(
     lead_id: str,
     priority: str,
@@ -563,51 +1015,77 @@ def upsert_lead_autopilot(
     next_action_due_at: Optional[str],
     owner_queue: str,
     updated_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
-            """
-            INSERT INTO lead_meta
-            (lead_id, status, notes, follow_up_at, updated_at, autopilot_priority, autopilot_next_action, autopilot_next_action_due_at, autopilot_owner_queue, autopilot_updated_at)
-            VALUES (?, 'new', '', NULL, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(lead_id) DO UPDATE SET
-              autopilot_priority=excluded.autopilot_priority,
-              autopilot_next_action=excluded.autopilot_next_action,
-              autopilot_next_action_due_at=excluded.autopilot_next_action_due_at,
-              autopilot_owner_queue=excluded.autopilot_owner_queue,
-              autopilot_updated_at=excluded.autopilot_updated_at,
-              updated_at=excluded.updated_at
-            """,
+            _UPSERT_LEAD_AUTOPILOT_SQL,
             (lead_id, updated_at, priority, next_action, next_action_due_at, owner_queue, updated_at),
         )
-        c.commit()
 
 
+@_mutating
+def upsert_lead_autopilot_many(
+    rows: List[Tuple[str, str, str, Optional[str], str, str]],
+    tx: Optional[sqlite3.Connection] = None,
+) -> int:
+    # rows: (lead_id, priority, next_action, next_action_due_at, owner_queue, updated_at)
+    if not rows:
+        return 0
+    with _session(tx) as c:
+        c.executemany(
+            _UPSERT_LEAD_AUTOPILOT_SQL,
+            [(lead_id, updated_at, priority, action, due_at, queue_name, updated_at) for lead_id, priority, action, due_at, queue_name, updated_at in rows],
+        )
+    return len(rows)
+
+
+_UPSERT_LEAD_WIN_MODEL_SQL = """
+    INSERT INTO lead_meta
+    (lead_id, status, notes, follow_up_at, updated_at, win_probability, win_recommendation, win_model_version, win_updated_at)
+    VALUES (?, 'new', '', NULL, ?, ?, ?, ?, ?)
+    ON CONFLICT(lead_id) DO UPDATE SET
+      win_probability=excluded.win_probability,
+      win_recommendation=excluded.win_recommendation,
+      win_model_version=excluded.win_model_version,
+      win_updated_at=excluded.win_updated_at,
+      updated_at=excluded.updated_at
+"""
+
+
+@_mutating
 def upsert_lead_win_model(
     lead_id: str,
     win_probability: Optional[float],
     win_recommendation: Optional[str],
     win_model_version: Optional[str],
     updated_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
-            """
-            INSERT INTO lead_meta
-            (lead_id, status, notes, follow_up_at, updated_at, win_probability, win_recommendation, win_model_version, win_updated_at)
-            VALUES (?, 'new', '', NULL, ?, ?, ?, ?, ?)
-            ON CONFLICT(lead_id) DO UPDATE SET
-              win_probability=excluded.win_probability,
-              win_recommendation=excluded.win_recommendation,
-              win_model_version=excluded.win_model_version,
-              win_updated_at=excluded.win_updated_at,
-              updated_at=excluded.updated_at
-            """,
+            _UPSERT_LEAD_WIN_MODEL_SQL,
             (lead_id, updated_at, win_probability, win_recommendation, win_model_version, updated_at),
         )
-        c.commit()
 
 
+@_mutating
+def upsert_lead_win_model_many(
+    rows: List[Tuple[str, Optional[float], Optional[str], Optional[str], str]],
+    tx: Optional[sqlite3.Connection] = None,
+) -> int:
+    # rows: (lead_id, win_probability, win_recommendation, win_model_version, updated_at)
+    if not rows:
+        return 0
+    with _session(tx) as c:
+        c.executemany(
+            _UPSERT_LEAD_WIN_MODEL_SQL,
+            [(lead_id, updated_at, prob, rec, version, updated_at) for lead_id, prob, rec, version, updated_at in rows],
+        )
+    return len(rows)
+
+
+@_mutating
 def upsert_lead_enrichment(
     lead_id: str,
     booking_token: Optional[str],
@@ -615,8 +1093,9 @@ def upsert_lead_enrichment(
     is_spam: bool,
     spam_reason: str,
     updated_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO lead_meta (lead_id, status, notes, follow_up_at, updated_at, booking_token, is_test, is_spam, spam_reason)
@@ -630,11 +1109,10 @@ def upsert_lead_enrichment(
             """,
             (lead_id, updated_at, booking_token, 1 if is_test else 0, 1 if is_spam else 0, spam_reason),
         )
-        c.commit()
 
 
-def booking_target(lead_id: str, booking_token: str) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def booking_target(lead_id: str, booking_token: str, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT
@@ -647,15 +1125,16 @@ def booking_target(lead_id: str, booking_token: str) -> Optional[Dict[str, Any]]
               COALESCE(m.is_spam, 0) AS is_spam
             FROM leads l
             JOIN lead_meta m ON m.lead_id = l.id
-            WHERE l.id = ? AND COALESCE(m.booking_token, '') = ?
+            WHERE l.id = ? AND m.booking_token = ?
             """,
             (lead_id, booking_token),
         ).fetchone()
         return dict(row) if row else None
 
 
-def confirm_lead_booking(lead_id: str, booked_slot: str, updated_at: str) -> None:
-    with conn() as c:
+@_mutating
+def confirm_lead_booking(lead_id: str, booked_slot: str, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             """
             UPDATE lead_meta
@@ -668,9 +1147,9 @@ def confirm_lead_booking(lead_id: str, booked_slot: str, updated_at: str) -> Non
             """,
             (updated_at, booked_slot, updated_at, lead_id),
         )
-        c.commit()
 
 
+@_mutating
 def touch_lead_action(
     lead_id: str,
     status: str,
@@ -679,8 +1158,9 @@ def touch_lead_action(
     last_contact_at: Optional[str],
     lost_reason: str,
     updated_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO lead_meta
@@ -696,11 +1176,10 @@ def touch_lead_action(
             """,
             (lead_id, status, notes, follow_up_at, updated_at, last_contact_at, lost_reason),
         )
-        c.commit()
 
 
-def count_recent_leads_by_ip(ip: str, since_iso: str) -> int:
-    with conn() as c:
+def count_recent_leads_by_ip(ip: str, since_iso: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         row = c.execute(
             "SELECT COUNT(*) AS cnt FROM leads WHERE ip = ? AND created_at >= ?",
             (ip, since_iso),
@@ -708,39 +1187,122 @@ def count_recent_leads_by_ip(ip: str, since_iso: str) -> int:
         return int(row["cnt"] if row else 0)
 
 
-def insert_analytics_events(rows: List[Tuple[str, str, str, str, str, str, str, str, str, str]]) -> int:
+def _rollup_day_counts(rows: List[Tuple[str, str, str, str, str, str, str, str, str, str]]) -> List[Tuple[str, str, str, str, int]]:
+    counts: Dict[Tuple[str, str, str, str], int] = {}
+    for r in rows:
+        key = (str(r[9] or "")[:10], r[0], r[2] or "", _NO_LABEL if r[1] is None else r[1])
+        counts[key] = counts.get(key, 0) + 1
+    return [(day, name, path, label, cnt) for (day, name, path, label), cnt in counts.items()]
+
+
+@_mutating
+def insert_analytics_events(rows: List[Tuple[str, str, str, str, str, str, str, str, str, str]], tx: Optional[sqlite3.Connection] = None) -> int:
     if not rows:
         return 0
-    with conn() as c:
+    with _session(tx) as c:
         c.executemany(
             """
             INSERT INTO analytics_events
-            (event_name, label, path, href, session_id, consent_state, payload_json, source_ip, user_agent, created_at)
-            VALUES (?,?,?,?,?,?,?,?,?,?)
+            (event_name, label, path, href, session_id, consent_state, payload_json, source_ip, user_agent, created_at,
+             page_type, cta_area, cta_kind, form_name)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
             """,
-            rows,
+            [(*r, *_event_payload_columns(r[6])) for r in rows],
+        )
+        c.executemany(
+            """
+            INSERT INTO analytics_daily_rollup (day, event_name, path, label, cnt)
+            VALUES (?,?,?,?,?)
+            ON CONFLICT(day, event_name, path, label) DO UPDATE SET cnt = cnt + excluded.cnt
+            """,
+            _rollup_day_counts(rows),
         )
-        c.commit()
     return len(rows)
 
 
-def count_events_between(start_iso: str, end_iso: str, event_name: Optional[str] = None) -> int:
-    with conn() as c:
-        if event_name:
-            row = c.execute(
-                "SELECT COUNT(*) AS cnt FROM analytics_events WHERE created_at >= ? AND created_at < ? AND event_name = ?",
-                (start_iso, end_iso, event_name),
-            ).fetchone()
-        else:
-            row = c.execute(
-                "SELECT COUNT(*) AS cnt FROM analytics_events WHERE created_at >= ? AND created_at < ?",
-                (start_iso, end_iso),
-            ).fetchone()
+# Rollups are keyed by the created_at date prefix, so a window is split into
+# whole days (summed from analytics_daily_rollup) and raw edge ranges.
+_DAY_BOUNDARY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}(T00:00:00(\.0+)?)?(Z|[+-]00:00)?$")
+
+
+def _rollup_windows(start_iso: str, end_iso: str) -> Tuple[List[Tuple[str, str]], Optional[Tuple[str, str]]]:
+    try:
+        first = date.fromisoformat(start_iso[:10])
+        last = date.fromisoformat(end_iso[:10])
+    except ValueError:
+        return [(start_iso, end_iso)], None
+    start_aligned = bool(_DAY_BOUNDARY_RE.match(start_iso))
+    end_aligned = bool(_DAY_BOUNDARY_RE.match(end_iso))
+    if not start_aligned:
+        first += timedelta(days=1)
+    if first >= last:
+        if not end_aligned and start_iso[:10] < last.isoformat():
+            # Two partial days: split at midnight so each raw range stays within one day.
+            return [(start_iso, last.isoformat()), (last.isoformat(), end_iso)], None
+        return [(start_iso, end_iso)], None
+    raw: List[Tuple[str, str]] = []
+    if not start_aligned:
+        raw.append((start_iso, first.isoformat()))
+    if not end_aligned:
+        raw.append((last.isoformat(), end_iso))
+    return raw, (first.isoformat(), last.isoformat())
+
+
+def _event_counts_sql(start_iso: str, end_iso: str, where: str = "", args: Tuple[Any, ...] = ()) -> Tuple[str, List[Any]]:
+    raw, days = _rollup_windows(start_iso, end_iso)
+    parts: List[str] = []
+    params: List[Any] = []
+    for lo, hi in raw:
+        parts.append(
+            """
+            SELECT event_name, COALESCE(path, '') AS path, COALESCE(label, '(no-label)') AS label, COUNT(*) AS cnt
+            FROM analytics_events
+            WHERE created_at >= ? AND created_at < ?"""
+            + where
+            + """
+            GROUP BY 1, 2, 3
+            """
+        )
+        params.extend([lo, hi, *args])
+        try:
+            day = date.fromisoformat(lo[:10])
+        except ValueError:
+            continue
+        # Archiving moves whole days out of the hot table; an edge on such a day snaps to its
+        # full rollup row, so it may count events outside the requested hours.
+        parts.append(
+            """
+            SELECT event_name, path, label, cnt
+            FROM analytics_daily_rollup
+            WHERE day = ?
+              AND NOT EXISTS (SELECT 1 FROM analytics_events WHERE created_at >= ? AND created_at < ?)"""
+            + where
+        )
+        params.extend([day.isoformat(), day.isoformat(), (day + timedelta(days=1)).isoformat(), *args])
+    if days:
+        parts.append(
+            """
+            SELECT event_name, path, label, cnt
+            FROM analytics_daily_rollup
+            WHERE day >= ? AND day < ?"""
+            + where
+        )
+        params.extend([days[0], days[1], *args])
+    return " UNION ALL ".join(parts), params
+
+
+def count_events_between(start_iso: str, end_iso: str, event_name: Optional[str] = None, tx: Optional[sqlite3.Connection] = None) -> int:
+    if event_name:
+        src, params = _event_counts_sql(start_iso, end_iso, " AND event_name = ?", (event_name,))
+    else:
+        src, params = _event_counts_sql(start_iso, end_iso)
+    with _session(tx) as c:
+        row = c.execute(f"SELECT COALESCE(SUM(cnt), 0) AS cnt FROM ({src})", params).fetchone()
         return int(row["cnt"] if row else 0)
 
 
-def count_leads_between(start_iso: str, end_iso: str) -> int:
-    with conn() as c:
+def count_leads_between(start_iso: str, end_iso: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         row = c.execute(
             "SELECT COUNT(*) AS cnt FROM leads WHERE created_at >= ? AND created_at < ?",
             (start_iso, end_iso),
@@ -748,37 +1310,26 @@ def count_leads_between(start_iso: str, end_iso: str) -> int:
         return int(row["cnt"] if row else 0)
 
 
-def count_form_submit_between(start_iso: str, end_iso: str) -> int:
-    with conn() as c:
-        row = c.execute(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM analytics_events
-            WHERE created_at >= ? AND created_at < ?
-              AND event_name = 'form_submit'
-            """,
-            (start_iso, end_iso),
-        ).fetchone()
-        return int(row["cnt"] if row else 0)
+def count_form_submit_between(start_iso: str, end_iso: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    return count_events_between(start_iso, end_iso, "form_submit", tx=tx)
 
 
-def count_form_submit_by_form_between(start_iso: str, end_iso: str) -> Dict[str, int]:
-    with conn() as c:
+def count_form_submit_by_form_between(start_iso: str, end_iso: str, tx: Optional[sqlite3.Connection] = None) -> Dict[str, int]:
+    src, params = _event_counts_sql(start_iso, end_iso, " AND event_name = 'form_submit'")
+    with _session(tx) as c:
         rows = c.execute(
-            """
+            f"""
             SELECT
               CASE
                 WHEN LOWER(label) LIKE '%audyt%' THEN 'audyt'
                 WHEN LOWER(label) LIKE '%kontakt%' THEN 'kontakt'
                 ELSE 'other'
               END AS form_type,
-              COUNT(*) AS cnt
-            FROM analytics_events
-            WHERE created_at >= ? AND created_at < ?
-              AND event_name = 'form_submit'
+              SUM(cnt) AS cnt
+            FROM ({src})
             GROUP BY form_type
             """,
-            (start_iso, end_iso),
+            params,
         ).fetchall()
         out: Dict[str, int] = {"audyt": 0, "kontakt": 0, "other": 0}
         for r in rows:
@@ -786,34 +1337,26 @@ def count_form_submit_by_form_between(start_iso: str, end_iso: str) -> Dict[str,
         return out
 
 
-def top_cta_labels_between(start_iso: str, end_iso: str, limit: int = 8) -> List[Dict[str, Any]]:
-    with conn() as c:
+def top_cta_labels_between(start_iso: str, end_iso: str, limit: int = 8, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    src, params = _event_counts_sql(start_iso, end_iso, " AND event_name = 'cta_click'")
+    with _session(tx) as c:
         rows = c.execute(
-            """
-            SELECT COALESCE(label, '(no-label)') AS label, COUNT(*) AS cnt
-            FROM analytics_events
-            WHERE created_at >= ? AND created_at < ? AND event_name = 'cta_click'
-            GROUP BY COALESCE(label, '(no-label)')
+            f"""
+            SELECT label, SUM(cnt) AS cnt
+            FROM ({src})
+            GROUP BY label
             ORDER BY cnt DESC
             LIMIT ?
             """,
-            (start_iso, end_iso, limit),
+            (*params, limit),
         ).fetchall()
         return [dict(r) for r in rows]
 
 
-def funnel_count_between(start_iso: str, end_iso: str, path: str) -> int:
-    with conn() as c:
-        row = c.execute(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM analytics_events
-            WHERE created_at >= ? AND created_at < ?
-              AND event_name = 'page_view'
-              AND path = ?
-            """,
-            (start_iso, end_iso, path),
-        ).fetchone()
+def funnel_count_between(start_iso: str, end_iso: str, path: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    src, params = _event_counts_sql(start_iso, end_iso, " AND event_name = 'page_view' AND path = ?", (path,))
+    with _session(tx) as c:
+        row = c.execute(f"SELECT COALESCE(SUM(cnt), 0) AS cnt FROM ({src})", params).fetchone()
         return int(row["cnt"] if row else 0)
 
 
@@ -823,6 +1366,7 @@ def list_recent_leads(
     status: str = "",
     include_test: bool = True,
     include_spam: bool = True,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> List[Dict[str, Any]]:
     sql = """
         SELECT
@@ -858,25 +1402,26 @@ def list_recent_leads(
         sql += " AND l.form_type = ?"
         args.append(form_type)
     if status:
-        sql += " AND COALESCE(m.status, 'new') = ?"
+        sql += " AND m.status = ?"
         args.append(status)
     if not include_test:
-        sql += " AND COALESCE(m.is_test, 0) = 0"
+        sql += " AND m.is_test = 0"
     if not include_spam:
-        sql += " AND COALESCE(m.is_spam, 0) = 0"
+        sql += " AND m.is_spam = 0"
     sql += " ORDER BY l.created_at DESC LIMIT ?"
     args.append(limit)
 
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
 def list_leads_for_backfill(
     limit: int = 1000,
-    offset: int = 0,
+    after_id: str = "",
     include_test: bool = True,
     include_spam: bool = True,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> List[Dict[str, Any]]:
     sql = """
         SELECT
@@ -905,22 +1450,22 @@ def list_leads_for_backfill(
           COALESCE(m.deal_value, 0) AS deal_value
         FROM leads l
         LEFT JOIN lead_meta m ON m.lead_id = l.id
-        WHERE 1=1
+        WHERE l.id > ?
     """
-    args: List[Any] = []
+    args: List[Any] = [after_id or ""]
     if not include_test:
-        sql += " AND COALESCE(m.is_test, 0) = 0"
+        sql += " AND m.is_test = 0"
     if not include_spam:
-        sql += " AND COALESCE(m.is_spam, 0) = 0"
-    sql += " ORDER BY l.created_at ASC LIMIT ? OFFSET ?"
-    args.extend([int(limit), int(offset)])
-    with conn() as c:
+        sql += " AND m.is_spam = 0"
+    sql += " ORDER BY l.id ASC LIMIT ?"
+    args.append(int(limit))
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def count_leads_by_form_between(start_iso: str, end_iso: str) -> List[Dict[str, Any]]:
-    with conn() as c:
+def count_leads_by_form_between(start_iso: str, end_iso: str, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT form_type, COUNT(*) AS cnt
@@ -934,7 +1479,7 @@ def count_leads_by_form_between(start_iso: str, end_iso: str) -> List[Dict[str,
         return [dict(r) for r in rows]
 
 
-def count_leads_by_status_between(start_iso: str, end_iso: str, include_test: bool = True, include_spam: bool = True) -> List[Dict[str, Any]]:
+def count_leads_by_status_between(start_iso: str, end_iso: str, include_test: bool = True, include_spam: bool = True, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT COALESCE(m.status, 'new') AS status, COUNT(*) AS cnt
         FROM leads l
@@ -943,20 +1488,21 @@ def count_leads_by_status_between(start_iso: str, end_iso: str, include_test: bo
     """
     args: List[Any] = [start_iso, end_iso]
     if not include_test:
-        sql += " AND COALESCE(m.is_test, 0) = 0"
+        sql += " AND m.is_test = 0"
     if not include_spam:
-        sql += " AND COALESCE(m.is_spam, 0) = 0"
+        sql += " AND m.is_spam = 0"
     sql += " GROUP BY COALESCE(m.status, 'new') ORDER BY cnt DESC"
 
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def list_leads_between(start_iso: str, end_iso: str, limit: int = 5000, include_test: bool = True, include_spam: bool = True) -> List[Dict[str, Any]]:
+def list_leads_between(start_iso: str, end_iso: str, limit: int = 5000, include_test: bool = True, include_spam: bool = True, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT
           l.id, l.form_type, l.payload_json, l.source_path, l.ip, l.created_at,
+          l.email, l.utm_source, l.utm_campaign, l.session_id, l.landing_path, l.budget,
           COALESCE(m.status, 'new') AS lead_status,
           COALESCE(m.notes, '') AS lead_notes,
           m.follow_up_at AS lead_follow_up_at,
@@ -983,35 +1529,35 @@ def list_leads_between(start_iso: str, end_iso: str, limit: int = 5000, include_
     """
     args: List[Any] = [start_iso, end_iso]
     if not include_test:
-        sql += " AND COALESCE(m.is_test, 0) = 0"
+        sql += " AND m.is_test = 0"
     if not include_spam:
-        sql += " AND COALESCE(m.is_spam, 0) = 0"
+        sql += " AND m.is_spam = 0"
     sql += " ORDER BY l.created_at DESC LIMIT ?"
     args.append(limit)
 
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def top_events_between(start_iso: str, end_iso: str, limit: int = 20) -> List[Dict[str, Any]]:
-    with conn() as c:
+def top_events_between(start_iso: str, end_iso: str, limit: int = 20, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    src, params = _event_counts_sql(start_iso, end_iso)
+    with _session(tx) as c:
         rows = c.execute(
-            """
-            SELECT event_name, COUNT(*) AS cnt
-            FROM analytics_events
-            WHERE created_at >= ? AND created_at < ?
+            f"""
+            SELECT event_name, SUM(cnt) AS cnt
+            FROM ({src})
             GROUP BY event_name
             ORDER BY cnt DESC
             LIMIT ?
             """,
-            (start_iso, end_iso, limit),
+            (*params, limit),
         ).fetchall()
         return [dict(r) for r in rows]
 
 
-def list_recent_events(limit: int = 60) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_recent_events(limit: int = 60, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT event_name, label, path, href, session_id, consent_state, created_at
@@ -1024,8 +1570,8 @@ def list_recent_events(limit: int = 60) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def list_followup_templates() -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_followup_templates(tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT step_hours, subject_template, body_template, updated_at
@@ -1036,8 +1582,9 @@ def list_followup_templates() -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def upsert_followup_template(step_hours: int, subject_template: str, body_template: str, updated_at: str) -> None:
-    with conn() as c:
+@_mutating
+def upsert_followup_template(step_hours: int, subject_template: str, body_template: str, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO followup_templates (step_hours, subject_template, body_template, updated_at)
@@ -1049,11 +1596,10 @@ def upsert_followup_template(step_hours: int, subject_template: str, body_templa
             """,
             (step_hours, subject_template, body_template, updated_at),
         )
-        c.commit()
 
 
-def list_due_followup_candidates(step_hours: int, older_than_iso: str, limit: int = 200) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_due_followup_candidates(step_hours: int, older_than_iso: str, limit: int = 200, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT
@@ -1064,9 +1610,9 @@ def list_due_followup_candidates(step_hours: int, older_than_iso: str, limit: in
             FROM leads l
             LEFT JOIN lead_meta m ON m.lead_id = l.id
             WHERE l.created_at <= ?
-              AND COALESCE(m.status, 'new') NOT IN ('won', 'lost')
-              AND COALESCE(m.is_test, 0) = 0
-              AND COALESCE(m.is_spam, 0) = 0
+              AND m.status NOT IN ('won', 'lost')
+              AND m.is_test = 0
+              AND m.is_spam = 0
               AND NOT EXISTS (
                 SELECT 1
                 FROM followup_log fl
@@ -1080,6 +1626,7 @@ def list_due_followup_candidates(step_hours: int, older_than_iso: str, limit: in
         return [dict(r) for r in rows]
 
 
+@_mutating
 def insert_followup_log(
     lead_id: str,
     step_hours: int,
@@ -1088,8 +1635,9 @@ def insert_followup_log(
     body: str,
     status: str,
     sent_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO followup_log (lead_id, step_hours, to_email, subject, body, status, sent_at)
@@ -1097,11 +1645,10 @@ def insert_followup_log(
             """,
             (lead_id, step_hours, to_email, subject, body, status, sent_at),
         )
-        c.commit()
 
 
-def list_followup_logs(limit: int = 100) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_followup_logs(limit: int = 100, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, lead_id, step_hours, to_email, subject, status, sent_at
@@ -1114,8 +1661,8 @@ def list_followup_logs(limit: int = 100) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def list_due_followups(now_iso: str, limit: int = 200) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_due_followups(now_iso: str, limit: int = 200, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT
@@ -1127,9 +1674,9 @@ def list_due_followups(now_iso: str, limit: int = 200) -> List[Dict[str, Any]]:
             JOIN lead_meta m ON m.lead_id = l.id
             WHERE m.follow_up_at IS NOT NULL
               AND m.follow_up_at <= ?
-              AND COALESCE(m.status, 'new') NOT IN ('won', 'lost')
-              AND COALESCE(m.is_test, 0) = 0
-              AND COALESCE(m.is_spam, 0) = 0
+              AND m.status NOT IN ('won', 'lost')
+              AND m.is_test = 0
+              AND m.is_spam = 0
             ORDER BY m.follow_up_at ASC
             LIMIT ?
             """,
@@ -1139,9 +1686,10 @@ def list_due_followups(now_iso: str, limit: int = 200) -> List[Dict[str, Any]]:
 
 
 
-def list_analytics_events_between(start_iso: str, end_iso: str, event_name: str = "", limit: int = 12000) -> List[Dict[str, Any]]:
+def list_analytics_events_between(start_iso: str, end_iso: str, event_name: str = "", limit: int = 12000, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
-        SELECT event_name, label, path, href, session_id, consent_state, payload_json, source_ip, user_agent, created_at
+        SELECT event_name, label, path, href, session_id, consent_state, payload_json, source_ip, user_agent, created_at,
+          page_type, cta_area, cta_kind, form_name
         FROM analytics_events
         WHERE created_at >= ? AND created_at < ?
     """
@@ -1152,13 +1700,152 @@ def list_analytics_events_between(start_iso: str, end_iso: str, event_name: str
     sql += " ORDER BY created_at ASC LIMIT ?"
     args.append(limit)
 
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def get_lead_by_id(lead_id: str) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def _analytics_archive_dir() -> Path:
+    raw = (os.getenv("ANALYTICS_ARCHIVE_DIR") or "").strip()
+    return Path(raw) if raw else Path(DB_PATH).parent / "analytics_archive"
+
+
+def _analytics_archive_path(month: str) -> Path:
+    return _analytics_archive_dir() / f"analytics-{month}.sqlite3"
+
+
+def _ensure_archive_table(c: sqlite3.Connection) -> List[str]:
+    cols = c.execute("PRAGMA main.table_info(analytics_events)").fetchall()
+    names = [str(r["name"]) for r in cols]
+    ddl = ", ".join(
+        f"{r['name']} {r['type'] or ''} PRIMARY KEY" if r["name"] == "id" else f"{r['name']} {r['type'] or ''}" for r in cols
+    )
+    c.execute(f"CREATE TABLE IF NOT EXISTS archive.analytics_events ({ddl})")
+    archived = {str(r["name"]) for r in c.execute("PRAGMA archive.table_info(analytics_events)").fetchall()}
+    for r in cols:
+        if r["name"] not in archived:
+            c.execute(f"ALTER TABLE archive.analytics_events ADD COLUMN {r['name']} {r['type'] or ''}")
+    c.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_events_created_at ON analytics_events(created_at)")
+    return names
+
+
+def archive_analytics_events(before_day: str) -> Dict[str, Any]:
+    # Moves whole days older than before_day into per-month archive files. Rollups stay in the
+    # hot DB, so reports over archived days keep working; partial-day report windows over an
+    # archived day are counted from that day's whole rollup row.
+    cutoff = date.fromisoformat(before_day[:10])
+    archive_dir = _analytics_archive_dir()
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    moved = 0
+    months: Dict[str, int] = {}
+    c = _open_connection(str(DB_PATH))
+    try:
+        days: List[date] = []
+        for r in c.execute(
+            "SELECT DISTINCT substr(created_at, 1, 10) AS day FROM analytics_events WHERE created_at < ? ORDER BY day",
+            (cutoff.isoformat(),),
+        ).fetchall():
+            try:
+                days.append(date.fromisoformat(str(r["day"])))
+            except ValueError:
+                continue
+        by_month: Dict[str, List[date]] = {}
+        for d in days:
+            by_month.setdefault(d.isoformat()[:7], []).append(d)
+
+        for month, month_days in by_month.items():
+            c.execute("ATTACH DATABASE ? AS archive", (str(_analytics_archive_path(month)),))
+            try:
+                cols = ", ".join(_ensure_archive_table(c))
+                for d in month_days:
+                    window = (d.isoformat(), (d + timedelta(days=1)).isoformat())
+                    # Copy and delete commit separately (WAL gives no cross-file atomicity); the delete
+                    # only removes ids already durable in the archive, so a rerun resumes safely.
+                    c.execute("BEGIN IMMEDIATE")
+                    try:
+                        c.execute(
+                            f"""
+                            INSERT OR IGNORE INTO archive.analytics_events ({cols})
+                            SELECT {cols} FROM main.analytics_events
+                            WHERE created_at >= ? AND created_at < ?
+                            """,
+                            window,
+                        )
+                        c.commit()
+                    except Exception:
+                        c.rollback()
+                        raise
+                    c.execute("BEGIN IMMEDIATE")
+                    try:
+                        cur = c.execute(
+                            """
+                            DELETE FROM main.analytics_events
+                            WHERE created_at >= ? AND created_at < ?
+                              AND id IN (SELECT id FROM archive.analytics_events WHERE created_at >= ? AND created_at < ?)
+                            """,
+                            (*window, *window),
+                        )
+                        c.commit()
+                    except Exception:
+                        c.rollback()
+                        raise
+                    moved += int(cur.rowcount or 0)
+                    months[month] = months.get(month, 0) + int(cur.rowcount or 0)
+            finally:
+                c.execute("DETACH DATABASE archive")
+
+        vacuumed = False
+        if moved and int(c.execute("PRAGMA auto_vacuum").fetchone()[0]) == 2:
+            c.execute("PRAGMA incremental_vacuum").fetchall()
+            vacuumed = True
+        c.execute("PRAGMA optimize")
+    finally:
+        c.close()
+    return {"moved": moved, "months": months, "incremental_vacuum": vacuumed}
+
+
+def list_archived_analytics_events_between(start_iso: str, end_iso: str, event_name: str = "", limit: int = 12000) -> List[Dict[str, Any]]:
+    # Rare historical reads: attach each overlapping month file in turn and merge with the hot table.
+    try:
+        first = date.fromisoformat(start_iso[:10]).replace(day=1)
+        last = date.fromisoformat(end_iso[:10])
+    except ValueError:
+        return list_analytics_events_between(start_iso, end_iso, event_name=event_name, limit=limit)
+    sql = """
+        SELECT event_name, label, path, href, session_id, consent_state, payload_json, source_ip, user_agent, created_at,
+          page_type, cta_area, cta_kind, form_name
+        FROM {table}
+        WHERE created_at >= ? AND created_at < ?
+    """
+    args: List[Any] = [start_iso, end_iso]
+    if event_name:
+        sql += " AND event_name = ?"
+        args.append(event_name)
+    sql += " ORDER BY created_at ASC LIMIT ?"
+    args.append(limit)
+
+    out: List[Dict[str, Any]] = []
+    c = _open_connection(str(DB_PATH))
+    try:
+        month = first
+        while month <= last:
+            path = _analytics_archive_path(month.isoformat()[:7])
+            if path.exists():
+                c.execute("ATTACH DATABASE ? AS archive", (str(path),))
+                try:
+                    out.extend(dict(r) for r in c.execute(sql.format(table="archive.analytics_events"), tuple(args)).fetchall())
+                finally:
+                    c.execute("DETACH DATABASE archive")
+            month = (month + timedelta(days=32)).replace(day=1)
+        out.extend(dict(r) for r in c.execute(sql.format(table="main.analytics_events"), tuple(args)).fetchall())
+    finally:
+        c.close()
+    out.sort(key=lambda r: str(r.get("created_at") or ""))
+    return out[:limit]
+
+
+def get_lead_by_id(lead_id: str, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT
@@ -1194,6 +1881,7 @@ def get_lead_by_id(lead_id: str) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
+@_mutating
 def upsert_sequence_task(
     lead_id: str,
     step_code: str,
@@ -1201,8 +1889,9 @@ def upsert_sequence_task(
     updated_at: str,
     status: str = "pending",
     note: str = "",
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO lead_sequence_tasks (lead_id, step_code, due_at, status, done_at, note, updated_at)
@@ -1221,11 +1910,10 @@ def upsert_sequence_task(
             """,
             (lead_id, step_code, due_at, status, note, updated_at),
         )
-        c.commit()
 
 
-def list_sequence_tasks_by_lead(lead_id: str) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_sequence_tasks_by_lead(lead_id: str, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT lead_id, step_code, due_at, status, done_at, note, updated_at
@@ -1238,6 +1926,7 @@ def list_sequence_tasks_by_lead(lead_id: str) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
+@_mutating
 def mark_sequence_task_status(
     lead_id: str,
     step_code: str,
@@ -1246,8 +1935,9 @@ def mark_sequence_task_status(
     done_at: Optional[str] = None,
     note: str = "",
     due_at: Optional[str] = None,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         if due_at is None:
             c.execute(
                 """
@@ -1273,11 +1963,11 @@ def mark_sequence_task_status(
                 """,
                 (status, done_at, due_at, note, note, updated_at, lead_id, step_code),
             )
-        c.commit()
 
 
-def skip_pending_sequence_for_lead(lead_id: str, updated_at: str, note: str = "") -> None:
-    with conn() as c:
+@_mutating
+def skip_pending_sequence_for_lead(lead_id: str, updated_at: str, note: str = "", tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             """
             UPDATE lead_sequence_tasks
@@ -1289,11 +1979,10 @@ def skip_pending_sequence_for_lead(lead_id: str, updated_at: str, note: str = ""
             """,
             (updated_at, note, note, updated_at, lead_id),
         )
-        c.commit()
 
 
-def list_due_sequence_tasks(now_iso: str, limit: int = 120) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_due_sequence_tasks(now_iso: str, limit: int = 120, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT
@@ -1305,9 +1994,9 @@ def list_due_sequence_tasks(now_iso: str, limit: int = 120) -> List[Dict[str, An
             LEFT JOIN lead_meta m ON m.lead_id = t.lead_id
             WHERE t.status = 'pending'
               AND t.due_at <= ?
-              AND COALESCE(m.status, 'new') NOT IN ('won', 'lost')
-              AND COALESCE(m.is_test, 0) = 0
-              AND COALESCE(m.is_spam, 0) = 0
+              AND m.status NOT IN ('won', 'lost')
+              AND m.is_test = 0
+              AND m.is_spam = 0
             ORDER BY t.due_at ASC
             LIMIT ?
             """,
@@ -1316,7 +2005,7 @@ def list_due_sequence_tasks(now_iso: str, limit: int = 120) -> List[Dict[str, An
         return [dict(r) for r in rows]
 
 
-def sequence_progress_for_leads(lead_ids: List[str]) -> Dict[str, Dict[str, int]]:
+def sequence_progress_for_leads(lead_ids: List[str], tx: Optional[sqlite3.Connection] = None) -> Dict[str, Dict[str, int]]:
     if not lead_ids:
         return {}
     placeholders = ",".join(["?"] * len(lead_ids))
@@ -1330,7 +2019,7 @@ def sequence_progress_for_leads(lead_ids: List[str]) -> Dict[str, Dict[str, int]
         WHERE lead_id IN ({placeholders})
         GROUP BY lead_id
     """
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(lead_ids)).fetchall()
         out: Dict[str, Dict[str, int]] = {}
         for r in rows:
@@ -1343,8 +2032,9 @@ def sequence_progress_for_leads(lead_ids: List[str]) -> Dict[str, Dict[str, int]
         return out
 
 
-def upsert_channel_cost_daily(date_iso: str, channel: str, cost: float, updated_at: str) -> None:
-    with conn() as c:
+@_mutating
+def upsert_channel_cost_daily(date_iso: str, channel: str, cost: float, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO channel_cost_daily (date_iso, channel, cost, updated_at)
@@ -1355,11 +2045,10 @@ def upsert_channel_cost_daily(date_iso: str, channel: str, cost: float, updated_
             """,
             (date_iso, channel, float(cost), updated_at),
         )
-        c.commit()
 
 
-def list_channel_costs_between(start_date_iso: str, end_date_iso: str) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_channel_costs_between(start_date_iso: str, end_date_iso: str, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT date_iso, channel, cost, updated_at
@@ -1372,8 +2061,8 @@ def list_channel_costs_between(start_date_iso: str, end_date_iso: str) -> List[D
         return [dict(r) for r in rows]
 
 
-def channel_costs_grouped_between(start_date_iso: str, end_date_iso: str) -> List[Dict[str, Any]]:
-    with conn() as c:
+def channel_costs_grouped_between(start_date_iso: str, end_date_iso: str, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT channel, SUM(cost) AS total_cost, COUNT(*) AS days_count
@@ -1387,8 +2076,8 @@ def channel_costs_grouped_between(start_date_iso: str, end_date_iso: str) -> Lis
         return [dict(r) for r in rows]
 
 
-def channel_cost_on_date(date_iso: str, channel: str) -> Optional[float]:
-    with conn() as c:
+def channel_cost_on_date(date_iso: str, channel: str, tx: Optional[sqlite3.Connection] = None) -> Optional[float]:
+    with _session(tx) as c:
         row = c.execute(
             "SELECT cost FROM channel_cost_daily WHERE date_iso = ? AND channel = ?",
             (date_iso, channel),
@@ -1398,8 +2087,9 @@ def channel_cost_on_date(date_iso: str, channel: str) -> Optional[float]:
         return float(row["cost"] or 0.0)
 
 
-def insert_budget_plan(created_at: str, days: int, spend_change_pct: float, status: str, note: str) -> int:
-    with conn() as c:
+@_mutating
+def insert_budget_plan(created_at: str, days: int, spend_change_pct: float, status: str, note: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO budget_plans (created_at, days, spend_change_pct, status, note)
@@ -1407,14 +2097,14 @@ def insert_budget_plan(created_at: str, days: int, spend_change_pct: float, stat
             """,
             (created_at, int(days), float(spend_change_pct), status, note[:400]),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def insert_budget_plan_items(plan_id: int, items: List[Tuple[str, str, str, float, float, float, float, str, str]]) -> int:
+@_mutating
+def insert_budget_plan_items(plan_id: int, items: List[Tuple[str, str, str, float, float, float, float, str, str]], tx: Optional[sqlite3.Connection] = None) -> int:
     if not items:
         return 0
-    with conn() as c:
+    with _session(tx) as c:
         c.executemany(
             """
             INSERT INTO budget_plan_items
@@ -1423,12 +2113,11 @@ def insert_budget_plan_items(plan_id: int, items: List[Tuple[str, str, str, floa
             """,
             [(plan_id, *x) for x in items],
         )
-        c.commit()
         return len(items)
 
 
-def list_budget_plans(limit: int = 20) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_budget_plans(limit: int = 20, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, created_at, days, spend_change_pct, status, note
@@ -1441,8 +2130,8 @@ def list_budget_plans(limit: int = 20) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def get_budget_plan(plan_id: int) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_budget_plan(plan_id: int, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT id, created_at, days, spend_change_pct, status, note
@@ -1454,8 +2143,8 @@ def get_budget_plan(plan_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
-def list_budget_plan_items(plan_id: int) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_budget_plan_items(plan_id: int, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, plan_id, channel, action, reason, current_cost, proposed_cost, delta_cost, expected_profit_delta, status, applied_at, updated_at
@@ -1468,14 +2157,15 @@ def list_budget_plan_items(plan_id: int) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def update_budget_plan_status(plan_id: int, status: str) -> None:
-    with conn() as c:
+@_mutating
+def update_budget_plan_status(plan_id: int, status: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute("UPDATE budget_plans SET status=? WHERE id=?", (status, plan_id))
-        c.commit()
 
 
-def update_budget_plan_item_status(item_id: int, status: str, applied_at: Optional[str], updated_at: str) -> None:
-    with conn() as c:
+@_mutating
+def update_budget_plan_item_status(item_id: int, status: str, applied_at: Optional[str], updated_at: str, tx: Optional[sqlite3.Connection] = None) -> None:
+    with _session(tx) as c:
         c.execute(
             """
             UPDATE budget_plan_items
@@ -1486,11 +2176,10 @@ def update_budget_plan_item_status(item_id: int, status: str, applied_at: Option
             """,
             (status, applied_at, updated_at, item_id),
         )
-        c.commit()
 
 
-def budget_plan_item(item_id: int) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def budget_plan_item(item_id: int, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT id, plan_id, channel, action, reason, current_cost, proposed_cost, delta_cost, expected_profit_delta, status, applied_at, updated_at
@@ -1502,10 +2191,11 @@ def budget_plan_item(item_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
-def insert_budget_plan_cost_runs(rows: List[Tuple[int, int, str, str, float, float, str]]) -> int:
+@_mutating
+def insert_budget_plan_cost_runs(rows: List[Tuple[int, int, str, str, float, float, str]], tx: Optional[sqlite3.Connection] = None) -> int:
     if not rows:
         return 0
-    with conn() as c:
+    with _session(tx) as c:
         c.executemany(
             """
             INSERT INTO budget_plan_cost_runs
@@ -1514,11 +2204,10 @@ def insert_budget_plan_cost_runs(rows: List[Tuple[int, int, str, str, float, flo
             """,
             rows,
         )
-        c.commit()
         return len(rows)
 
 
-def list_budget_plan_cost_runs(plan_id: int, item_id: Optional[int] = None, limit: int = 200) -> List[Dict[str, Any]]:
+def list_budget_plan_cost_runs(plan_id: int, item_id: Optional[int] = None, limit: int = 200, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, plan_id, item_id, date_iso, channel, prev_cost, new_cost, applied_at, reverted_at
         FROM budget_plan_cost_runs
@@ -1530,13 +2219,13 @@ def list_budget_plan_cost_runs(plan_id: int, item_id: Optional[int] = None, limi
         args.append(int(item_id))
     sql += " ORDER BY applied_at DESC, id DESC LIMIT ?"
     args.append(int(limit))
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def unreverted_budget_plan_cost_runs(plan_id: int, item_id: int) -> List[Dict[str, Any]]:
-    with conn() as c:
+def unreverted_budget_plan_cost_runs(plan_id: int, item_id: int, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, plan_id, item_id, date_iso, channel, prev_cost, new_cost, applied_at, reverted_at
@@ -1549,18 +2238,19 @@ def unreverted_budget_plan_cost_runs(plan_id: int, item_id: int) -> List[Dict[st
         return [dict(r) for r in rows]
 
 
-def mark_budget_plan_runs_reverted(run_ids: List[int], reverted_at: str) -> int:
+@_mutating
+def mark_budget_plan_runs_reverted(run_ids: List[int], reverted_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
     if not run_ids:
         return 0
     placeholders = ",".join(["?"] * len(run_ids))
     sql = f"UPDATE budget_plan_cost_runs SET reverted_at=? WHERE id IN ({placeholders})"
     args: List[Any] = [reverted_at] + [int(x) for x in run_ids]
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(sql, tuple(args))
-        c.commit()
         return int(cur.rowcount or 0)
 
 
+@_mutating
 def upsert_guardrail_incident(
     fingerprint: str,
     severity: str,
@@ -1569,8 +2259,9 @@ def upsert_guardrail_incident(
     title: str,
     details_json: str,
     now_iso: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         row = c.execute(
             "SELECT id, status FROM guardrail_incidents WHERE fingerprint = ?",
             (fingerprint,),
@@ -1609,7 +2300,6 @@ def upsert_guardrail_incident(
                     """,
                     (now_iso, severity, incident_type, channel, title, details_json, incident_id),
                 )
-            c.commit()
             return incident_id
 
         cur = c.execute(
@@ -1620,11 +2310,10 @@ def upsert_guardrail_incident(
             """,
             (fingerprint, now_iso, now_iso, severity, incident_type, channel, title, details_json),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def list_guardrail_incidents(status: str = "", limit: int = 100) -> List[Dict[str, Any]]:
+def list_guardrail_incidents(status: str = "", limit: int = 100, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, fingerprint, created_at, updated_at, severity, incident_type, channel, title, details_json, status, acknowledged_at, resolved_at
         FROM guardrail_incidents
@@ -1636,13 +2325,14 @@ def list_guardrail_incidents(status: str = "", limit: int = 100) -> List[Dict[st
         args.append(status)
     sql += " ORDER BY updated_at DESC LIMIT ?"
     args.append(limit)
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def update_guardrail_incident_status(incident_id: int, status: str, now_iso: str) -> int:
-    with conn() as c:
+@_mutating
+def update_guardrail_incident_status(incident_id: int, status: str, now_iso: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         if status == "ack":
             cur = c.execute(
                 """
@@ -1676,10 +2366,10 @@ def update_guardrail_incident_status(incident_id: int, status: str, now_iso: str
                 """,
                 (now_iso, incident_id),
             )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
+@_mutating
 def create_incident_task(
     incident_id: int,
     due_at: str,
@@ -1689,8 +2379,9 @@ def create_incident_task(
     action_type: str,
     payload_json: str,
     now_iso: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO incident_tasks
@@ -1707,12 +2398,11 @@ def create_incident_task(
             """,
             (int(cur.lastrowid or 0), json.dumps(audit, ensure_ascii=False), now_iso),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def has_active_incident_task(incident_id: int, action_type: str) -> bool:
-    with conn() as c:
+def has_active_incident_task(incident_id: int, action_type: str, tx: Optional[sqlite3.Connection] = None) -> bool:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT 1
@@ -1727,7 +2417,7 @@ def has_active_incident_task(incident_id: int, action_type: str) -> bool:
         return row is not None
 
 
-def list_incident_tasks(status: str = "", limit: int = 120) -> List[Dict[str, Any]]:
+def list_incident_tasks(status: str = "", limit: int = 120, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT
           id, incident_id, created_at, updated_at, due_at, owner, priority, title, action_type,
@@ -1741,13 +2431,13 @@ def list_incident_tasks(status: str = "", limit: int = 120) -> List[Dict[str, An
         args.append(status)
     sql += " ORDER BY due_at ASC, updated_at DESC LIMIT ?"
     args.append(limit)
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def get_incident_task(task_id: int) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_incident_task(task_id: int, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT
@@ -1761,6 +2451,7 @@ def get_incident_task(task_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
+@_mutating
 def update_incident_task_status(
     task_id: int,
     now_iso: str,
@@ -1771,8 +2462,9 @@ def update_incident_task_status(
     actor: str = "admin",
     reason: str = "",
     expected_updated_at: str = "",
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         row = c.execute("SELECT * FROM incident_tasks WHERE id = ?", (task_id,)).fetchone()
         if not row:
             return 0
@@ -1874,11 +2566,10 @@ def update_incident_task_status(
                 """,
                 (task_id, (actor or "admin")[:120], "update", json.dumps(change, ensure_ascii=False), now_iso),
             )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
-def list_incident_task_audit(limit: int = 200, task_id: int = 0) -> List[Dict[str, Any]]:
+def list_incident_task_audit(limit: int = 200, task_id: int = 0, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, task_id, actor, action, change_json, created_at
         FROM incident_task_audit
@@ -1890,13 +2581,14 @@ def list_incident_task_audit(limit: int = 200, task_id: int = 0) -> List[Dict[st
         args.append(task_id)
     sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     args.append(limit)
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def mark_incident_task_sla_alert(task_id: int, bucket: str, now_iso: str) -> int:
-    with conn() as c:
+@_mutating
+def mark_incident_task_sla_alert(task_id: int, bucket: str, now_iso: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             UPDATE incident_tasks
@@ -1915,10 +2607,10 @@ def mark_incident_task_sla_alert(task_id: int, bucket: str, now_iso: str) -> int
                 """,
                 (int(task_id), json.dumps({"bucket": bucket}, ensure_ascii=False), now_iso),
             )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
+@_mutating
 def create_scenario_snapshot(
     created_at: str,
     name: str,
@@ -1932,8 +2624,9 @@ def create_scenario_snapshot(
     include_test: bool,
     include_spam: bool,
     summary_json: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO scenario_snapshots
@@ -1955,12 +2648,11 @@ def create_scenario_snapshot(
                 summary_json,
             ),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def list_scenario_snapshots(limit: int = 30) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_scenario_snapshots(limit: int = 30, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, created_at, name, days, history_days, horizon_days, target_revenue, budget_change_pct, conv_uplift_pct, spend_change_pct, include_test, include_spam, summary_json
@@ -1973,8 +2665,8 @@ def list_scenario_snapshots(limit: int = 30) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def get_scenario_snapshot(snapshot_id: int) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_scenario_snapshot(snapshot_id: int, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT id, created_at, name, days, history_days, horizon_days, target_revenue, budget_change_pct, conv_uplift_pct, spend_change_pct, include_test, include_spam, summary_json
@@ -1986,15 +2678,15 @@ def get_scenario_snapshot(snapshot_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
-def delete_scenario_snapshot(snapshot_id: int) -> int:
-    with conn() as c:
+@_mutating
+def delete_scenario_snapshot(snapshot_id: int, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute("DELETE FROM scenario_snapshots WHERE id = ?", (snapshot_id,))
-        c.commit()
         return int(cur.rowcount or 0)
 
 
-def leads_pending_touch(limit: int = 120) -> List[Dict[str, Any]]:
-    with conn() as c:
+def leads_pending_touch(limit: int = 120, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT
@@ -2019,9 +2711,9 @@ def leads_pending_touch(limit: int = 120) -> List[Dict[str, Any]]:
               COALESCE(m.deal_value, 0) AS deal_value
             FROM leads l
             LEFT JOIN lead_meta m ON m.lead_id = l.id
-            WHERE COALESCE(m.status, 'new') IN ('new', 'in_progress')
-              AND COALESCE(m.is_test, 0) = 0
-              AND COALESCE(m.is_spam, 0) = 0
+            WHERE m.status IN ('new', 'in_progress')
+              AND m.is_test = 0
+              AND m.is_spam = 0
             ORDER BY l.created_at ASC
             LIMIT ?
             """,
@@ -2030,8 +2722,8 @@ def leads_pending_touch(limit: int = 120) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
-def list_execution_connectors() -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_execution_connectors(tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT channel, provider, mode, status, daily_change_limit_pct, last_sync_at, last_result_json, updated_at
@@ -2042,6 +2734,7 @@ def list_execution_connectors() -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
+@_mutating
 def upsert_execution_connector(
     channel: str,
     provider: str,
@@ -2049,8 +2742,9 @@ def upsert_execution_connector(
     status: str,
     daily_change_limit_pct: float,
     updated_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO execution_connectors
@@ -2065,11 +2759,11 @@ def upsert_execution_connector(
             """,
             (channel, provider, mode, status, float(daily_change_limit_pct), updated_at),
         )
-        c.commit()
 
 
-def update_execution_connector_sync(channel: str, last_sync_at: str, last_result_json: str, updated_at: str) -> int:
-    with conn() as c:
+@_mutating
+def update_execution_connector_sync(channel: str, last_sync_at: str, last_result_json: str, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             UPDATE execution_connectors
@@ -2080,10 +2774,10 @@ def update_execution_connector_sync(channel: str, last_sync_at: str, last_result
             """,
             (last_sync_at, last_result_json, updated_at, channel),
         )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
+@_mutating
 def create_approval(
     entity_type: str,
     entity_id: str,
@@ -2093,8 +2787,9 @@ def create_approval(
     requested_by: str,
     note: str,
     created_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO approvals
@@ -2103,11 +2798,10 @@ def create_approval(
             """,
             (entity_type, entity_id, action, payload_json, float(threshold_value), requested_by, note[:400], created_at),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def list_approvals(status: str = "", limit: int = 120) -> List[Dict[str, Any]]:
+def list_approvals(status: str = "", limit: int = 120, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, entity_type, entity_id, action, payload_json, threshold_value, status, requested_by, decided_by, note, created_at, decided_at
         FROM approvals
@@ -2119,13 +2813,13 @@ def list_approvals(status: str = "", limit: int = 120) -> List[Dict[str, Any]]:
         args.append(status)
     sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     args.append(int(limit))
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def get_approval(approval_id: int) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_approval(approval_id: int, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT id, entity_type, entity_id, action, payload_json, threshold_value, status, requested_by, decided_by, note, created_at, decided_at
@@ -2137,8 +2831,9 @@ def get_approval(approval_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
-def update_approval_status(approval_id: int, status: str, decided_by: str, note: str, decided_at: str) -> int:
-    with conn() as c:
+@_mutating
+def update_approval_status(approval_id: int, status: str, decided_by: str, note: str, decided_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             UPDATE approvals
@@ -2150,10 +2845,10 @@ def update_approval_status(approval_id: int, status: str, decided_by: str, note:
             """,
             (status, decided_by, note, note, decided_at, int(approval_id)),
         )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
+@_mutating
 def create_execution_run(
     connector_channel: str,
     action: str,
@@ -2161,8 +2856,9 @@ def create_execution_run(
     created_at: str,
     plan_id: Optional[int] = None,
     item_id: Optional[int] = None,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO execution_runs
@@ -2171,12 +2867,12 @@ def create_execution_run(
             """,
             (connector_channel, plan_id, item_id, action, request_json, created_at),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def finish_execution_run(run_id: int, status: str, response_json: str, finished_at: str) -> int:
-    with conn() as c:
+@_mutating
+def finish_execution_run(run_id: int, status: str, response_json: str, finished_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             UPDATE execution_runs
@@ -2187,11 +2883,10 @@ def finish_execution_run(run_id: int, status: str, response_json: str, finished_
             """,
             (status, response_json, finished_at, int(run_id)),
         )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
-def list_execution_runs(limit: int = 120, channel: str = "") -> List[Dict[str, Any]]:
+def list_execution_runs(limit: int = 120, channel: str = "", tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, connector_channel, plan_id, item_id, action, status, request_json, response_json, created_at, finished_at
         FROM execution_runs
@@ -2203,19 +2898,21 @@ def list_execution_runs(limit: int = 120, channel: str = "") -> List[Dict[str, A
         args.append(channel)
     sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     args.append(int(limit))
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
+@_mutating
 def create_experiment(
     name: str,
     scope: str,
     metric_primary: str,
     allocation_mode: str,
     created_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO experiments
@@ -2224,12 +2921,12 @@ def create_experiment(
             """,
             (name[:180], scope[:80], metric_primary[:80], allocation_mode[:40], created_at, created_at),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def update_experiment_status(experiment_id: int, status: str, updated_at: str) -> int:
-    with conn() as c:
+@_mutating
+def update_experiment_status(experiment_id: int, status: str, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             UPDATE experiments
@@ -2239,11 +2936,10 @@ def update_experiment_status(experiment_id: int, status: str, updated_at: str) -
             """,
             (status, updated_at, int(experiment_id)),
         )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
-def list_experiments(limit: int = 40, status: str = "") -> List[Dict[str, Any]]:
+def list_experiments(limit: int = 40, status: str = "", tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, name, scope, status, metric_primary, allocation_mode, created_at, updated_at
         FROM experiments
@@ -2255,13 +2951,13 @@ def list_experiments(limit: int = 40, status: str = "") -> List[Dict[str, Any]]:
         args.append(status)
     sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     args.append(int(limit))
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
 
 
-def get_experiment(experiment_id: int) -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_experiment(experiment_id: int, tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT id, name, scope, status, metric_primary, allocation_mode, created_at, updated_at
@@ -2273,10 +2969,11 @@ def get_experiment(experiment_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
-def upsert_experiment_arms(experiment_id: int, arms: List[Tuple[str, str, float, str]]) -> int:
+@_mutating
+def upsert_experiment_arms(experiment_id: int, arms: List[Tuple[str, str, float, str]], tx: Optional[sqlite3.Connection] = None) -> int:
     if not arms:
         return 0
-    with conn() as c:
+    with _session(tx) as c:
         for arm_key, label, weight, config_json in arms:
             c.execute(
                 """
@@ -2289,12 +2986,11 @@ def upsert_experiment_arms(experiment_id: int, arms: List[Tuple[str, str, float,
                 """,
                 (int(experiment_id), arm_key[:60], label[:140], float(weight), config_json),
             )
-        c.commit()
         return len(arms)
 
 
-def list_experiment_arms(experiment_id: int) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_experiment_arms(experiment_id: int, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, experiment_id, arm_key, label, weight, config_json
@@ -2307,6 +3003,7 @@ def list_experiment_arms(experiment_id: int) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 
+@_mutating
 def insert_experiment_event(
     experiment_id: int,
     arm_key: str,
@@ -2315,8 +3012,9 @@ def insert_experiment_event(
     session_id: str,
     lead_id: str,
     created_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO experiment_events
@@ -2325,12 +3023,11 @@ def insert_experiment_event(
             """,
             (int(experiment_id), arm_key[:60], event_type[:60], float(value), session_id[:120], lead_id[:120], created_at),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def list_experiment_events(experiment_id: int, limit: int = 5000) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_experiment_events(experiment_id: int, limit: int = 5000, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, experiment_id, arm_key, event_type, value, session_id, lead_id, created_at
@@ -2344,6 +3041,7 @@ def list_experiment_events(experiment_id: int, limit: int = 5000) -> List[Dict[s
         return [dict(r) for r in rows]
 
 
+@_mutating
 def create_target_commit(
     period_start: str,
     period_end: str,
@@ -2351,8 +3049,9 @@ def create_target_commit(
     owner: str,
     status: str,
     created_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> int:
-    with conn() as c:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO target_commits
@@ -2361,12 +3060,12 @@ def create_target_commit(
             """,
             (period_start, period_end, float(target_revenue), owner[:80], status[:40], created_at, created_at),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def close_other_target_commits(active_commit_id: int, updated_at: str) -> int:
-    with conn() as c:
+@_mutating
+def close_other_target_commits(active_commit_id: int, updated_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             UPDATE target_commits
@@ -2377,12 +3076,11 @@ def close_other_target_commits(active_commit_id: int, updated_at: str) -> int:
             """,
             (updated_at, int(active_commit_id)),
         )
-        c.commit()
         return int(cur.rowcount or 0)
 
 
-def get_active_target_commit() -> Optional[Dict[str, Any]]:
-    with conn() as c:
+def get_active_target_commit(tx: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, Any]]:
+    with _session(tx) as c:
         row = c.execute(
             """
             SELECT id, period_start, period_end, target_revenue, owner, status, created_at, updated_at
@@ -2395,6 +3093,7 @@ def get_active_target_commit() -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
+@_mutating
 def upsert_target_daily_snapshot(
     commit_id: int,
     day_iso: str,
@@ -2404,8 +3103,9 @@ def upsert_target_daily_snapshot(
     risk_level: str,
     recommendations_json: str,
     created_at: str,
+    tx: Optional[sqlite3.Connection] = None,
 ) -> None:
-    with conn() as c:
+    with _session(tx) as c:
         c.execute(
             """
             INSERT INTO target_daily_snapshots
@@ -2430,11 +3130,10 @@ def upsert_target_daily_snapshot(
                 created_at,
             ),
         )
-        c.commit()
 
 
-def list_target_daily_snapshots(commit_id: int, limit: int = 60) -> List[Dict[str, Any]]:
-    with conn() as c:
+def list_target_daily_snapshots(commit_id: int, limit: int = 60, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    with _session(tx) as c:
         rows = c.execute(
             """
             SELECT id, commit_id, day_iso, actual_revenue, expected_revenue, gap, risk_level, recommendations_json, created_at
@@ -2448,8 +3147,9 @@ def list_target_daily_snapshots(commit_id: int, limit: int = 60) -> List[Dict[st
         return [dict(r) for r in rows]
 
 
-def insert_autonomous_run_log(run_type: str, status: str, summary_json: str, created_at: str) -> int:
-    with conn() as c:
+@_mutating
+def insert_autonomous_run_log(run_type: str, status: str, summary_json: str, created_at: str, tx: Optional[sqlite3.Connection] = None) -> int:
+    with _session(tx) as c:
         cur = c.execute(
             """
             INSERT INTO autonomous_run_log (run_type, status, summary_json, created_at)
@@ -2457,11 +3157,10 @@ def insert_autonomous_run_log(run_type: str, status: str, summary_json: str, cre
             """,
             (run_type[:60], status[:20], summary_json, created_at),
         )
-        c.commit()
         return int(cur.lastrowid or 0)
 
 
-def list_autonomous_run_log(run_type: str = "", limit: int = 80) -> List[Dict[str, Any]]:
+def list_autonomous_run_log(run_type: str = "", limit: int = 80, tx: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
     sql = """
         SELECT id, run_type, status, summary_json, created_at
         FROM autonomous_run_log
@@ -2473,6 +3172,6 @@ def list_autonomous_run_log(run_type: str = "", limit: int = 80) -> List[Dict[st
         args.append(run_type)
     sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     args.append(int(limit))
-    with conn() as c:
+    with _session(tx) as c:
         rows = c.execute(sql, tuple(args)).fetchall()
         return [dict(r) for r in rows]
@@ -1,61 +1,63 @@
-import csv
-import json
-import sqlite3
+import argparse
+import gzip
 import sys
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from typing import List
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from backend.db import DB_PATH, init_db
+from backend.db import init_db
+from backend.export_stream import EXPORT_TABLES, export_columns, iter_csv, iter_export_rows, iter_ndjson
 
 
-def fetch_all(con: sqlite3.Connection, sql: str):
-    cur = con.execute(sql)
-    return [dict(zip([d[0] for d in cur.description], row)) for row in cur.fetchall()]
+def export_table(table: str, out_dir: Path, stamp: str, fmt: str = "both", since: str = "", compress: bool = False) -> List[Path]:
+    written: List[Path] = []
+    formats = ["ndjson", "csv"] if fmt == "both" else [fmt]
+    for f in formats:
+        suffix = ".gz" if compress else ""
+        path = out_dir / f"{table.replace('_', '-')}-{stamp}.{f}{suffix}"
+        rows = iter_export_rows(table, since=since)
+        lines = iter_ndjson(rows) if f == "ndjson" else iter_csv(export_columns(table), rows)
+        opener = gzip.open if compress else open
+        with opener(path, "wt", encoding="utf-8", newline="") as out:
+            for line in lines:
+                out.write(line)
+        written.append(path)
+    return written
 
 
-def write_csv(path: Path, rows):
-    if not rows:
-        path.write_text("", encoding="utf-8")
-        return
-    with path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
-        writer.writeheader()
-        writer.writerows(rows)
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stream SQLite tables to NDJSON/CSV files.")
+    parser.add_argument("--format", choices=["ndjson", "csv", "both"], default="both")
+    parser.add_argument("--gzip", action="store_true", help="write .gz files")
+    parser.add_argument("--since", default="", help="only rows with timestamp >= this ISO value")
+    parser.add_argument("--tables", default=",".join(EXPORT_TABLES), help="comma separated table list")
+    parser.add_argument("--workers", type=int, default=4, help="tables exported in parallel")
+    parser.add_argument("--out-dir", default=str(Path(__file__).resolve().parent / "exports"))
+    args = parser.parse_args()
 
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    unknown = [t for t in tables if t not in EXPORT_TABLES]
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(unknown)}")
 
-def main() -> None:
     init_db()
-    out_dir = Path(__file__).resolve().parent / "exports"
+    out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    with sqlite3.connect(DB_PATH) as con:
-        leads = fetch_all(con, "SELECT * FROM leads ORDER BY created_at DESC")
-        lead_meta = fetch_all(con, "SELECT * FROM lead_meta ORDER BY updated_at DESC")
-        events = fetch_all(con, "SELECT * FROM analytics_events ORDER BY created_at DESC")
-        followups = fetch_all(con, "SELECT * FROM followup_log ORDER BY sent_at DESC")
-
-    bundle = {
-        "exported_at": datetime.now(timezone.utc).isoformat(),
-        "leads": leads,
-        "lead_meta": lead_meta,
-        "analytics_events": events,
-        "followup_log": followups,
-    }
-
-    json_path = out_dir / f"full-export-{stamp}.json"
-    json_path.write_text(json.dumps(bundle, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    write_csv(out_dir / f"leads-{stamp}.csv", leads)
-    write_csv(out_dir / f"lead-meta-{stamp}.csv", lead_meta)
-    write_csv(out_dir / f"events-{stamp}.csv", events)
-    write_csv(out_dir / f"followups-{stamp}.csv", followups)
-
-    print(f"Export written: {json_path}")
+    with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(tables) or 1))) as pool:
+        futures = [
+            pool.submit(export_table, t, out_dir, stamp, args.format, args.since.strip(), args.gzip)
+            for t in tables
+        ]
+        for fut in futures:
+            for path in fut.result():
+                print(f"Export written: {path}")
 
 
 if __name__ == "__main__":
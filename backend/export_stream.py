@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List
+
+from . import db
+
+# Exportable tables and the timestamp column used for ordering and --since filtering.
+EXPORT_TABLES: Dict[str, str] = {
+    "leads": "created_at",
+    "lead_meta": "updated_at",
+    "analytics_events": "created_at",
+    "followup_log": "sent_at",
+}
+
+
+def export_columns(table: str) -> List[str]:
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"table not exportable: {table}")
+    with db.conn() as c:
+        return [str(r["name"]) for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def iter_export_rows(table: str, since: str = "", chunk_size: int = 500) -> Iterator[Dict[str, Any]]:
+    # Own connection: the generator may be resumed from different threads (StreamingResponse, export workers).
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"table not exportable: {table}")
+    ts_col = EXPORT_TABLES[table]
+    sql = f"SELECT * FROM {table}"
+    args: List[Any] = []
+    if since:
+        sql += f" WHERE {ts_col} >= ?"
+        args.append(since)
+    sql += f" ORDER BY {ts_col} ASC"
+    c = db.open_connection()
+    try:
+        cur = c.execute(sql, tuple(args))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            for r in rows:
+                yield dict(r)
+    finally:
+        c.close()
+
+
+def iter_ndjson(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=str) + "\n"
+
+
+def iter_csv(columns: List[str], rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate(0)
+        writer.writerow([row.get(col) for col in columns])
+        yield buf.getvalue()
+
+
+def iter_gzip(chunks: Iterable[str]) -> Iterator[bytes]:
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield z.flush()
@@ -0,0 +1,357 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# In-process Prometheus-style registry. Each metric has its own lock, held only for a dict
+# update, so hot paths never contend on a global lock.
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_REGISTRY: Dict[str, Dict[str, Any]] = {}
+_REGISTRY_LOCK = threading.Lock()
+_COLLECTORS: List[Callable[[], None]] = []
+_DUMPER: Dict[str, Any] = {"thread": None, "stop": None}
+# Snapshot files are per process instance, so a restarted process that reuses a pid never
+# overwrites counters of its predecessor that were not yet retired.
+_INSTANCE = uuid.uuid4().hex[:12]
+_RETIRED_FILE = "_retired.json"
+_RETIRE_LOCK_STALE_SECONDS = 60.0
+
+
+def _env_int(name: str, default: int, lo: int, hi: int) -> int:
+    raw = (os.getenv(name) or str(default)).strip()
+    try:
+        value = int(raw)
+    except Exception:
+        value = default
+    return max(lo, min(hi, value))
+
+
+def _define(name: str, kind: str, help_text: str, buckets: Optional[Iterable[float]] = None) -> None:
+    with _REGISTRY_LOCK:
+        if name in _REGISTRY:
+            return
+        _REGISTRY[name] = {
+            "kind": kind,
+            "help": help_text,
+            "buckets": tuple(sorted(float(b) for b in (buckets or DEFAULT_BUCKETS))) if kind == "histogram" else (),
+            "series": {},
+            "lock": threading.Lock(),
+        }
+
+
+def define_counter(name: str, help_text: str) -> None:
+    _define(name, "counter", help_text)
+
+
+def define_gauge(name: str, help_text: str) -> None:
+    _define(name, "gauge", help_text)
+
+
+def define_histogram(name: str, help_text: str, buckets: Optional[Iterable[float]] = None) -> None:
+    _define(name, "histogram", help_text, buckets)
+
+
+def _metric(name: str, kind: str) -> Dict[str, Any]:
+    metric = _REGISTRY.get(name)
+    if metric is None:
+        _define(name, kind, name)
+        metric = _REGISTRY[name]
+    return metric
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    metric = _metric(name, "counter")
+    key = _label_key(labels)
+    with metric["lock"]:
+        metric["series"][key] = metric["series"].get(key, 0.0) + float(value)
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    metric = _metric(name, "gauge")
+    key = _label_key(labels)
+    with metric["lock"]:
+        metric["series"][key] = float(value)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    metric = _metric(name, "histogram")
+    key = _label_key(labels)
+    value = float(value)
+    buckets = metric["buckets"]
+    idx = len(buckets)
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            idx = i
+            break
+    with metric["lock"]:
+        series = metric["series"].get(key)
+        if series is None:
+            series = {"counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            metric["series"][key] = series
+        series["counts"][idx] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+
+def register_collector(fn: Callable[[], None]) -> None:
+    # Called right before a snapshot; use it to refresh gauges from module state.
+    if fn not in _COLLECTORS:
+        _COLLECTORS.append(fn)
+
+
+def snapshot() -> Dict[str, Any]:
+    for fn in list(_COLLECTORS):
+        try:
+            fn()
+        except Exception:
+            pass
+    out: Dict[str, Any] = {}
+    with _REGISTRY_LOCK:
+        items = list(_REGISTRY.items())
+    for name, metric in items:
+        with metric["lock"]:
+            series = [
+                [dict(key), json.loads(json.dumps(value))]
+                for key, value in metric["series"].items()
+            ]
+        out[name] = {"kind": metric["kind"], "help": metric["help"], "buckets": list(metric["buckets"]), "series": series}
+    return out
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = sorted(labels.items())
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _fmt_num(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(snap: Dict[str, Any]) -> str:
+    lines: List[str] = []
+    for name in sorted(snap):
+        metric = snap[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for labels, value in sorted(metric["series"], key=lambda s: sorted(s[0].items())):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_num(value)}")
+                continue
+            cumulative = 0
+            for bound, n in zip(list(metric["buckets"]) + ["+Inf"], value["counts"]):
+                cumulative += int(n)
+                le = bound if bound == "+Inf" else _fmt_num(float(bound))
+                lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_num(value['sum'])}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {int(value['count'])}")
+    return "\n".join(lines) + "\n"
+
+
+def merge(snaps: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    # Counters and histograms add up across processes; gauges keep one series per process.
+    out: Dict[str, Any] = {}
+    for process, snap in sorted(snaps.items()):
+        for name, metric in snap.items():
+            target = out.setdefault(
+                name,
+                {"kind": metric["kind"], "help": metric["help"], "buckets": metric["buckets"], "series": {}},
+            )
+            if target["kind"] != metric["kind"] or target["buckets"] != metric["buckets"]:
+                continue
+            for labels, value in metric["series"]:
+                if metric["kind"] == "gauge":
+                    labels = {**labels, "process": process}
+                key = _label_key(labels)
+                cur = target["series"].get(key)
+                if cur is None:
+                    target["series"][key] = (labels, json.loads(json.dumps(value)))
+                elif metric["kind"] == "histogram":
+                    cur[1]["counts"] = [a + b for a, b in zip(cur[1]["counts"], value["counts"])]
+                    cur[1]["sum"] += value["sum"]
+                    cur[1]["count"] += value["count"]
+                else:
+                    target["series"][key] = (labels, cur[1] + value)
+    for metric in out.values():
+        metric["series"] = [[labels, value] for labels, value in metric["series"].values()]
+    return out
+
+
+def _multiproc_dir() -> Optional[Path]:
+    raw = (os.getenv("METRICS_MULTIPROC_DIR") or "").strip()
+    return Path(raw) if raw else None
+
+
+def _process_name() -> str:
+    role = (os.getenv("METRICS_PROCESS_ROLE") or "app").strip() or "app"
+    return f"{role}-{os.getpid()}"
+
+
+def _write_json_atomic(path: Path, data: Dict[str, Any]) -> None:
+    # Unique temp name per writer: the dumper thread and a scrape may write the same file at once.
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.stem}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def dump_snapshot() -> Optional[Path]:
+    out_dir = _multiproc_dir()
+    if out_dir is None:
+        return None
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"{_process_name()}-{_INSTANCE}.json"
+    _write_json_atomic(path, {"at": time.time(), "process": _process_name(), "metrics": snapshot()})
+    return path
+
+
+def _without_gauges(snap: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: metric for name, metric in snap.items() if metric.get("kind") != "gauge"}
+
+
+def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def _retire_snapshots(out_dir: Path, stems: List[str], stale_s: float) -> None:
+    # Folds counters and histograms of exited processes into _retired.json so merged totals never
+    # drop. mkdir is the cross-process lock; whoever loses skips, and the next scrape retries.
+    lock = out_dir / ".retire.lock"
+    try:
+        os.mkdir(lock)
+    except FileExistsError:
+        try:
+            if time.time() - lock.stat().st_mtime < _RETIRE_LOCK_STALE_SECONDS:
+                return
+            os.rmdir(lock)
+            os.mkdir(lock)
+        except OSError:
+            return
+    try:
+        retired = _read_json(out_dir / _RETIRED_FILE) or {}
+        files: Dict[str, float] = dict(retired.get("files") or {})
+        snaps: Dict[str, Dict[str, Any]] = {_RETIRED_FILE: retired.get("metrics") or {}}
+        folded: List[Path] = []
+        for stem in stems:
+            path = out_dir / f"{stem}.json"
+            data = _read_json(path)
+            if stem in files or data is None or time.time() - float(data.get("at") or 0) <= stale_s:
+                continue
+            snaps[stem] = _without_gauges(data.get("metrics") or {})
+            files[stem] = time.time()
+            folded.append(path)
+        if not folded:
+            return
+        # Stems are remembered for a while so a late dump of a retired process is not counted twice.
+        keep_s = max(86400.0, stale_s * 10.0)
+        files = {stem: at for stem, at in files.items() if time.time() - float(at) <= keep_s}
+        _write_json_atomic(out_dir / _RETIRED_FILE, {"files": files, "metrics": merge(snaps)})
+        for path in folded:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    finally:
+        try:
+            os.rmdir(lock)
+        except OSError:
+            pass
+
+
+def metrics_text() -> str:
+    out_dir = _multiproc_dir()
+    if out_dir is None:
+        return render(snapshot())
+    dump_snapshot()
+    stale_s = _env_int("METRICS_STALE_SECONDS", 300, 10, 86400)
+    found: List[Tuple[str, Dict[str, Any]]] = []
+    for path in out_dir.glob("*.json"):
+        data = _read_json(path) if path.name != _RETIRED_FILE else None
+        if data is not None:
+            found.append((path.stem, data))
+    # Read after the process files: a file folded in the meantime is then listed here and skipped.
+    retired = _read_json(out_dir / _RETIRED_FILE) or {}
+    retired_files = retired.get("files") or {}
+    snaps: Dict[str, Dict[str, Any]] = {_RETIRED_FILE: retired.get("metrics") or {}}
+    stale: List[str] = []
+    for stem, data in found:
+        if stem in retired_files:
+            continue
+        metrics = data.get("metrics") or {}
+        # Processes that stopped dumping (crashed or exited) lose their gauges but keep their
+        # counters: they are summed from the file until it is folded into _retired.json.
+        if time.time() - float(data.get("at") or 0) > stale_s:
+            stale.append(stem)
+            snaps[stem] = _without_gauges(metrics)
+            continue
+        snaps[str(data.get("process") or stem)] = metrics
+    if stale:
+        try:
+            _retire_snapshots(out_dir, stale, stale_s)
+        except Exception:
+            pass
+    return render(merge(snaps))
+
+
+def start_metrics_dumper(interval_s: float = 5.0) -> None:
+    if _multiproc_dir() is None:
+        return
+    thread = _DUMPER.get("thread")
+    if thread is not None and thread.is_alive():
+        return
+    stop = threading.Event()
+
+    def _loop() -> None:
+        while not stop.wait(interval_s):
+            try:
+                dump_snapshot()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=_loop, name="metrics-dumper", daemon=True)
+    _DUMPER["thread"] = thread
+    _DUMPER["stop"] = stop
+    thread.start()
+
+
+def stop_metrics_dumper() -> None:
+    stop = _DUMPER.get("stop")
+    thread = _DUMPER.get("thread")
+    if stop is not None:
+        stop.set()
+    if thread is not None:
+        thread.join(timeout=2.0)
+    _DUMPER["thread"] = None
+    _DUMPER["stop"] = None
+    try:
+        dump_snapshot()
+    except Exception:
+        pass
@@ -0,0 +1,18 @@
+-- Materialized per-user balance, updated in the same transaction as each credit_ledger insert.
+
+CREATE TABLE IF NOT EXISTS user_balances (
+  user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+  balance INTEGER NOT NULL DEFAULT 0,
+  last_ledger_id UUID,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  reconciled_at TIMESTAMPTZ
+);
+
+INSERT INTO user_balances (user_id, balance, updated_at, reconciled_at)
+SELECT user_id, COALESCE(SUM(amount), 0), now(), now()
+FROM credit_ledger
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+  SET balance = excluded.balance,
+      updated_at = now(),
+      reconciled_at = now();
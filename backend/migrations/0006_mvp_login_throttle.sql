@@ -0,0 +1,12 @@
+-- Shared login throttle state (AUTH_LOGIN_THROTTLE_STORE=postgres) so lockouts hold across web processes.
+
+CREATE TABLE IF NOT EXISTS auth_login_throttle (
+  key TEXT PRIMARY KEY,
+  failures INTEGER NOT NULL DEFAULT 0,
+  window_started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_auth_login_throttle_updated
+  ON auth_login_throttle (updated_at);
@@ -0,0 +1,79 @@
+-- Precomputed ops metrics so /api/ops/metrics does not aggregate jobs on every poll.
+-- Counters and job-duration histogram buckets per 5-minute bucket, and job status counts, are
+-- sharded rows (summed on read) to spread concurrent transactions over several rows; each
+-- transaction adds to one random shard. Backfilled rows go to shard 0.
+
+CREATE TABLE IF NOT EXISTS ops_metrics_rollup (
+  bucket_start TIMESTAMPTZ NOT NULL,
+  metric TEXT NOT NULL,
+  label TEXT NOT NULL DEFAULT '',
+  count BIGINT NOT NULL DEFAULT 0,
+  sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+  shard SMALLINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (bucket_start, metric, label, shard)
+);
+
+CREATE TABLE IF NOT EXISTS ops_job_status_counts (
+  status TEXT NOT NULL,
+  shard SMALLINT NOT NULL,
+  n BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (status, shard)
+);
+
+INSERT INTO ops_job_status_counts (status, shard, n)
+SELECT status, 0, COUNT(*)
+FROM jobs
+GROUP BY status
+ON CONFLICT (status, shard) DO UPDATE SET n = excluded.n;
+
+INSERT INTO ops_metrics_rollup (bucket_start, metric, label, count, sum)
+SELECT to_timestamp(floor(EXTRACT(EPOCH FROM finished_at) / 300) * 300), 'job_failed', '', COUNT(*), 0
+FROM jobs
+WHERE status = 'failed' AND finished_at >= now() - INTERVAL '24 hours'
+GROUP BY 1
+ON CONFLICT (bucket_start, metric, label, shard) DO NOTHING;
+
+INSERT INTO ops_metrics_rollup (bucket_start, metric, label, count, sum)
+SELECT to_timestamp(floor(EXTRACT(EPOCH FROM created_at) / 300) * 300), 'dead_letter', '', COUNT(*), 0
+FROM job_dead_letters
+WHERE created_at >= now() - INTERVAL '24 hours'
+GROUP BY 1
+ON CONFLICT (bucket_start, metric, label, shard) DO NOTHING;
+
+INSERT INTO ops_metrics_rollup (bucket_start, metric, label, count, sum)
+SELECT to_timestamp(floor(EXTRACT(EPOCH FROM received_at) / 300) * 300), 'webhook_failed', '', COUNT(*), 0
+FROM webhook_events
+WHERE status = 'failed' AND received_at >= now() - INTERVAL '24 hours'
+GROUP BY 1
+ON CONFLICT (bucket_start, metric, label, shard) DO NOTHING;
+
+-- Bucket labels must match _JOB_DURATION_BUCKETS in backend/mvp_billing.py.
+INSERT INTO ops_metrics_rollup (bucket_start, metric, label, count, sum)
+SELECT
+  to_timestamp(floor(EXTRACT(EPOCH FROM finished_at) / 300) * 300),
+  'job_duration',
+  CASE
+    WHEN d <= 1 THEN '1'
+    WHEN d <= 2 THEN '2'
+    WHEN d <= 5 THEN '5'
+    WHEN d <= 10 THEN '10'
+    WHEN d <= 30 THEN '30'
+    WHEN d <= 60 THEN '60'
+    WHEN d <= 120 THEN '120'
+    WHEN d <= 300 THEN '300'
+    WHEN d <= 600 THEN '600'
+    WHEN d <= 1800 THEN '1800'
+    ELSE '+Inf'
+  END,
+  COUNT(*),
+  SUM(d)
+FROM (
+  SELECT finished_at, EXTRACT(EPOCH FROM (finished_at - started_at))::double precision AS d
+  FROM jobs
+  WHERE status IN ('succeeded', 'failed')
+    AND started_at IS NOT NULL
+    AND finished_at IS NOT NULL
+    AND finished_at >= now() - INTERVAL '24 hours'
+) j
+GROUP BY 1, 3
+ON CONFLICT (bucket_start, metric, label, shard) DO NOTHING;
@@ -0,0 +1,47 @@
+-- Weighted fair claiming: one row per user with queued or running jobs.
+-- `pass` is the user's virtual time (stride scheduling): each claim adds 1 / weight and the
+-- claimer always serves the lowest pass first, so users take turns in proportion to weight.
+-- `ready_at` is the earliest available_at of the user's queued jobs (NULL = nothing queued).
+
+ALTER TABLE plans
+  ADD COLUMN IF NOT EXISTS priority_weight INTEGER NOT NULL DEFAULT 1 CHECK (priority_weight BETWEEN 1 AND 100);
+
+ALTER TABLE plans
+  ADD COLUMN IF NOT EXISTS max_running_jobs INTEGER CHECK (max_running_jobs >= 1);
+
+ALTER TABLE users
+  ADD COLUMN IF NOT EXISTS plan_id TEXT REFERENCES plans(id);
+
+CREATE TABLE IF NOT EXISTS job_queue_users (
+  user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+  running INTEGER NOT NULL DEFAULT 0,
+  ready_at TIMESTAMPTZ,
+  pass DOUBLE PRECISION NOT NULL DEFAULT 0,
+  weight INTEGER NOT NULL DEFAULT 1,
+  max_running INTEGER NOT NULL DEFAULT 2,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_users_pass
+  ON job_queue_users (pass, user_id)
+  WHERE ready_at IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_user_queued
+  ON jobs (user_id, available_at, created_at)
+  WHERE status = 'queued';
+
+INSERT INTO job_queue_users (user_id, running, ready_at, pass, weight, max_running, updated_at)
+SELECT
+  j.user_id,
+  COUNT(*) FILTER (WHERE j.status = 'running'),
+  MIN(j.available_at) FILTER (WHERE j.status = 'queued'),
+  0,
+  COALESCE(MAX(p.priority_weight), 1),
+  COALESCE(MAX(p.max_running_jobs), 2),
+  now()
+FROM jobs j
+JOIN users u ON u.id = j.user_id
+LEFT JOIN plans p ON p.id = u.plan_id
+WHERE j.status IN ('queued', 'running')
+GROUP BY j.user_id
+ON CONFLICT (user_id) DO NOTHING;
@@ -0,0 +1,39 @@
+-- Content-addressed result cache for opted-in (provider, operation) pairs.
+-- jobs.input_hash is sha256 of the canonical (provider, operation, input) JSON. A submission whose
+-- hash matches a running/queued job is stored as status 'attached' under cache_parent_job_id and
+-- completes (or is released back to the queue) in the same transaction as its parent.
+
+ALTER TABLE jobs
+  ADD COLUMN IF NOT EXISTS input_hash TEXT;
+
+ALTER TABLE jobs
+  ADD COLUMN IF NOT EXISTS cache_parent_job_id UUID REFERENCES jobs(id);
+
+ALTER TABLE jobs
+  DROP CONSTRAINT IF EXISTS jobs_status_check;
+
+ALTER TABLE jobs
+  ADD CONSTRAINT jobs_status_check CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'attached'));
+
+CREATE INDEX IF NOT EXISTS idx_jobs_input_hash_inflight
+  ON jobs (input_hash, created_at)
+  WHERE input_hash IS NOT NULL AND status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_jobs_cache_parent
+  ON jobs (cache_parent_job_id)
+  WHERE status = 'attached';
+
+CREATE TABLE IF NOT EXISTS job_result_cache (
+  input_hash TEXT PRIMARY KEY,
+  provider TEXT NOT NULL,
+  operation TEXT NOT NULL,
+  provider_job_id TEXT,
+  result_json JSONB NOT NULL,
+  source_job_id UUID,
+  hits BIGINT NOT NULL DEFAULT 0,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_result_cache_expires
+  ON job_result_cache (expires_at);
@@ -0,0 +1,10 @@
+-- Running jobs hold a lease that the owning worker renews while the provider call is in flight.
+-- Any worker's reaper requeues or dead-letters running jobs whose lease has expired.
+-- Rows claimed before this migration have no lease and fall back to updated_at + MVP_RUNNING_STALE_SECONDS.
+
+ALTER TABLE jobs
+  ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_running_lease
+  ON jobs (lease_expires_at)
+  WHERE status = 'running';
@@ -1,18 +1,26 @@
 import asyncio
 import hashlib
+import heapq
 import json
 import logging
 import os
+import random
 import secrets
 import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
+from . import metrics
+
 router = APIRouter(tags=["mvp"])
 
 logger = logging.getLogger("mvp")
@@ -20,6 +28,9 @@ if not logger.handlers:
     logging.basicConfig(level=logging.INFO)
 
 _WORKER_TASK: Optional[asyncio.Task] = None
+# job_id -> attempt_count for jobs this worker is running; the heartbeat renews their leases.
+_JOB_LEASES: Dict[str, int] = {}
+_JOB_REAPER_BATCH = 100
 _WORKER_STATE: Dict[str, Any] = {
     "running": False,
     "last_heartbeat": None,
@@ -28,10 +39,68 @@ _WORKER_STATE: Dict[str, Any] = {
     "recovered_total": 0,
     "recovered_last_at": None,
     "recovered_last_summary": None,
+    "leases_lost_total": 0,
+    "balance_reconciled_last_at": None,
+    "balance_drift_total": 0,
+}
+_PG_POOL_LOCK = threading.Lock()
+_PG_POOL_STATE: Dict[str, Any] = {"pool": None, "dsn": ""}
+_HASH_LOCK = threading.Lock()
+_HASH_STATE: Dict[str, Any] = {"executor": None, "depth": 0, "shed_total": 0}
+_SESSION_LOCK = threading.Lock()
+_SESSION_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_SESSION_TOUCHES: Dict[str, datetime] = {}
+_SESSION_CACHE_MAX = 20000
+_SESSION_FLUSH_TASK: Optional[asyncio.Task] = None
+_JOBS_CHANNEL = "mvp_jobs"
+_JOB_WAKEUP: Dict[str, Any] = {"loop": None, "event": None, "listening": False}
+_PREDICTIONS_CHANNEL = "mvp_predictions"
+_JOB_EVENTS_CHANNEL = "mvp_job_events"
+_JOB_TERMINAL_STATUSES = {"succeeded", "failed"}
+# subscribers[job_id] -> list of {"queue", "last_id"}; one shared refresh per job feeds all of them.
+_JOB_STREAM: Dict[str, Any] = {
+    "subscribers": {},
+    "refreshing": set(),
+    "dirty": set(),
+    "loop": None,
+    "thread": None,
+    "stop": None,
+    "listening": False,
+    "refreshes": 0,
 }
-_AUTH_LOCK = threading.Lock()
-_LOGIN_ATTEMPTS: Dict[str, List[datetime]] = {}
-_LOGIN_LOCKED_UNTIL: Dict[str, datetime] = {}
+# Upper bounds (seconds) of the job duration histogram; migration 0007 uses the same labels.
+_JOB_DURATION_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+_OPS_STATUS_SHARDS = 8
+_OPS_BUCKET_SQL = "to_timestamp(floor(EXTRACT(EPOCH FROM now()) / 300) * 300)"
+_PROVIDER_STATE: Dict[str, Any] = {"client": None, "loop": None}
+_REPLICATE_POLL: Dict[str, Any] = {"pending": {}, "task": None, "wake": None, "loop": None, "ticks": 0}
+_LOGIN_SHARD_COUNT = 16
+# Per shard: attempts[key] -> deque of failure times, locked[key] -> unlock time, and one FIFO
+# expiry queue per map. Window and lock lengths are fixed, so expiry order equals insertion order.
+_LOGIN_SHARDS: List[Dict[str, Any]] = [
+    {"lock": threading.Lock(), "attempts": {}, "locked": {}, "attempt_expiry": deque(), "lock_expiry": deque()}
+    for _ in range(_LOGIN_SHARD_COUNT)
+]
+
+metrics.define_histogram("http_request_duration_seconds", "HTTP request latency by route template.")
+metrics.define_histogram("mvp_pg_pool_wait_seconds", "Time spent waiting for a pooled Postgres connection.")
+metrics.define_histogram("mvp_pg_session_seconds", "Time a Postgres connection was held, by outcome.")
+metrics.define_counter("mvp_pg_pool_errors_total", "Failed Postgres pool checkouts.")
+metrics.define_histogram("mvp_provider_seconds", "Provider call latency, by provider and outcome.")
+metrics.define_histogram(
+    "mvp_job_claim_to_finish_seconds",
+    "Time from claiming a job to recording its result.",
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+metrics.define_gauge("mvp_worker_in_flight", "Jobs currently being processed by this worker.")
+metrics.define_counter("mvp_worker_processed_total", "Claimed jobs this worker finished processing.")
+metrics.define_gauge("mvp_predictions_pending", "Replicate predictions waiting on the shared poller.")
+metrics.define_gauge("mvp_auth_hash_queue_depth", "Password hashes queued or running.")
+metrics.define_gauge("mvp_session_cache_entries", "Cached auth sessions.")
+metrics.define_gauge("mvp_pg_pool_size", "Postgres pool connections, by state.")
+metrics.define_counter("mvp_jobs_reaped_total", "Running jobs whose lease expired, by outcome (requeued/failed).")
+metrics.define_counter("mvp_job_leases_lost_total", "Leases this worker failed to renew; the job was reaped or finished elsewhere.")
+metrics.define_counter("mvp_result_cache_hits_total", "Jobs completed from the result cache, by where the hit happened.")
 
 
 def _now_utc() -> datetime:
@@ -64,6 +133,66 @@ def _running_stale_seconds() -> int:
     return max(30, min(86400, value))
 
 
+def _job_lease_seconds() -> int:
+    return _env_int("MVP_JOB_LEASE_SECONDS", 30, 5, 3600)
+
+
+def _job_reaper_seconds() -> float:
+    raw = (os.getenv("MVP_JOB_REAPER_INTERVAL_SECONDS") or "5").strip()
+    try:
+        value = float(raw)
+    except Exception:
+        value = 5.0
+    return max(1.0, min(300.0, value))
+
+
+def _worker_fallback_poll_seconds() -> float:
+    raw = (os.getenv("MVP_WORKER_FALLBACK_POLL_SECONDS") or "10").strip()
+    try:
+        value = float(raw)
+    except Exception:
+        value = 10.0
+    # Stay under the 30s heartbeat window checked by /api/ready.
+    return max(1.0, min(25.0, value))
+
+
+def _worker_concurrency() -> int:
+    raw = (os.getenv("MVP_WORKER_CONCURRENCY") or "4").strip()
+    try:
+        value = int(raw)
+    except Exception:
+        value = 4
+    return max(1, min(1000, value))
+
+
+def _balance_reconcile_seconds() -> int:
+    raw = (os.getenv("MVP_BALANCE_RECONCILE_SECONDS") or "3600").strip()
+    try:
+        value = int(raw)
+    except Exception:
+        value = 3600
+    # 0 disables the background pass.
+    return 0 if value <= 0 else max(60, min(86400, value))
+
+
+def _session_cache_seconds() -> float:
+    raw = (os.getenv("AUTH_SESSION_CACHE_SECONDS") or "30").strip()
+    try:
+        value = float(raw)
+    except Exception:
+        value = 30.0
+    return max(0.0, min(600.0, value))
+
+
+def _session_flush_seconds() -> float:
+    raw = (os.getenv("AUTH_SESSION_TOUCH_FLUSH_SECONDS") or "5").strip()
+    try:
+        value = float(raw)
+    except Exception:
+        value = 5.0
+    return max(0.5, min(300.0, value))
+
+
 def _require_env(name: str) -> str:
     value = (os.getenv(name) or "").strip()
     if not value:
@@ -71,22 +200,97 @@ def _require_env(name: str) -> str:
     return value
 
 
-def _connect_postgres():
+def _env_int(name: str, default: int, lo: int, hi: int) -> int:
+    raw = (os.getenv(name) or str(default)).strip()
+    try:
+        value = int(raw)
+    except Exception:
+        value = default
+    return max(lo, min(hi, value))
+
+
+def _pg_pool():
     dsn = _require_env("DATABASE_URL")
+    pool = _PG_POOL_STATE.get("pool")
+    if pool is not None and _PG_POOL_STATE.get("dsn") == dsn:
+        return pool
     try:
-        import psycopg
         from psycopg.rows import dict_row
+        from psycopg_pool import ConnectionPool
     except Exception as exc:
-        raise HTTPException(status_code=500, detail="psycopg is not installed") from exc
+        raise HTTPException(status_code=500, detail="psycopg / psycopg_pool is not installed") from exc
+    with _PG_POOL_LOCK:
+        pool = _PG_POOL_STATE.get("pool")
+        if pool is not None and _PG_POOL_STATE.get("dsn") == dsn:
+            return pool
+        if pool is not None:
+            pool.close()
+        min_size = _env_int("MVP_PG_POOL_MIN", 2, 0, 100)
+        pool = ConnectionPool(
+            dsn,
+            min_size=min_size,
+            max_size=_env_int("MVP_PG_POOL_MAX", 10, max(1, min_size), 200),
+            max_idle=float(_env_int("MVP_PG_POOL_MAX_IDLE_SECONDS", 300, 10, 86400)),
+            timeout=float(_env_int("MVP_PG_POOL_TIMEOUT_SECONDS", 10, 1, 300)),
+            check=ConnectionPool.check_connection,
+            kwargs={"row_factory": dict_row},
+            name="mvp",
+            open=True,
+        )
+        _PG_POOL_STATE["pool"] = pool
+        _PG_POOL_STATE["dsn"] = dsn
+        return pool
+
+
+def close_postgres_pool() -> None:
+    with _PG_POOL_LOCK:
+        pool = _PG_POOL_STATE.get("pool")
+        _PG_POOL_STATE["pool"] = None
+        _PG_POOL_STATE["dsn"] = ""
+    if pool is not None:
+        pool.close()
+
+
+@contextmanager
+def _connect_postgres():
+    pool = _pg_pool()
+    started = time.perf_counter()
     try:
-        conn = psycopg.connect(dsn)
-        conn.row_factory = dict_row
-        return conn
+        conn = pool.getconn()
     except Exception as exc:
+        metrics.inc("mvp_pg_pool_errors_total")
         raise HTTPException(status_code=503, detail=f"Cannot connect to Postgres: {exc}") from exc
+    acquired = time.perf_counter()
+    metrics.observe("mvp_pg_pool_wait_seconds", acquired - started)
+    outcome = "commit"
+    # Same exit semantics as `with psycopg.connect()`: commit on success, rollback on error.
+    try:
+        yield conn
+        if not conn.closed:
+            conn.commit()
+    except BaseException:
+        outcome = "rollback"
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        pool.putconn(conn)
+        metrics.observe("mvp_pg_session_seconds", time.perf_counter() - acquired, outcome=outcome)
+
 
+def _pbkdf2_iterations() -> int:
+    raw = (os.getenv("AUTH_PBKDF2_ITERATIONS") or "390000").strip()
+    try:
+        value = int(raw)
+    except Exception:
+        value = 390000
+    return max(100000, min(5000000, value))
 
-def _hash_password(password: str, *, iterations: int = 390000) -> str:
+
+def _hash_password(password: str, *, iterations: Optional[int] = None) -> str:
+    iterations = int(iterations or _pbkdf2_iterations())
     salt = secrets.token_hex(16)
     digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), iterations).hex()
     return f"pbkdf2_sha256${iterations}${salt}${digest}"
@@ -104,6 +308,55 @@ def _verify_password(password: str, password_hash: str) -> bool:
     return secrets.compare_digest(check, digest)
 
 
+def _password_needs_rehash(password_hash: str) -> bool:
+    try:
+        algo, iter_raw, _, _ = password_hash.split("$", 3)
+        return algo != "pbkdf2_sha256" or int(iter_raw) < _pbkdf2_iterations()
+    except Exception:
+        return True
+
+
+def _hash_executor() -> ThreadPoolExecutor:
+    executor = _HASH_STATE.get("executor")
+    if executor is None:
+        raw = (os.getenv("AUTH_HASH_WORKERS") or "").strip()
+        try:
+            workers = int(raw) if raw else min(4, os.cpu_count() or 1)
+        except Exception:
+            workers = 2
+        # pbkdf2_hmac drops the GIL, so a small thread pool hashes in parallel.
+        executor = ThreadPoolExecutor(max_workers=max(1, min(32, workers)), thread_name_prefix="auth-hash")
+        _HASH_STATE["executor"] = executor
+    return executor
+
+
+def _hash_max_queue() -> int:
+    raw = (os.getenv("AUTH_HASH_MAX_QUEUE") or "32").strip()
+    try:
+        value = int(raw)
+    except Exception:
+        value = 32
+    return max(1, min(10000, value))
+
+
+def _hash_release(_fut: Any) -> None:
+    with _HASH_LOCK:
+        _HASH_STATE["depth"] = max(0, int(_HASH_STATE.get("depth") or 0) - 1)
+
+
+async def _run_password_work(fn: Any, *args: Any) -> Any:
+    with _HASH_LOCK:
+        if int(_HASH_STATE.get("depth") or 0) >= _hash_max_queue():
+            _HASH_STATE["shed_total"] = int(_HASH_STATE.get("shed_total") or 0) + 1
+            raise HTTPException(status_code=503, detail="auth is busy, retry shortly", headers={"Retry-After": "1"})
+        _HASH_STATE["depth"] = int(_HASH_STATE.get("depth") or 0) + 1
+        executor = _hash_executor()
+    fut = executor.submit(fn, *args)
+    # Released when the hash finishes, even if the request was cancelled meanwhile.
+    fut.add_done_callback(_hash_release)
+    return await asyncio.wrap_future(fut)
+
+
 def _hash_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
@@ -150,53 +403,139 @@ def _login_limits() -> Tuple[int, int, int]:
     return max(60, window_s), max(1, max_attempts), max(60, lock_s)
 
 
-def _prune_login_state(now: datetime, window_s: int) -> None:
-    threshold = now - timedelta(seconds=window_s)
-    for key in list(_LOGIN_ATTEMPTS.keys()):
-        arr = [t for t in _LOGIN_ATTEMPTS.get(key, []) if t >= threshold]
-        if arr:
-            _LOGIN_ATTEMPTS[key] = arr
-        else:
-            _LOGIN_ATTEMPTS.pop(key, None)
-    for key in list(_LOGIN_LOCKED_UNTIL.keys()):
-        if _LOGIN_LOCKED_UNTIL[key] <= now:
-            _LOGIN_LOCKED_UNTIL.pop(key, None)
+def _login_store() -> str:
+    return "postgres" if (os.getenv("AUTH_LOGIN_THROTTLE_STORE") or "").strip().lower() == "postgres" else "memory"
+
+
+def _login_shard(key: str) -> Dict[str, Any]:
+    return _LOGIN_SHARDS[int(hashlib.blake2b(key.encode("utf-8"), digest_size=2).hexdigest(), 16) % _LOGIN_SHARD_COUNT]
+
+
+def _expire_login_shard(shard: Dict[str, Any], now: float, window_s: int) -> None:
+    # Amortized O(1): each recorded failure / lock is popped exactly once.
+    attempts: Dict[str, deque] = shard["attempts"]
+    attempt_expiry: deque = shard["attempt_expiry"]
+    while attempt_expiry and attempt_expiry[0][0] <= now:
+        _, key = attempt_expiry.popleft()
+        arr = attempts.get(key)
+        if arr is None:
+            continue
+        while arr and arr[0] <= now - window_s:
+            arr.popleft()
+        if not arr:
+            attempts.pop(key, None)
+    locked: Dict[str, float] = shard["locked"]
+    lock_expiry: deque = shard["lock_expiry"]
+    while lock_expiry and lock_expiry[0][0] <= now:
+        _, key = lock_expiry.popleft()
+        until = locked.get(key)
+        if until is not None and until <= now:
+            locked.pop(key, None)
 
 
 def _assert_login_allowed(email: str, ip: str) -> None:
-    now = _now_utc()
     window_s, _, _ = _login_limits()
     key = _login_key(email, ip)
-    with _AUTH_LOCK:
-        _prune_login_state(now, window_s)
-        until = _LOGIN_LOCKED_UNTIL.get(key)
+    if _login_store() == "postgres":
+        with _connect_postgres() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT EXTRACT(EPOCH FROM (locked_until - now()))::int AS wait_s
+                    FROM auth_login_throttle
+                    WHERE key = %s AND locked_until > now()
+                    """,
+                    (key,),
+                )
+                row = cur.fetchone()
+        if row:
+            raise HTTPException(status_code=429, detail=f"too many login attempts, retry in {int(row['wait_s'])}s")
+        return
+    now = time.monotonic()
+    shard = _login_shard(key)
+    with shard["lock"]:
+        _expire_login_shard(shard, now, window_s)
+        until = shard["locked"].get(key)
         if until and until > now:
-            wait_s = int((until - now).total_seconds())
+            wait_s = int(until - now)
             raise HTTPException(status_code=429, detail=f"too many login attempts, retry in {wait_s}s")
 
 
 def _register_login_failure(email: str, ip: str) -> None:
-    now = _now_utc()
     window_s, max_attempts, lock_s = _login_limits()
     key = _login_key(email, ip)
-    with _AUTH_LOCK:
-        _prune_login_state(now, window_s)
-        arr = _LOGIN_ATTEMPTS.get(key, [])
+    if _login_store() == "postgres":
+        with _connect_postgres() as conn:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO auth_login_throttle (key, failures, window_started_at, locked_until, updated_at)
+                        VALUES (%s, 1, now(), NULL, now())
+                        ON CONFLICT (key) DO UPDATE SET
+                          failures = CASE
+                            WHEN auth_login_throttle.window_started_at <= now() - make_interval(secs => %s) THEN 1
+                            ELSE auth_login_throttle.failures + 1
+                          END,
+                          window_started_at = CASE
+                            WHEN auth_login_throttle.window_started_at <= now() - make_interval(secs => %s) THEN now()
+                            ELSE auth_login_throttle.window_started_at
+                          END,
+                          updated_at = now()
+                        RETURNING failures
+                        """,
+                        (key, window_s, window_s),
+                    )
+                    failures = int((cur.fetchone() or {}).get("failures") or 0)
+                    if failures >= max_attempts:
+                        cur.execute(
+                            "UPDATE auth_login_throttle SET locked_until = now() + make_interval(secs => %s) WHERE key = %s",
+                            (lock_s, key),
+                        )
+                    # Bounded cleanup of idle rows keeps the table small without a separate job.
+                    cur.execute(
+                        """
+                        DELETE FROM auth_login_throttle
+                        WHERE key IN (
+                          SELECT key FROM auth_login_throttle
+                          WHERE updated_at < now() - make_interval(secs => %s)
+                            AND (locked_until IS NULL OR locked_until < now())
+                          LIMIT 50
+                        )
+                        """,
+                        (max(window_s, lock_s),),
+                    )
+        return
+    now = time.monotonic()
+    shard = _login_shard(key)
+    with shard["lock"]:
+        _expire_login_shard(shard, now, window_s)
+        arr = shard["attempts"].setdefault(key, deque())
         arr.append(now)
-        _LOGIN_ATTEMPTS[key] = arr
+        shard["attempt_expiry"].append((now + window_s, key))
         if len(arr) >= max_attempts:
-            _LOGIN_LOCKED_UNTIL[key] = now + timedelta(seconds=lock_s)
+            shard["locked"][key] = now + lock_s
+            shard["lock_expiry"].append((now + lock_s, key))
 
 
 def _register_login_success(email: str, ip: str) -> None:
     key = _login_key(email, ip)
-    with _AUTH_LOCK:
-        _LOGIN_ATTEMPTS.pop(key, None)
-        _LOGIN_LOCKED_UNTIL.pop(key, None)
+    if _login_store() == "postgres":
+        with _connect_postgres() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM auth_login_throttle WHERE key = %s", (key,))
+        return
+    shard = _login_shard(key)
+    with shard["lock"]:
+        shard["attempts"].pop(key, None)
+        shard["locked"].pop(key, None)
 
 
-def _parse_bearer_token(req: Request) -> str:
+def _parse_bearer_token(req: Request, allow_query: bool = False) -> str:
     auth = (req.headers.get("authorization") or "").strip()
+    if allow_query and not auth:
+        # EventSource cannot set headers, so streams may pass the session token as ?access_token=.
+        auth = f"Bearer {(req.query_params.get('access_token') or '').strip()}"
     if not auth.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing bearer token")
     token = auth.split(" ", 1)[1].strip()
@@ -206,11 +545,50 @@ def _parse_bearer_token(req: Request) -> str:
 
 
 def _current_balance(cur: Any, user_id: str) -> int:
+    cur.execute("SELECT balance FROM user_balances WHERE user_id = %s", (user_id,))
+    row = cur.fetchone()
+    if row:
+        return int(row.get("balance") or 0)
     cur.execute("SELECT COALESCE(SUM(amount), 0) AS balance FROM credit_ledger WHERE user_id = %s", (user_id,))
     row = cur.fetchone()
     return int((row or {}).get("balance") or 0)
 
 
+def _lock_balance(cur: Any, user_id: str) -> Optional[int]:
+    # The user_balances row is the per-user write lock for every ledger insert.
+    cur.execute("SELECT balance FROM user_balances WHERE user_id = %s FOR UPDATE", (user_id,))
+    row = cur.fetchone()
+    if row:
+        return int(row.get("balance") or 0)
+    cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
+    if not cur.fetchone():
+        return None
+    # First ledger write for this user: seed the checkpoint from history once.
+    cur.execute(
+        """
+        INSERT INTO user_balances (user_id, balance, updated_at)
+        SELECT %s, COALESCE(SUM(amount), 0), now()
+        FROM credit_ledger
+        WHERE user_id = %s
+        ON CONFLICT (user_id) DO NOTHING
+        """,
+        (user_id, user_id),
+    )
+    cur.execute("SELECT balance FROM user_balances WHERE user_id = %s FOR UPDATE", (user_id,))
+    return int((cur.fetchone() or {}).get("balance") or 0)
+
+
+def _apply_balance_delta(cur: Any, user_id: str, ledger_id: str, amount: int) -> None:
+    cur.execute(
+        """
+        UPDATE user_balances
+        SET balance = balance + %s, last_ledger_id = %s, updated_at = now(), reconciled_at = NULL
+        WHERE user_id = %s
+        """,
+        (amount, ledger_id, user_id),
+    )
+
+
 def _admin_token_ok(req: Request) -> bool:
     expected = (os.getenv("ADMIN_TOKEN") or "").strip()
     if not expected:
@@ -219,11 +597,120 @@ def _admin_token_ok(req: Request) -> bool:
     return bool(supplied) and secrets.compare_digest(supplied, expected)
 
 
-def _auth_user_from_token(req: Request) -> Dict[str, Any]:
-    token = _parse_bearer_token(req)
+def _session_cache_get(token_hash: str) -> Optional[Dict[str, Any]]:
+    with _SESSION_LOCK:
+        hit = _SESSION_CACHE.get(token_hash)
+        if not hit:
+            return None
+        if hit[0] <= time.monotonic():
+            _SESSION_CACHE.pop(token_hash, None)
+            return None
+        return hit[1]
+
+
+def _session_cache_put(token_hash: str, row: Dict[str, Any]) -> None:
+    ttl = _session_cache_seconds()
+    if ttl <= 0:
+        return
+    now = time.monotonic()
+    with _SESSION_LOCK:
+        if len(_SESSION_CACHE) >= _SESSION_CACHE_MAX:
+            for key in [k for k, (until, _) in _SESSION_CACHE.items() if until <= now]:
+                _SESSION_CACHE.pop(key, None)
+            if len(_SESSION_CACHE) >= _SESSION_CACHE_MAX:
+                _SESSION_CACHE.clear()
+        _SESSION_CACHE[token_hash] = (now + ttl, row)
+
+
+def _session_cache_invalidate(token_hash: str) -> None:
+    with _SESSION_LOCK:
+        _SESSION_CACHE.pop(token_hash, None)
+
+
+def _touch_session(session_id: str) -> None:
+    with _SESSION_LOCK:
+        _SESSION_TOUCHES[session_id] = _now_utc()
+
+
+def _flush_session_touches() -> int:
+    with _SESSION_LOCK:
+        pending = dict(_SESSION_TOUCHES)
+        _SESSION_TOUCHES.clear()
+    if not pending:
+        return 0
+    items = list(pending.items())
+    try:
+        with _connect_postgres() as conn:
+            with conn.cursor() as cur:
+                values = ", ".join(["(%s::uuid, %s::timestamptz)"] * len(items))
+                args: List[Any] = []
+                for session_id, used_at in items:
+                    args.extend([session_id, used_at])
+                cur.execute(
+                    f"""
+                    UPDATE auth_sessions AS s
+                    SET last_used_at = v.used_at
+                    FROM (VALUES {values}) AS v(id, used_at)
+                    WHERE s.id = v.id
+                      AND (s.last_used_at IS NULL OR s.last_used_at < v.used_at)
+                    """,
+                    args,
+                )
+    except Exception:
+        # Put the touches back so the next flush retries them.
+        with _SESSION_LOCK:
+            for session_id, used_at in items:
+                current = _SESSION_TOUCHES.get(session_id)
+                if current is None or current < used_at:
+                    _SESSION_TOUCHES[session_id] = used_at
+        raise
+    return len(items)
+
+
+async def _session_flush_loop() -> None:
+    while True:
+        await asyncio.sleep(_session_flush_seconds())
+        try:
+            await asyncio.to_thread(_flush_session_touches)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("session last_used_at flush failed: %s", exc)
+
+
+def start_session_flusher() -> Optional[asyncio.Task]:
+    global _SESSION_FLUSH_TASK
+    if not (os.getenv("DATABASE_URL") or "").strip():
+        return None
+    if _SESSION_FLUSH_TASK and not _SESSION_FLUSH_TASK.done():
+        return _SESSION_FLUSH_TASK
+    loop = asyncio.get_running_loop()
+    _SESSION_FLUSH_TASK = loop.create_task(_session_flush_loop(), name="mvp-session-flush")
+    return _SESSION_FLUSH_TASK
+
+
+async def stop_session_flusher() -> None:
+    global _SESSION_FLUSH_TASK
+    task = _SESSION_FLUSH_TASK
+    _SESSION_FLUSH_TASK = None
+    if task and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    try:
+        await asyncio.to_thread(_flush_session_touches)
+    except Exception as exc:
+        logger.warning("final session last_used_at flush failed: %s", exc)
+
+
+def _auth_user_from_token(req: Request, allow_query: bool = False) -> Dict[str, Any]:
+    token = _parse_bearer_token(req, allow_query=allow_query)
     token_hash = _hash_token(token)
-    with _connect_postgres() as conn:
-        with conn:
+    row = _session_cache_get(token_hash)
+    if row is None:
+        with _connect_postgres() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -242,23 +729,26 @@ def _auth_user_from_token(req: Request) -> Dict[str, Any]:
                     (token_hash,),
                 )
                 row = cur.fetchone()
-                if not row:
-                    raise HTTPException(status_code=401, detail="Invalid auth token")
-                expires_at = row.get("expires_at")
-                if not expires_at or expires_at <= _now_utc():
-                    raise HTTPException(status_code=401, detail="Session expired")
-                if not bool(row.get("is_active")):
-                    raise HTTPException(status_code=403, detail="User is disabled")
-                cur.execute("UPDATE auth_sessions SET last_used_at = now() WHERE id = %s", (row["session_id"],))
-
-                req.state.user_id = str(row["user_id"])
-                req.state.session_id = str(row["session_id"])
-                return {
-                    "id": str(row["user_id"]),
-                    "email": str(row["email"]),
-                    "session_id": str(row["session_id"]),
-                    "expires_at": row["expires_at"].isoformat() if row.get("expires_at") else None,
-                }
+        if not row:
+            raise HTTPException(status_code=401, detail="Invalid auth token")
+        _session_cache_put(token_hash, row)
+
+    expires_at = row.get("expires_at")
+    if not expires_at or expires_at <= _now_utc():
+        _session_cache_invalidate(token_hash)
+        raise HTTPException(status_code=401, detail="Session expired")
+    if not bool(row.get("is_active")):
+        raise HTTPException(status_code=403, detail="User is disabled")
+    _touch_session(str(row["session_id"]))
+
+    req.state.user_id = str(row["user_id"])
+    req.state.session_id = str(row["session_id"])
+    return {
+        "id": str(row["user_id"]),
+        "email": str(row["email"]),
+        "session_id": str(row["session_id"]),
+        "expires_at": row["expires_at"].isoformat() if row.get("expires_at") else None,
+    }
 
 
 def _issue_session(cur: Any, user_id: str) -> Tuple[str, str]:
@@ -305,6 +795,15 @@ class JobCreateIn(BaseModel):
     idempotency_key: str = Field(default="", max_length=200)
 
 
+class JobBatchCreateIn(BaseModel):
+    jobs: List[JobCreateIn] = Field(min_length=1, max_length=5000)
+
+
+class PlanAssignIn(BaseModel):
+    user_id: str = Field(min_length=36, max_length=36)
+    plan_id: str = Field(default="", max_length=120)
+
+
 class CreditAdjustmentIn(BaseModel):
     user_id: str = Field(min_length=36, max_length=36)
     amount: int = Field(ge=-1_000_000, le=1_000_000)
@@ -349,15 +848,18 @@ def _parse_stripe_event(payload: bytes, signature_header: str) -> Dict[str, Any]
     return event
 
 
-def _resolve_checkout_credits(session: Dict[str, Any]) -> int:
+def _checkout_metadata(session: Dict[str, Any]) -> Dict[str, Any]:
     metadata = session.get("metadata") or {}
     if isinstance(metadata, str):
         try:
             metadata = json.loads(metadata)
         except Exception:
             metadata = {}
-    if not isinstance(metadata, dict):
-        metadata = {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def _resolve_checkout_credits(session: Dict[str, Any]) -> int:
+    metadata = _checkout_metadata(session)
     raw = metadata.get("credits")
     if raw is None:
         return 0
@@ -369,14 +871,7 @@ def _resolve_checkout_credits(session: Dict[str, Any]) -> int:
 
 
 def _resolve_checkout_user_id(session: Dict[str, Any]) -> str:
-    metadata = session.get("metadata") or {}
-    if isinstance(metadata, str):
-        try:
-            metadata = json.loads(metadata)
-        except Exception:
-            metadata = {}
-    if not isinstance(metadata, dict):
-        metadata = {}
+    metadata = _checkout_metadata(session)
     user_id = str(metadata.get("user_id") or "").strip()
     if user_id:
         return user_id
@@ -412,13 +907,18 @@ def _apply_checkout_completed(cur: Any, event: Dict[str, Any]) -> Tuple[str, Opt
     if credits <= 0:
         return "failed", "missing positive credits value in metadata.credits"
 
-    cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
-    if not cur.fetchone():
+    balance_before = _lock_balance(cur, user_id)
+    if balance_before is None:
         return "failed", f"user not found: {user_id}"
-
-    balance_before = _current_balance(cur, user_id)
     balance_after = balance_before + credits
 
+    # Checkout sessions created for a plan carry metadata.plan_id; plain top-ups leave the plan alone.
+    plan_id = str(_checkout_metadata(session).get("plan_id") or "").strip()
+    if plan_id:
+        plan_error = _assign_user_plan(cur, user_id, plan_id)
+        if plan_error:
+            return "failed", plan_error
+
     ledger_id = str(uuid.uuid4())
     source_id = str(session.get("id") or event_id)
     idem_key = f"stripe:{event_id}:topup"
@@ -438,7 +938,8 @@ def _apply_checkout_completed(cur: Any, event: Dict[str, Any]) -> Tuple[str, Opt
         """,
         (ledger_id, user_id, credits, balance_after, source_id, idem_key, json.dumps(meta)),
     )
-    cur.fetchone()
+    if cur.fetchone():
+        _apply_balance_delta(cur, user_id, ledger_id, credits)
     return "processed", None
 
 
@@ -449,7 +950,7 @@ def _process_event_in_tx(event: Dict[str, Any]) -> Dict[str, Any]:
         raise HTTPException(status_code=400, detail="Stripe event missing id/type")
 
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -479,9 +980,178 @@ def _process_event_in_tx(event: Dict[str, Any]) -> Dict[str, Any]:
                     """,
                     (status, error_text, event_id),
                 )
+                if status == "failed":
+                    ops = _ops_counters()
+                    _bump_ops_metric(ops, "webhook_failed")
+                    _flush_ops_counters(cur, ops)
                 return {"status": status, "event_id": event_id, "event_type": event_type, "error_text": error_text}
 
 
+def _duration_bucket_label(seconds: float) -> str:
+    for bound in _JOB_DURATION_BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+def _ops_counters() -> Dict[str, Dict[Any, Any]]:
+    return {"status": {}, "rollup": {}}
+
+
+def _bump_ops_metric(
+    ops: Dict[str, Dict[Any, Any]], metric: str, count: int = 1, value: float = 0.0, label: str = ""
+) -> None:
+    total = ops["rollup"].setdefault((metric, label), [0, 0.0])
+    total[0] += int(count)
+    total[1] += float(value)
+
+
+def _record_job_duration(ops: Dict[str, Dict[Any, Any]], row: Optional[Dict[str, Any]]) -> None:
+    seconds = (row or {}).get("duration_s")
+    if seconds is None:
+        return
+    seconds = max(0.0, float(seconds))
+    _bump_ops_metric(ops, "job_duration", 1, seconds, _duration_bucket_label(seconds))
+
+
+def _move_job_status(ops: Dict[str, Dict[Any, Any]], from_status: Optional[str], to_status: str, n: int = 1) -> None:
+    if n <= 0:
+        return
+    counts = ops["status"]
+    counts[to_status] = counts.get(to_status, 0) + n
+    if from_status:
+        counts[from_status] = counts.get(from_status, 0) - n
+
+
+def _flush_ops_counters(cur: Any, ops: Dict[str, Dict[Any, Any]]) -> None:
+    # Last statements of the transaction, rows always in the same order: counter row locks
+    # are held only until commit and two transactions never take them crosswise.
+    # One random shard per transaction keeps concurrent workers off the same rows.
+    shard = random.randrange(_OPS_STATUS_SHARDS)
+    status_rows = [(status, n) for status, n in sorted(ops["status"].items()) if n]
+    if status_rows:
+        cur.execute(
+            f"""
+            INSERT INTO ops_job_status_counts (status, shard, n)
+            VALUES {", ".join(["(%s, %s, %s)"] * len(status_rows))}
+            ON CONFLICT (status, shard) DO UPDATE SET n = ops_job_status_counts.n + excluded.n
+            """,
+            [v for status, n in status_rows for v in (status, shard, n)],
+        )
+    rollup_rows = sorted(ops["rollup"].items())
+    if rollup_rows:
+        cur.execute(
+            f"""
+            INSERT INTO ops_metrics_rollup (bucket_start, metric, label, shard, count, sum)
+            VALUES {", ".join([f"({_OPS_BUCKET_SQL}, %s, %s, %s, %s, %s)"] * len(rollup_rows))}
+            ON CONFLICT (bucket_start, metric, label, shard) DO UPDATE
+              SET count = ops_metrics_rollup.count + excluded.count,
+                  sum = ops_metrics_rollup.sum + excluded.sum
+            """,
+            [v for (metric, label), (count, total) in rollup_rows for v in (metric, label, shard, count, total)],
+        )
+    ops["status"].clear()
+    ops["rollup"].clear()
+
+
+def _user_max_running_default() -> int:
+    # Defaults to the worker concurrency, the per-user limit before fair claiming existed.
+    return _env_int("MVP_USER_MAX_RUNNING", _worker_concurrency(), 1, 1000)
+
+
+def _assign_user_plan(cur: Any, user_id: str, plan_id: str) -> Optional[str]:
+    # The queue row takes the new weight and cap now, not on the user's next submission.
+    if plan_id:
+        cur.execute("SELECT 1 FROM plans WHERE id = %s", (plan_id,))
+        if not cur.fetchone():
+            return f"plan not found: {plan_id}"
+    cur.execute("UPDATE users SET plan_id = %s WHERE id = %s", (plan_id or None, user_id))
+    if not int(cur.rowcount or 0):
+        return f"user not found: {user_id}"
+    cur.execute(
+        """
+        UPDATE job_queue_users AS q
+        SET weight = COALESCE(p.priority_weight, 1),
+            max_running = COALESCE(p.max_running_jobs, %s),
+            updated_at = now()
+        FROM users u
+        LEFT JOIN plans p ON p.id = u.plan_id
+        WHERE u.id = q.user_id AND q.user_id = %s
+        """,
+        (_user_max_running_default(), user_id),
+    )
+    return None
+
+
+def _queue_user_enqueue(cur: Any, user_id: str) -> None:
+    # Touch job_queue_users before ops counters everywhere: claims lock it first, then the counters.
+    # A user coming back from idle starts at the current minimum pass, not with banked credit.
+    cur.execute(
+        """
+        INSERT INTO job_queue_users AS q (user_id, running, ready_at, pass, weight, max_running, updated_at)
+        SELECT u.id, 0, now(),
+          COALESCE((SELECT MIN(pass) FROM job_queue_users WHERE ready_at IS NOT NULL), 0),
+          COALESCE(p.priority_weight, 1), COALESCE(p.max_running_jobs, %s), now()
+        FROM users u
+        LEFT JOIN plans p ON p.id = u.plan_id
+        WHERE u.id = %s
+        ON CONFLICT (user_id) DO UPDATE
+          SET pass = CASE WHEN q.ready_at IS NULL AND q.running = 0 THEN GREATEST(q.pass, excluded.pass) ELSE q.pass END,
+              ready_at = LEAST(q.ready_at, excluded.ready_at),
+              weight = excluded.weight,
+              max_running = excluded.max_running,
+              updated_at = now()
+        """,
+        (_user_max_running_default(), user_id),
+    )
+
+
+def _queue_user_release(cur: Any, user_id: str, requeued_at: Optional[datetime] = None) -> None:
+    cur.execute(
+        """
+        UPDATE job_queue_users
+        SET running = GREATEST(running - 1, 0),
+            ready_at = LEAST(ready_at, %s::timestamptz),
+            updated_at = now()
+        WHERE user_id = %s
+        RETURNING ready_at
+        """,
+        (requeued_at, user_id),
+    )
+    row = cur.fetchone()
+    if requeued_at is None and row and row.get("ready_at") is not None:
+        # The freed slot may unblock this user's next queued job on another worker.
+        _notify_jobs(cur)
+
+
+def _fair_share(users: List[Dict[str, Any]], limit: int) -> Dict[str, int]:
+    # Stride scheduling: each slot goes to the lowest-pass user with spare capacity, whose pass then
+    # advances by 1 / weight. Heavier plans get proportionally more turns; nobody waits a full round.
+    heap = [(float(u["pass"]), str(u["user_id"])) for u in users]
+    heapq.heapify(heap)
+    by_id = {str(u["user_id"]): u for u in users}
+    slots: Dict[str, int] = {}
+    given = 0
+    while heap and given < limit:
+        pass_value, user_id = heapq.heappop(heap)
+        user = by_id[user_id]
+        slots[user_id] = slots.get(user_id, 0) + 1
+        given += 1
+        if int(user["running"]) + slots[user_id] < int(user["max_running"]):
+            heapq.heappush(heap, (pass_value + 1.0 / max(1, int(user["weight"])), user_id))
+    return slots
+
+
+def _notify_jobs(cur: Any, delay_seconds: int = 0) -> None:
+    # Delivered on commit; the payload tells listeners when the job becomes due.
+    cur.execute("SELECT pg_notify(%s, %s)", (_JOBS_CHANNEL, str(max(0, int(delay_seconds)))))
+
+
+def _notify_job_events(cur: Any, *job_ids: Any) -> None:
+    # Tells /api/jobs/{id}/stream hubs that a job has new job_events rows (sent on commit).
+    cur.executemany("SELECT pg_notify(%s, %s)", [(_JOB_EVENTS_CHANNEL, str(job_id)) for job_id in job_ids])
+
+
 def _resolve_idempotency_key(*values: Optional[str]) -> str:
     for raw in values:
         key = str(raw or "").strip()
@@ -493,18 +1163,224 @@ def _resolve_idempotency_key(*values: Optional[str]) -> str:
     return ""
 
 
+def _result_cache_ttl(provider: str, operation: str) -> int:
+    # MVP_RESULT_CACHE_OPERATIONS="image.generate=3600,replicate:image.upscale"; 0 = not cached.
+    provider = str(provider or "").strip().lower()
+    operation = str(operation or "").strip().lower()
+    for entry in (os.getenv("MVP_RESULT_CACHE_OPERATIONS") or "").split(","):
+        name, _, ttl = entry.strip().lower().partition("=")
+        if not name or name not in {operation, f"{provider}:{operation}"}:
+            continue
+        if not ttl.strip():
+            return _env_int("MVP_RESULT_CACHE_TTL_SECONDS", 86400, 60, 2592000)
+        try:
+            value = int(ttl)
+        except ValueError:
+            return _env_int("MVP_RESULT_CACHE_TTL_SECONDS", 86400, 60, 2592000)
+        return max(60, value) if value > 0 else 0
+    return 0
+
+
+def _result_cache_key(provider: str, operation: str, input_json: Optional[Dict[str, Any]]) -> str:
+    if _result_cache_ttl(provider, operation) <= 0:
+        return ""
+    canonical = json.dumps(
+        {
+            "provider": str(provider or "").strip().lower(),
+            "operation": str(operation or "").strip().lower(),
+            "input": input_json or {},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _result_cache_lookup(cur: Any, input_hash: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    # Lock order: cache key, then the in-flight leader row, then (in the caller) the balance row.
+    # Completion locks the leader row before any balance, so the two paths cannot deadlock, and
+    # FOR SHARE makes a completing leader wait until this attach commits (or vice versa).
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"job-cache:{input_hash}",))
+    cur.execute(
+        """
+        SELECT id
+        FROM jobs
+        WHERE input_hash = %s AND status = 'running'
+        ORDER BY created_at ASC
+        LIMIT 1
+        FOR SHARE
+        """,
+        (input_hash,),
+    )
+    leader = cur.fetchone()
+    if leader:
+        return str(leader["id"]), None
+    return "", _result_cache_get(cur, input_hash)
+
+
+def _result_cache_get(cur: Any, input_hash: str) -> Optional[Dict[str, Any]]:
+    cur.execute(
+        """
+        UPDATE job_result_cache
+        SET hits = hits + 1
+        WHERE input_hash = %s AND expires_at > now()
+        RETURNING provider_job_id, result_json, source_job_id
+        """,
+        (input_hash,),
+    )
+    return cur.fetchone()
+
+
+def _result_cache_store(cur: Any, job: Dict[str, Any], provider_job_id: str, result_json: Dict[str, Any]) -> None:
+    ttl = _result_cache_ttl(str(job.get("provider") or ""), str(job.get("operation") or ""))
+    if ttl <= 0 or bool(result_json.get("cache_hit")):
+        return
+    cur.execute(
+        """
+        INSERT INTO job_result_cache
+          (input_hash, provider, operation, provider_job_id, result_json, source_job_id, created_at, expires_at)
+        VALUES
+          (%s, %s, %s, %s, %s::jsonb, %s, now(), now() + make_interval(secs => %s))
+        ON CONFLICT (input_hash) DO UPDATE
+          SET provider_job_id = excluded.provider_job_id,
+              result_json = excluded.result_json,
+              source_job_id = excluded.source_job_id,
+              created_at = excluded.created_at,
+              expires_at = excluded.expires_at
+        """,
+        (
+            str(job["input_hash"]),
+            str(job.get("provider") or ""),
+            str(job.get("operation") or ""),
+            provider_job_id or None,
+            json.dumps(result_json),
+            str(job["id"]),
+            ttl,
+        ),
+    )
+
+
+def _complete_job_from_result(
+    cur: Any,
+    job_id: str,
+    user_id: str,
+    credits_cost: int,
+    from_status: str,
+    cached: Dict[str, Any],
+    ops: Dict[str, Dict[Any, Any]],
+) -> None:
+    # Same ledger path as a real success: the hold is released and the cost consumed.
+    _insert_ledger_release(cur, user_id, job_id, credits_cost, "release_on_success")
+    _insert_ledger_consume(cur, user_id, job_id, credits_cost)
+    _finish_job_from_result(cur, job_id, from_status, cached, ops)
+
+
+def _finish_job_from_result(
+    cur: Any, job_id: str, from_status: str, cached: Dict[str, Any], ops: Dict[str, Dict[Any, Any]]
+) -> None:
+    source_job_id = str(cached.get("source_job_id") or "")
+    result = dict(cached.get("result_json") or {})
+    result.update({"cache_hit": True, "cached_from_job_id": source_job_id})
+    cur.execute(
+        """
+        UPDATE jobs
+        SET status = 'succeeded',
+            provider_job_id = %s,
+            result_json = %s::jsonb,
+            last_error = NULL,
+            started_at = COALESCE(started_at, now()),
+            finished_at = now(),
+            updated_at = now()
+        WHERE id = %s
+        """,
+        (cached.get("provider_job_id") or None, json.dumps(result), job_id),
+    )
+    _move_job_status(ops, from_status, "succeeded")
+    cur.execute(
+        """
+        INSERT INTO job_events (job_id, event_type, payload, created_at)
+        VALUES (%s, 'succeeded', %s::jsonb, now())
+        """,
+        (job_id, json.dumps({"attempt": 0, "cache_hit": True, "source_job_id": source_job_id})),
+    )
+    _notify_job_events(cur, job_id)
+    metrics.inc("mvp_result_cache_hits_total", source=from_status)
+
+
+def _lock_attached_jobs(cur: Any, parent_id: str) -> List[Dict[str, Any]]:
+    cur.execute(
+        """
+        SELECT id, user_id, credits_cost
+        FROM jobs
+        WHERE cache_parent_job_id = %s AND status = 'attached'
+        ORDER BY id
+        FOR UPDATE
+        """,
+        (parent_id,),
+    )
+    return cur.fetchall() or []
+
+
+def _release_attached_jobs(cur: Any, parent_id: str, ops: Dict[str, Dict[Any, Any]]) -> int:
+    # The parent failed for good: attached jobs go back to the queue and run on their own.
+    cur.execute(
+        """
+        UPDATE jobs
+        SET status = 'queued',
+            cache_parent_job_id = NULL,
+            available_at = now(),
+            updated_at = now()
+        WHERE cache_parent_job_id = %s AND status = 'attached'
+        RETURNING id, user_id
+        """,
+        (parent_id,),
+    )
+    rows = cur.fetchall() or []
+    if not rows:
+        return 0
+    for user_id in sorted({str(row["user_id"]) for row in rows}):
+        _queue_user_enqueue(cur, user_id)
+    _move_job_status(ops, "attached", "queued", len(rows))
+    _notify_jobs(cur)
+    _notify_job_events(cur, *(row["id"] for row in rows))
+    return len(rows)
+
+
+def _is_idempotency_conflict(exc: BaseException) -> bool:
+    diag = getattr(exc, "diag", None)
+    return (
+        getattr(exc, "sqlstate", None) == "23505"
+        and getattr(diag, "constraint_name", None) == "idx_jobs_user_request_idempotency"
+    )
+
+
+def _retry_idempotency_conflict(fn: Any, *args: Any) -> Dict[str, Any]:
+    # A concurrent request committed the same idempotency key first; the retry answers as its replay.
+    try:
+        return fn(*args)
+    except Exception as exc:
+        if not _is_idempotency_conflict(exc):
+            raise
+    return fn(*args)
+
+
 def _create_job_with_credit_hold(user_id: str, data: JobCreateIn, request_idempotency_key: str = "") -> Dict[str, Any]:
+    return _retry_idempotency_conflict(_create_job_in_tx, user_id, data, request_idempotency_key)
+
+
+def _create_job_in_tx(user_id: str, data: JobCreateIn, request_idempotency_key: str) -> Dict[str, Any]:
     job_id = str(uuid.uuid4())
     hold_entry_id = str(uuid.uuid4())
     request_idempotency_key = _resolve_idempotency_key(request_idempotency_key)
+    input_hash = _result_cache_key(data.provider, data.operation, data.input)
 
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
-                cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
-                if not cur.fetchone():
-                    raise HTTPException(status_code=404, detail="user not found")
-
+                # Replays are answered before the cache lookup so they never count as cache hits.
+                # The lookup still runs before the balance lock, see _result_cache_lookup.
                 if request_idempotency_key:
                     cur.execute(
                         "SELECT pg_advisory_xact_lock(hashtext(%s))",
@@ -533,7 +1409,11 @@ def _create_job_with_credit_hold(user_id: str, data: JobCreateIn, request_idempo
                             "idempotent_replay": True,
                         }
 
-                balance_before = _current_balance(cur, user_id)
+                leader_id, cached = _result_cache_lookup(cur, input_hash) if input_hash else ("", None)
+                balance_before = _lock_balance(cur, user_id)
+                if balance_before is None:
+                    raise HTTPException(status_code=404, detail="user not found")
+
                 if balance_before < data.credits_cost:
                     raise HTTPException(
                         status_code=402,
@@ -565,45 +1445,59 @@ def _create_job_with_credit_hold(user_id: str, data: JobCreateIn, request_idempo
                         json.dumps(hold_meta),
                     ),
                 )
+                _apply_balance_delta(cur, user_id, hold_entry_id, -data.credits_cost)
 
+                status = "attached" if leader_id else "queued"
                 cur.execute(
                     """
                     INSERT INTO jobs
-                      (id, user_id, provider, operation, status, attempt_count, max_attempts, credits_cost, request_idempotency_key, available_at, input_json, created_at, updated_at)
+                      (id, user_id, provider, operation, status, attempt_count, max_attempts, credits_cost, request_idempotency_key, available_at, input_json, input_hash, cache_parent_job_id, created_at, updated_at)
                     VALUES
-                      (%s, %s, %s, %s, 'queued', 0, %s, %s, %s, now(), %s::jsonb, now(), now())
+                      (%s, %s, %s, %s, %s, 0, %s, %s, %s, now(), %s::jsonb, %s, %s, now(), now())
                     """,
                     (
                         job_id,
                         user_id,
                         data.provider,
                         data.operation,
+                        status,
                         data.max_attempts,
                         data.credits_cost,
                         request_idempotency_key or None,
                         json.dumps(data.input or {}),
+                        input_hash or None,
+                        leader_id or None,
                     ),
                 )
+                if status == "queued" and not cached:
+                    _queue_user_enqueue(cur, user_id)
+                ops = _ops_counters()
+                _move_job_status(ops, None, status)
+                queued_payload: Dict[str, Any] = {
+                    "credits_cost": data.credits_cost,
+                    "balance_before": balance_before,
+                    "balance_after": balance_after,
+                }
+                if leader_id:
+                    queued_payload["attached_to"] = leader_id
                 cur.execute(
                     """
                     INSERT INTO job_events (job_id, event_type, payload, created_at)
                     VALUES (%s, 'queued', %s::jsonb, now())
                     """,
-                    (
-                        job_id,
-                        json.dumps(
-                            {
-                                "credits_cost": data.credits_cost,
-                                "balance_before": balance_before,
-                                "balance_after": balance_after,
-                            }
-                        ),
-                    ),
+                    (job_id, json.dumps(queued_payload)),
                 )
+                # No job_events NOTIFY here: nobody can be streaming a job before its id is returned.
+                if cached:
+                    _complete_job_from_result(cur, job_id, user_id, data.credits_cost, "queued", cached, ops)
+                    status = "succeeded"
+                elif status == "queued":
+                    _notify_jobs(cur)
+                _flush_ops_counters(cur, ops)
 
                 return {
                     "id": job_id,
-                    "status": "queued",
+                    "status": status,
                     "user_id": user_id,
                     "provider": data.provider,
                     "operation": data.operation,
@@ -611,21 +1505,210 @@ def _create_job_with_credit_hold(user_id: str, data: JobCreateIn, request_idempo
                     "balance_after": balance_after,
                     "request_idempotency_key": request_idempotency_key or "",
                     "idempotent_replay": False,
+                    "cache_hit": bool(cached),
+                    "attached_to": leader_id or None,
                 }
 
 
+def _job_batch_max() -> int:
+    return _env_int("MVP_JOB_BATCH_MAX", 500, 1, 5000)
+
+
+def _create_jobs_batch(user_id: str, items: List[JobCreateIn], request_idempotency_key: str = "") -> Dict[str, Any]:
+    return _retry_idempotency_conflict(_create_jobs_batch_in_tx, user_id, items, request_idempotency_key)
+
+
+def _create_jobs_batch_in_tx(user_id: str, items: List[JobCreateIn], request_idempotency_key: str) -> Dict[str, Any]:
+    if len(items) > _job_batch_max():
+        raise HTTPException(status_code=400, detail=f"batch too large: max={_job_batch_max()}")
+    batch_key = _resolve_idempotency_key(request_idempotency_key)
+    keys: List[str] = []
+    for idx, item in enumerate(items):
+        # A batch-level Idempotency-Key covers items without their own key by position.
+        keys.append(_resolve_idempotency_key(item.idempotency_key, f"{batch_key}:{idx}" if batch_key else ""))
+    seen: set = set()
+    for key in keys:
+        if key and key in seen:
+            raise HTTPException(status_code=400, detail=f"duplicate idempotency key in batch: {key}")
+        seen.add(key)
+
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                # Same job-idem advisory locks as the single-job path, taken before the balance lock
+                # like there. Sorted by lock id so two batches never wait on each other crosswise.
+                if seen - {""}:
+                    cur.execute(
+                        """
+                        SELECT pg_advisory_xact_lock(h)
+                        FROM (
+                          SELECT DISTINCT hashtext(k) AS h FROM unnest(%s::text[]) AS k ORDER BY 1
+                        ) locks
+                        """,
+                        ([f"job-idem:{user_id}:{k}" for k in keys if k],),
+                    )
+                balance_before = _lock_balance(cur, user_id)
+                if balance_before is None:
+                    raise HTTPException(status_code=404, detail="user not found")
+
+                existing: Dict[str, Dict[str, Any]] = {}
+                if seen - {""}:
+                    # Replays report the balance stored on their own hold, not this batch's.
+                    cur.execute(
+                        """
+                        SELECT j.id, j.status, j.provider, j.operation, j.credits_cost, j.request_idempotency_key,
+                          l.balance_after
+                        FROM jobs j
+                        LEFT JOIN credit_ledger l ON l.idempotency_key = 'job:' || j.id::text || ':hold'
+                        WHERE j.user_id = %s AND j.request_idempotency_key = ANY(%s)
+                        """,
+                        (user_id, [k for k in keys if k]),
+                    )
+                    existing = {str(row["request_idempotency_key"]): row for row in (cur.fetchall() or [])}
+
+                fresh = [idx for idx, key in enumerate(keys) if not key or key not in existing]
+                total_cost = sum(int(items[idx].credits_cost) for idx in fresh)
+                if balance_before < total_cost:
+                    raise HTTPException(
+                        status_code=402,
+                        detail=f"insufficient credits: required={total_cost}, available={balance_before}",
+                    )
+
+                results: List[Dict[str, Any]] = []
+                job_ids: List[str] = []
+                ledger_ids: List[str] = []
+                balances: List[int] = []
+                running = balance_before
+                for idx, key in enumerate(keys):
+                    item = items[idx]
+                    if key and key in existing:
+                        row = existing[key]
+                        replayed: Dict[str, Any] = {
+                            "id": str(row["id"]),
+                            "status": str(row.get("status") or "queued"),
+                            "user_id": user_id,
+                            "provider": str(row.get("provider") or ""),
+                            "operation": str(row.get("operation") or ""),
+                            "credits_cost": int(row.get("credits_cost") or 0),
+                            "request_idempotency_key": key,
+                            "idempotent_replay": True,
+                        }
+                        if row.get("balance_after") is not None:
+                            replayed["balance_after"] = int(row["balance_after"])
+                        results.append(replayed)
+                        continue
+                    running -= int(item.credits_cost)
+                    job_ids.append(str(uuid.uuid4()))
+                    ledger_ids.append(str(uuid.uuid4()))
+                    balances.append(running)
+                    results.append(
+                        {
+                            "id": job_ids[-1],
+                            "status": "queued",
+                            "user_id": user_id,
+                            "provider": item.provider,
+                            "operation": item.operation,
+                            "credits_cost": item.credits_cost,
+                            "balance_after": running,
+                            "request_idempotency_key": key,
+                            "idempotent_replay": False,
+                        }
+                    )
+                if not job_ids:
+                    return {"jobs": results, "created": 0, "balance_after": balance_before}
+
+                new_items = [items[idx] for idx in fresh]
+                cur.execute(
+                    """
+                    INSERT INTO credit_ledger
+                      (id, user_id, entry_type, amount, balance_after, source_type, source_id, idempotency_key, meta, created_at)
+                    SELECT l.id, %s, 'hold', l.amount, l.balance_after, 'job', l.job_id::text,
+                      'job:' || l.job_id::text || ':hold', l.meta::jsonb, now()
+                    FROM unnest(%s::uuid[], %s::uuid[], %s::int[], %s::int[], %s::text[])
+                      AS l(id, job_id, amount, balance_after, meta)
+                    """,
+                    (
+                        user_id,
+                        ledger_ids,
+                        job_ids,
+                        [-int(item.credits_cost) for item in new_items],
+                        balances,
+                        [
+                            json.dumps(
+                                {
+                                    "job_id": job_id,
+                                    "provider": item.provider,
+                                    "operation": item.operation,
+                                    "kind": "reservation",
+                                }
+                            )
+                            for job_id, item in zip(job_ids, new_items)
+                        ],
+                    ),
+                )
+                _apply_balance_delta(cur, user_id, ledger_ids[-1], -total_cost)
+                cur.execute(
+                    """
+                    INSERT INTO jobs
+                      (id, user_id, provider, operation, status, attempt_count, max_attempts, credits_cost, request_idempotency_key, available_at, input_json, input_hash, created_at, updated_at)
+                    SELECT j.id, %s, j.provider, j.operation, 'queued', 0, j.max_attempts, j.credits_cost,
+                      NULLIF(j.idem_key, ''), now(), j.input_json::jsonb, NULLIF(j.input_hash, ''), now(), now()
+                    FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::int[], %s::int[], %s::text[], %s::text[], %s::text[])
+                      AS j(id, provider, operation, max_attempts, credits_cost, idem_key, input_json, input_hash)
+                    """,
+                    (
+                        user_id,
+                        job_ids,
+                        [item.provider for item in new_items],
+                        [item.operation for item in new_items],
+                        [int(item.max_attempts) for item in new_items],
+                        [int(item.credits_cost) for item in new_items],
+                        [keys[idx] for idx in fresh],
+                        [json.dumps(item.input or {}) for item in new_items],
+                        [_result_cache_key(item.provider, item.operation, item.input) for item in new_items],
+                    ),
+                )
+                _queue_user_enqueue(cur, user_id)
+                ops = _ops_counters()
+                _move_job_status(ops, None, "queued", len(job_ids))
+                cur.execute(
+                    """
+                    INSERT INTO job_events (job_id, event_type, payload, created_at)
+                    SELECT e.job_id, 'queued', e.payload::jsonb, now()
+                    FROM unnest(%s::uuid[], %s::text[]) AS e(job_id, payload)
+                    """,
+                    (
+                        job_ids,
+                        [
+                            json.dumps(
+                                {
+                                    "credits_cost": int(item.credits_cost),
+                                    "balance_before": after + int(item.credits_cost),
+                                    "balance_after": after,
+                                    "batch_size": len(job_ids),
+                                }
+                            )
+                            for item, after in zip(new_items, balances)
+                        ],
+                    ),
+                )
+                _notify_jobs(cur)
+                _flush_ops_counters(cur, ops)
+                return {"jobs": results, "created": len(job_ids), "balance_after": balances[-1]}
+
+
 def _apply_credit_adjustment(data: CreditAdjustmentIn) -> Dict[str, Any]:
     if data.amount == 0:
         raise HTTPException(status_code=400, detail="adjustment amount cannot be zero")
     idem_key = (data.idempotency_key or "").strip() or f"admin:adjust:{data.user_id}:{hashlib.sha1((data.reason + str(data.amount)).encode('utf-8')).hexdigest()}"
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
-                cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (data.user_id,))
-                if not cur.fetchone():
+                balance_before = _lock_balance(cur, data.user_id)
+                if balance_before is None:
                     raise HTTPException(status_code=404, detail="user not found")
-                balance_before = _current_balance(cur, data.user_id)
                 balance_after = balance_before + int(data.amount)
+                ledger_id = str(uuid.uuid4())
                 cur.execute(
                     """
                     INSERT INTO credit_ledger
@@ -636,7 +1719,7 @@ def _apply_credit_adjustment(data: CreditAdjustmentIn) -> Dict[str, Any]:
                     RETURNING id
                     """,
                     (
-                        str(uuid.uuid4()),
+                        ledger_id,
                         data.user_id,
                         int(data.amount),
                         balance_after,
@@ -647,6 +1730,8 @@ def _apply_credit_adjustment(data: CreditAdjustmentIn) -> Dict[str, Any]:
                 )
                 row = cur.fetchone()
                 applied = row is not None
+                if applied:
+                    _apply_balance_delta(cur, data.user_id, ledger_id, int(data.amount))
                 if not applied:
                     cur.execute(
                         """
@@ -683,12 +1768,12 @@ def _backoff_seconds(attempt_count: int) -> int:
 def _insert_ledger_release(cur: Any, user_id: str, job_id: str, credits_cost: int, reason: str) -> None:
     if credits_cost <= 0:
         return
-    cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
-    if not cur.fetchone():
+    balance_before = _lock_balance(cur, user_id)
+    if balance_before is None:
         return
-    balance_before = _current_balance(cur, user_id)
     balance_after = balance_before + credits_cost
     idem_key = f"job:{job_id}:{reason}"
+    ledger_id = str(uuid.uuid4())
     cur.execute(
         """
         INSERT INTO credit_ledger
@@ -696,9 +1781,10 @@ def _insert_ledger_release(cur: Any, user_id: str, job_id: str, credits_cost: in
         VALUES
           (%s, %s, 'release', %s, %s, 'job', %s, %s, %s::jsonb, now())
         ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
         """,
         (
-            str(uuid.uuid4()),
+            ledger_id,
             user_id,
             credits_cost,
             balance_after,
@@ -707,17 +1793,19 @@ def _insert_ledger_release(cur: Any, user_id: str, job_id: str, credits_cost: in
             json.dumps({"job_id": job_id, "reason": reason}),
         ),
     )
+    if cur.fetchone():
+        _apply_balance_delta(cur, user_id, ledger_id, credits_cost)
 
 
 def _insert_ledger_consume(cur: Any, user_id: str, job_id: str, credits_cost: int) -> None:
     if credits_cost <= 0:
         return
-    cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
-    if not cur.fetchone():
+    balance_before = _lock_balance(cur, user_id)
+    if balance_before is None:
         return
-    balance_before = _current_balance(cur, user_id)
     balance_after = balance_before - credits_cost
     idem_key = f"job:{job_id}:consume"
+    ledger_id = str(uuid.uuid4())
     cur.execute(
         """
         INSERT INTO credit_ledger
@@ -725,9 +1813,10 @@ def _insert_ledger_consume(cur: Any, user_id: str, job_id: str, credits_cost: in
         VALUES
           (%s, %s, 'consume', %s, %s, 'job', %s, %s, %s::jsonb, now())
         ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
         """,
         (
-            str(uuid.uuid4()),
+            ledger_id,
             user_id,
             -credits_cost,
             balance_after,
@@ -736,17 +1825,143 @@ def _insert_ledger_consume(cur: Any, user_id: str, job_id: str, credits_cost: in
             json.dumps({"job_id": job_id, "reason": "job_succeeded"}),
         ),
     )
+    if cur.fetchone():
+        _apply_balance_delta(cur, user_id, ledger_id, -credits_cost)
 
 
-def _replicate_run_prediction(input_json: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
-    try:
-        import requests
-    except Exception as exc:
-        raise RuntimeError("requests package missing for replicate provider") from exc
+def _replicate_api_base() -> str:
+    return (os.getenv("REPLICATE_API_BASE") or "https://api.replicate.com/v1").strip().rstrip("/")
+
 
+def _replicate_headers() -> Dict[str, str]:
     token = (os.getenv("REPLICATE_API_TOKEN") or "").strip()
     if not token:
         raise RuntimeError("REPLICATE_API_TOKEN missing for provider=replicate")
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
+def _replicate_poll_interval() -> float:
+    raw = (os.getenv("REPLICATE_POLL_INTERVAL_SECONDS") or "2").strip()
+    try:
+        value = float(raw)
+    except Exception:
+        value = 2.0
+    return max(0.01, min(60.0, value))
+
+
+def _provider_client():
+    # One AsyncClient per event loop, shared by every in-flight prediction.
+    loop = asyncio.get_running_loop()
+    client = _PROVIDER_STATE.get("client")
+    if client is not None and _PROVIDER_STATE.get("loop") is loop and not client.is_closed:
+        return client
+    try:
+        import httpx
+    except Exception as exc:
+        raise RuntimeError("httpx package missing for replicate provider") from exc
+    max_conn = _env_int("REPLICATE_MAX_CONNECTIONS", 20, 1, 1000)
+    client = httpx.AsyncClient(
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=max_conn, max_keepalive_connections=max_conn),
+    )
+    _PROVIDER_STATE["client"] = client
+    _PROVIDER_STATE["loop"] = loop
+    return client
+
+
+async def close_provider_client() -> None:
+    client = _PROVIDER_STATE.get("client")
+    _PROVIDER_STATE["client"] = None
+    _PROVIDER_STATE["loop"] = None
+    poll_task = _REPLICATE_POLL.get("task")
+    if poll_task and not poll_task.done():
+        poll_task.cancel()
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def _watch_prediction(prediction_id: str) -> "asyncio.Future[Dict[str, Any]]":
+    loop = asyncio.get_running_loop()
+    pending: Dict[str, asyncio.Future] = _REPLICATE_POLL["pending"]
+    fut = pending.get(prediction_id)
+    if fut is None or fut.done():
+        fut = loop.create_future()
+        pending[prediction_id] = fut
+    if _REPLICATE_POLL.get("wake") is None or _REPLICATE_POLL.get("loop") is not loop:
+        _REPLICATE_POLL["wake"] = asyncio.Event()
+        _REPLICATE_POLL["loop"] = loop
+    task = _REPLICATE_POLL.get("task")
+    if task is None or task.done():
+        _REPLICATE_POLL["task"] = loop.create_task(_prediction_poll_loop(), name="replicate-poller")
+    return fut
+
+
+def _prediction_pending(prediction_id: str) -> bool:
+    fut = _REPLICATE_POLL["pending"].get(prediction_id)
+    return fut is not None and not fut.done()
+
+
+def _poke_prediction_poller() -> None:
+    loop = _REPLICATE_POLL.get("loop")
+    wake = _REPLICATE_POLL.get("wake")
+    if loop is None or wake is None:
+        return
+    try:
+        loop.call_soon_threadsafe(wake.set)
+    except RuntimeError:
+        pass
+
+
+async def _fetch_prediction(prediction_id: str) -> Dict[str, Any]:
+    resp = await _provider_client().get(
+        f"{_replicate_api_base()}/predictions/{prediction_id}",
+        headers=_replicate_headers(),
+    )
+    if resp.status_code >= 300:
+        raise RuntimeError(f"replicate poll failed: {resp.status_code} {resp.text[:200]}")
+    return resp.json() or {}
+
+
+async def _prediction_poll_loop() -> None:
+    # One tick polls every in-flight prediction concurrently instead of one sleeping thread each.
+    pending: Dict[str, asyncio.Future] = _REPLICATE_POLL["pending"]
+    while pending:
+        wake: asyncio.Event = _REPLICATE_POLL["wake"]
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=_replicate_poll_interval())
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+        ids = [pid for pid, fut in pending.items() if not fut.done()]
+        if not ids:
+            continue
+        results = await asyncio.gather(*(_fetch_prediction(pid) for pid in ids), return_exceptions=True)
+        _REPLICATE_POLL["ticks"] = int(_REPLICATE_POLL.get("ticks") or 0) + 1
+        for pid, result in zip(ids, results):
+            fut = pending.get(pid)
+            if fut is None or fut.done():
+                continue
+            if isinstance(result, RuntimeError):
+                fut.set_exception(result)
+            elif isinstance(result, Exception):
+                # Transport hiccup: keep the prediction parked and retry next tick.
+                logger.warning("replicate poll error for %s: %s", pid, result)
+            elif str(result.get("status") or "") not in {"starting", "processing"}:
+                fut.set_result(result)
+
+
+async def _await_prediction(prediction_id: str, timeout_s: float) -> Dict[str, Any]:
+    fut = _watch_prediction(prediction_id)
+    try:
+        return await asyncio.wait_for(fut, timeout=timeout_s)
+    except asyncio.TimeoutError:
+        return {"id": prediction_id, "status": "timeout", "error": f"replicate prediction not finished after {int(timeout_s)}s"}
+    finally:
+        _REPLICATE_POLL["pending"].pop(prediction_id, None)
+
+
+async def _replicate_run_prediction(input_json: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    headers = _replicate_headers()
 
     model = str(input_json.get("model") or "").strip()
     version = str(input_json.get("version") or "").strip()
@@ -763,13 +1978,15 @@ def _replicate_run_prediction(input_json: Dict[str, Any]) -> Tuple[str, Dict[str
         payload["version"] = version
     else:
         payload["model"] = model
+    webhook_url = (os.getenv("REPLICATE_WEBHOOK_URL") or "").strip()
+    if webhook_url:
+        payload["webhook"] = webhook_url
+        payload["webhook_events_filter"] = ["completed"]
 
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    create_resp = requests.post(
-        "https://api.replicate.com/v1/predictions",
+    create_resp = await _provider_client().post(
+        f"{_replicate_api_base()}/predictions",
         headers=headers,
         json=payload,
-        timeout=30,
     )
     if create_resp.status_code >= 300:
         raise RuntimeError(f"replicate create failed: {create_resp.status_code} {create_resp.text[:200]}")
@@ -778,20 +1995,10 @@ def _replicate_run_prediction(input_json: Dict[str, Any]) -> Tuple[str, Dict[str
     if not prediction_id:
         raise RuntimeError("replicate response missing prediction id")
 
-    timeout_s = int((os.getenv("REPLICATE_POLL_TIMEOUT_SECONDS") or "180").strip())
-    timeout_s = max(30, timeout_s)
-    deadline = time.time() + timeout_s
+    timeout_s = _env_int("REPLICATE_POLL_TIMEOUT_SECONDS", 180, 30, 86400)
     status = str(prediction.get("status") or "")
-    while status in {"starting", "processing"} and time.time() < deadline:
-        time.sleep(2.0)
-        get_resp = requests.get(
-            f"https://api.replicate.com/v1/predictions/{prediction_id}",
-            headers=headers,
-            timeout=30,
-        )
-        if get_resp.status_code >= 300:
-            raise RuntimeError(f"replicate poll failed: {get_resp.status_code} {get_resp.text[:200]}")
-        prediction = get_resp.json() or {}
+    if status in {"starting", "processing"}:
+        prediction = await _await_prediction(prediction_id, float(timeout_s))
         status = str(prediction.get("status") or "")
 
     if status != "succeeded":
@@ -810,7 +2017,7 @@ def _replicate_run_prediction(input_json: Dict[str, Any]) -> Tuple[str, Dict[str
     }
 
 
-def _run_provider(job: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+async def _run_provider(job: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
     provider = str(job.get("provider") or "").strip().lower()
     operation = str(job.get("operation") or "").strip().lower()
     input_json = job.get("input_json") or {}
@@ -823,9 +2030,9 @@ def _run_provider(job: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
         raise RuntimeError("simulated provider failure")
 
     if provider == "replicate":
-        return _replicate_run_prediction(input_json)
+        return await _replicate_run_prediction(input_json)
 
-    time.sleep(0.2)
+    await asyncio.sleep(0.2)
     return "", {
         "ok": True,
         "provider": provider or "mock",
@@ -836,47 +2043,122 @@ def _run_provider(job: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
     }
 
 
-def _claim_next_job() -> Optional[Dict[str, Any]]:
+def _claim_jobs(limit: int) -> List[Dict[str, Any]]:
+    limit = max(1, int(limit))
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
+                # Users with ready work and a free running slot, lowest pass first. SKIP LOCKED on the
+                # user row lets concurrent workers serve different users instead of queueing on one.
                 cur.execute(
                     """
-                    SELECT
-                      id, user_id, provider, operation, input_json, status,
-                      attempt_count, max_attempts, credits_cost
-                    FROM jobs
-                    WHERE status = 'queued' AND available_at <= now()
-                    ORDER BY available_at ASC, created_at ASC
+                    SELECT user_id, running, max_running, weight, pass
+                    FROM job_queue_users
+                    WHERE ready_at IS NOT NULL
+                      AND ready_at <= now()
+                      AND running < max_running
+                    ORDER BY pass ASC, user_id ASC
+                    LIMIT %s
                     FOR UPDATE SKIP LOCKED
-                    LIMIT 1
-                    """
+                    """,
+                    (limit,),
                 )
-                row = cur.fetchone()
-                if not row:
-                    return None
-
-                attempt = int(row.get("attempt_count") or 0) + 1
+                users = cur.fetchall() or []
+                if not users:
+                    return []
+                slots = _fair_share(users, limit)
+                user_ids = list(slots)
                 cur.execute(
                     """
-                    UPDATE jobs
+                    WITH alloc AS (
+                      SELECT * FROM unnest(%s::uuid[], %s::int[]) AS a(user_id, n)
+                    ),
+                    picked AS (
+                      SELECT q.id
+                      FROM alloc a
+                      CROSS JOIN LATERAL (
+                        SELECT id
+                        FROM jobs
+                        WHERE user_id = a.user_id AND status = 'queued' AND available_at <= now()
+                        ORDER BY available_at ASC, created_at ASC
+                        LIMIT a.n
+                        FOR UPDATE SKIP LOCKED
+                      ) q
+                    )
+                    UPDATE jobs AS j
                     SET status = 'running',
-                        attempt_count = %s,
-                        started_at = COALESCE(started_at, now()),
+                        attempt_count = j.attempt_count + 1,
+                        started_at = COALESCE(j.started_at, now()),
+                        lease_expires_at = now() + make_interval(secs => %s),
                         updated_at = now()
-                    WHERE id = %s
+                    FROM picked
+                    WHERE j.id = picked.id
+                    RETURNING
+                      j.id, j.user_id, j.provider, j.operation, j.input_json, j.input_hash, j.status,
+                      j.attempt_count, j.max_attempts, j.credits_cost, j.available_at, j.created_at
                     """,
-                    (attempt, row["id"]),
+                    (user_ids, [slots[uid] for uid in user_ids], _job_lease_seconds()),
                 )
+                rows = cur.fetchall() or []
+                claimed: Dict[str, int] = {}
+                for row in rows:
+                    claimed[str(row["user_id"])] = claimed.get(str(row["user_id"]), 0) + 1
+                by_id = {str(u["user_id"]): u for u in users}
+                # Pass advances only for jobs actually claimed; ready_at is re-read from the
+                # (user_id, available_at) WHERE status='queued' index, so a user whose ready_at was
+                # stale drops out until new work arrives.
                 cur.execute(
+                    """
+                    UPDATE job_queue_users AS q
+                    SET running = q.running + c.n,
+                        pass = c.pass,
+                        ready_at = (
+                          SELECT MIN(available_at) FROM jobs WHERE user_id = q.user_id AND status = 'queued'
+                        ),
+                        updated_at = now()
+                    FROM unnest(%s::uuid[], %s::int[], %s::float8[]) AS c(user_id, n, pass)
+                    WHERE q.user_id = c.user_id
+                    """,
+                    (
+                        user_ids,
+                        [claimed.get(uid, 0) for uid in user_ids],
+                        [
+                            float(by_id[uid]["pass"]) + claimed.get(uid, 0) / max(1, int(by_id[uid]["weight"]))
+                            for uid in user_ids
+                        ],
+                    ),
+                )
+                if not rows:
+                    return []
+                rows.sort(key=lambda r: (r["available_at"], r["created_at"]))
+                cur.executemany(
                     """
                     INSERT INTO job_events (job_id, event_type, payload, created_at)
                     VALUES (%s, 'started', %s::jsonb, now())
                     """,
-                    (row["id"], json.dumps({"attempt": attempt})),
+                    [(row["id"], json.dumps({"attempt": int(row["attempt_count"])})) for row in rows],
                 )
-                row["attempt_count"] = attempt
-                return row
+                _notify_job_events(cur, *(row["id"] for row in rows))
+                ops = _ops_counters()
+                _move_job_status(ops, "queued", "running", len(rows))
+                _flush_ops_counters(cur, ops)
+                for row in rows:
+                    row.pop("available_at", None)
+                    row.pop("created_at", None)
+                return rows
+
+
+def _claim_next_job() -> Optional[Dict[str, Any]]:
+    rows = _claim_jobs(1)
+    return rows[0] if rows else None
+
+
+def _still_owns_job(existing: Optional[Dict[str, Any]], job: Dict[str, Any]) -> bool:
+    # attempt_count fences a worker whose lease expired: the reaper requeued the job and another
+    # claim (attempt + 1) owns it now, so this late outcome must not be recorded.
+    if not existing or str(existing.get("status") or "") != "running":
+        return False
+    return int(existing.get("attempt_count") or 0) == int(job.get("attempt_count") or 0)
 
 
 def _mark_job_succeeded(job: Dict[str, Any], provider_job_id: str, result_json: Dict[str, Any]) -> None:
@@ -884,16 +2166,22 @@ def _mark_job_succeeded(job: Dict[str, Any], provider_job_id: str, result_json:
     user_id = str(job["user_id"])
     credits_cost = int(job.get("credits_cost") or 0)
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
-                cur.execute("SELECT status FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
+                cur.execute("SELECT status, attempt_count, input_hash FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
                 existing = cur.fetchone()
-                if not existing or str(existing.get("status") or "") != "running":
+                if not _still_owns_job(existing, job):
                     return
+                attached = _lock_attached_jobs(cur, job_id) if existing.get("input_hash") else []
 
-                # Convert hold -> consume without net balance change (release + consume).
-                _insert_ledger_release(cur, user_id, job_id, credits_cost, "release_on_success")
-                _insert_ledger_consume(cur, user_id, job_id, credits_cost)
+                # Convert hold -> consume without net balance change (release + consume). Attached jobs
+                # settle here too, all balances in user order before any counter row is touched.
+                settle = [(user_id, job_id, credits_cost)] + [
+                    (str(row["user_id"]), str(row["id"]), int(row.get("credits_cost") or 0)) for row in attached
+                ]
+                for settle_user, settle_job, settle_cost in sorted(settle):
+                    _insert_ledger_release(cur, settle_user, settle_job, settle_cost, "release_on_success")
+                    _insert_ledger_consume(cur, settle_user, settle_job, settle_cost)
 
                 cur.execute(
                     """
@@ -905,9 +2193,15 @@ def _mark_job_succeeded(job: Dict[str, Any], provider_job_id: str, result_json:
                         finished_at = now(),
                         updated_at = now()
                     WHERE id = %s
+                    RETURNING EXTRACT(EPOCH FROM (finished_at - started_at))::double precision AS duration_s
                     """,
                     (provider_job_id or None, json.dumps(result_json), job_id),
                 )
+                duration = cur.fetchone()
+                _queue_user_release(cur, user_id)
+                ops = _ops_counters()
+                _record_job_duration(ops, duration)
+                _move_job_status(ops, "running", "succeeded")
                 cur.execute(
                     """
                     INSERT INTO job_events (job_id, event_type, payload, created_at)
@@ -915,6 +2209,13 @@ def _mark_job_succeeded(job: Dict[str, Any], provider_job_id: str, result_json:
                     """,
                     (job_id, json.dumps({"attempt": int(job.get("attempt_count") or 0)})),
                 )
+                _notify_job_events(cur, job_id)
+                if existing.get("input_hash"):
+                    _result_cache_store(cur, {**job, "input_hash": existing["input_hash"]}, provider_job_id, result_json)
+                    cached = {"provider_job_id": provider_job_id, "result_json": result_json, "source_job_id": job_id}
+                    for row in attached:
+                        _finish_job_from_result(cur, str(row["id"]), "attached", cached, ops)
+                _flush_ops_counters(cur, ops)
 
 
 def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
@@ -925,11 +2226,11 @@ def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
     credits_cost = int(job.get("credits_cost") or 0)
 
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
-                cur.execute("SELECT status FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
+                cur.execute("SELECT status, attempt_count FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
                 existing = cur.fetchone()
-                if not existing or str(existing.get("status") or "") != "running":
+                if not _still_owns_job(existing, job):
                     return
 
                 if attempt_count < max_attempts:
@@ -942,9 +2243,11 @@ def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
                             last_error = %s,
                             updated_at = now()
                         WHERE id = %s
+                        RETURNING available_at
                         """,
                         (delay_seconds, error_text, job_id),
                     )
+                    _queue_user_release(cur, user_id, cur.fetchone()["available_at"])
                     cur.execute(
                         """
                         INSERT INTO job_events (job_id, event_type, payload, created_at)
@@ -961,6 +2264,11 @@ def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
                             ),
                         ),
                     )
+                    _notify_jobs(cur, delay_seconds)
+                    _notify_job_events(cur, job_id)
+                    ops = _ops_counters()
+                    _move_job_status(ops, "running", "queued")
+                    _flush_ops_counters(cur, ops)
                     return
 
                 _insert_ledger_release(cur, user_id, job_id, credits_cost, "release_on_fail")
@@ -972,9 +2280,17 @@ def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
                         finished_at = now(),
                         updated_at = now()
                     WHERE id = %s
+                    RETURNING EXTRACT(EPOCH FROM (finished_at - started_at))::double precision AS duration_s
                     """,
                     (error_text, job_id),
                 )
+                duration = cur.fetchone()
+                _queue_user_release(cur, user_id)
+                ops = _ops_counters()
+                _release_attached_jobs(cur, job_id, ops)
+                _record_job_duration(ops, duration)
+                _move_job_status(ops, "running", "failed")
+                _bump_ops_metric(ops, "job_failed")
                 cur.execute(
                     """
                     INSERT INTO job_events (job_id, event_type, payload, created_at)
@@ -985,6 +2301,7 @@ def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
                         json.dumps({"attempt": attempt_count, "error": error_text}),
                     ),
                 )
+                _notify_job_events(cur, job_id)
                 cur.execute(
                     """
                     INSERT INTO job_dead_letters
@@ -1007,38 +2324,86 @@ def _mark_job_failed_or_retry(job: Dict[str, Any], error_text: str) -> None:
                         ),
                     ),
                 )
+                if int(cur.rowcount or 0) > 0:
+                    _bump_ops_metric(ops, "dead_letter")
+                _flush_ops_counters(cur, ops)
 
 
-def _recover_stale_running_jobs() -> Dict[str, int]:
-    stale_seconds = _running_stale_seconds()
-    summary: Dict[str, int] = {"stale_seconds": stale_seconds, "queued": 0, "failed": 0}
+def _renew_job_leases(leases: Dict[str, int]) -> List[str]:
+    # One UPDATE per heartbeat for every job this worker runs; returns the ids whose lease is gone.
+    if not leases:
+        return []
+    job_ids = list(leases)
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT
-                      id, user_id, attempt_count, max_attempts, credits_cost
-                    FROM jobs
-                    WHERE status = 'running'
-                      AND updated_at <= (now() - make_interval(secs => %s))
-                    ORDER BY updated_at ASC
-                    FOR UPDATE SKIP LOCKED
+                    UPDATE jobs AS j
+                    SET lease_expires_at = now() + make_interval(secs => %s)
+                    FROM unnest(%s::uuid[], %s::int[]) AS l(id, attempt)
+                    WHERE j.id = l.id AND j.status = 'running' AND j.attempt_count = l.attempt
+                    RETURNING j.id
                     """,
-                    (stale_seconds,),
+                    (_job_lease_seconds(), job_ids, [leases[job_id] for job_id in job_ids]),
                 )
-                rows = cur.fetchall() or []
-                summary["candidates"] = len(rows)
+                renewed = {str(row["id"]) for row in (cur.fetchall() or [])}
+    return [job_id for job_id in job_ids if job_id not in renewed]
 
-                for row in rows:
-                    job_id = str(row["id"])
+
+def _recover_stale_running_jobs(limit: int = _JOB_REAPER_BATCH) -> Dict[str, int]:
+    stale_seconds = _running_stale_seconds()
+    summary: Dict[str, int] = {"stale_seconds": stale_seconds, "queued": 0, "failed": 0}
+    # Expired leases, plus lease-less rows from before migration 0010 by updated_at.
+    expired_sql = """
+        status = 'running'
+        AND (
+          lease_expires_at <= now()
+          OR (lease_expires_at IS NULL AND updated_at <= (now() - make_interval(secs => %s)))
+        )
+    """
+    with _connect_postgres() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT id
+                FROM jobs
+                WHERE {expired_sql}
+                ORDER BY lease_expires_at ASC NULLS FIRST
+                LIMIT %s
+                """,
+                (stale_seconds, max(1, int(limit))),
+            )
+            candidates = [str(row["id"]) for row in (cur.fetchall() or [])]
+        conn.commit()
+        summary["candidates"] = len(candidates)
+
+        # One short transaction per job, like the worker's own fail/retry path: the reaper never
+        # holds one user's balance or queue row while waiting for another's. SKIP LOCKED lets
+        # every worker run the reaper without stepping on the others.
+        for job_id in candidates:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"""
+                        SELECT id, user_id, attempt_count, max_attempts, credits_cost
+                        FROM jobs
+                        WHERE id = %s AND {expired_sql}
+                        FOR UPDATE SKIP LOCKED
+                        """,
+                        (job_id, stale_seconds),
+                    )
+                    row = cur.fetchone()
+                    if not row:
+                        continue
+                    ops = _ops_counters()
                     user_id = str(row["user_id"])
                     attempt_count = int(row.get("attempt_count") or 0)
                     max_attempts = int(row.get("max_attempts") or 1)
                     credits_cost = int(row.get("credits_cost") or 0)
 
                     if attempt_count < max_attempts:
-                        error_text = "recovered stale running job after worker restart"
+                        error_text = "job lease expired; requeued"
                         cur.execute(
                             """
                             UPDATE jobs
@@ -1047,10 +2412,13 @@ def _recover_stale_running_jobs() -> Dict[str, int]:
                                 last_error = %s,
                                 updated_at = now()
                             WHERE id = %s AND status = 'running'
+                            RETURNING available_at
                             """,
                             (error_text, job_id),
                         )
-                        if int(cur.rowcount or 0) > 0:
+                        requeued = cur.fetchone()
+                        if requeued:
+                            _queue_user_release(cur, user_id, requeued["available_at"])
                             cur.execute(
                                 """
                                 INSERT INTO job_events (job_id, event_type, payload, created_at)
@@ -1068,10 +2436,14 @@ def _recover_stale_running_jobs() -> Dict[str, int]:
                                     ),
                                 ),
                             )
+                            _move_job_status(ops, "running", "queued")
+                            _notify_jobs(cur)
+                            _notify_job_events(cur, job_id)
+                            _flush_ops_counters(cur, ops)
                             summary["queued"] = int(summary.get("queued") or 0) + 1
                         continue
 
-                    error_text = "job recovered as failed after stale running timeout"
+                    error_text = "job lease expired on final attempt"
                     _insert_ledger_release(cur, user_id, job_id, credits_cost, "release_on_recover_fail")
                     cur.execute(
                         """
@@ -1081,11 +2453,18 @@ def _recover_stale_running_jobs() -> Dict[str, int]:
                             finished_at = now(),
                             updated_at = now()
                         WHERE id = %s AND status = 'running'
+                        RETURNING EXTRACT(EPOCH FROM (finished_at - started_at))::double precision AS duration_s
                         """,
                         (error_text, job_id),
                     )
-                    if int(cur.rowcount or 0) <= 0:
+                    finished = cur.fetchone()
+                    if not finished:
                         continue
+                    _queue_user_release(cur, user_id)
+                    _release_attached_jobs(cur, job_id, ops)
+                    _record_job_duration(ops, finished)
+                    _move_job_status(ops, "running", "failed")
+                    _bump_ops_metric(ops, "job_failed")
 
                     cur.execute(
                         """
@@ -1097,6 +2476,7 @@ def _recover_stale_running_jobs() -> Dict[str, int]:
                             json.dumps({"attempt": attempt_count, "error": error_text, "recovered": True}),
                         ),
                     )
+                    _notify_job_events(cur, job_id)
                     cur.execute(
                         """
                         INSERT INTO job_dead_letters
@@ -1120,46 +2500,582 @@ def _recover_stale_running_jobs() -> Dict[str, int]:
                             ),
                         ),
                     )
+                    if int(cur.rowcount or 0) > 0:
+                        _bump_ops_metric(ops, "dead_letter")
                     summary["failed"] = int(summary.get("failed") or 0) + 1
+                    _flush_ops_counters(cur, ops)
     return summary
 
 
-def _process_one_job() -> bool:
-    job = _claim_next_job()
-    if not job:
-        return False
+def _reconcile_user_balances() -> Dict[str, Any]:
+    summary: Dict[str, Any] = {"checked": 0, "drifted": 0, "fixed": []}
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                # One reconciler at a time across workers; the others skip this round.
+                cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('user-balance-reconcile')) AS locked")
+                if not cur.fetchone()["locked"]:
+                    summary["skipped"] = True
+                    return summary
+                # Only rows written since their last check: every ledger write clears reconciled_at,
+                # stores balance_after and points last_ledger_id at itself in the same transaction,
+                # so a healthy row matches its last entry without summing the ledger.
+                cur.execute(
+                    """
+                    SELECT b.user_id, b.balance, b.last_ledger_id, l.balance_after
+                    FROM user_balances b
+                    LEFT JOIN credit_ledger l ON l.id = b.last_ledger_id
+                    WHERE b.reconciled_at IS NULL
+                    ORDER BY b.user_id
+                    """
+                )
+                rows = cur.fetchall() or []
+                summary["checked"] = len(rows)
+                ok: List[Dict[str, Any]] = []
+                suspect: List[str] = []
+                for r in rows:
+                    if r.get("balance_after") is not None and int(r["balance_after"]) == int(r["balance"]):
+                        ok.append(r)
+                    else:
+                        suspect.append(str(r["user_id"]))
+                if ok:
+                    # Skips rows a writer moved on since the read; they are checked next round.
+                    cur.execute(
+                        """
+                        UPDATE user_balances b
+                        SET reconciled_at = now()
+                        FROM unnest(%s::uuid[], %s::uuid[]) AS c(user_id, last_ledger_id)
+                        WHERE b.user_id = c.user_id AND b.last_ledger_id = c.last_ledger_id
+                        """,
+                        ([str(r["user_id"]) for r in ok], [str(r["last_ledger_id"]) for r in ok]),
+                    )
+                for user_id in suspect:
+                    # Re-check under the row lock; writers hold it while inserting ledger rows.
+                    cur.execute("SELECT balance FROM user_balances WHERE user_id = %s FOR UPDATE", (user_id,))
+                    locked = cur.fetchone()
+                    if not locked:
+                        continue
+                    cur.execute(
+                        "SELECT COALESCE(SUM(amount), 0)::int AS total FROM credit_ledger WHERE user_id = %s",
+                        (user_id,),
+                    )
+                    total = int((cur.fetchone() or {}).get("total") or 0)
+                    cur.execute(
+                        """
+                        UPDATE user_balances
+                        SET balance = %s, updated_at = now(), reconciled_at = now()
+                        WHERE user_id = %s
+                        """,
+                        (total, user_id),
+                    )
+                    if total != int(locked.get("balance") or 0):
+                        summary["fixed"].append({"user_id": user_id, "was": int(locked.get("balance") or 0), "ledger": total})
+    summary["drifted"] = len(summary["fixed"])
+    return summary
+
+
+def _reconcile_ops_rollup() -> Dict[str, Any]:
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                # One reconciler at a time across workers; the others skip this round.
+                cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('ops-rollup-reconcile')) AS locked")
+                if not cur.fetchone()["locked"]:
+                    return {"status_drift": {}, "pruned_buckets": 0, "skipped": True}
+                # Jobs and their counter rows change in the same transaction, so one statement
+                # snapshot sees both consistently. The drift is added as a delta, which commutes
+                # with transitions committed meanwhile, and nothing blocks the job path.
+                cur.execute(
+                    """
+                    WITH actual AS (
+                      SELECT status, COUNT(*)::bigint AS n FROM jobs GROUP BY status
+                    ),
+                    tracked AS (
+                      SELECT status, SUM(n)::bigint AS n FROM ops_job_status_counts GROUP BY status
+                    ),
+                    drift AS (
+                      SELECT COALESCE(a.status, t.status) AS status, COALESCE(a.n, 0) - COALESCE(t.n, 0) AS n
+                      FROM actual a
+                      FULL JOIN tracked t ON t.status = a.status
+                      WHERE COALESCE(a.n, 0) <> COALESCE(t.n, 0)
+                    ),
+                    fixed AS (
+                      INSERT INTO ops_job_status_counts (status, shard, n)
+                      SELECT status, 0, n FROM drift ORDER BY status
+                      ON CONFLICT (status, shard) DO UPDATE SET n = ops_job_status_counts.n + excluded.n
+                    )
+                    SELECT status, n FROM drift
+                    """
+                )
+                drift = {str(r["status"]): int(r["n"]) for r in (cur.fetchall() or [])}
+                cur.execute("DELETE FROM ops_metrics_rollup WHERE bucket_start < now() - INTERVAL '7 days'")
+                return {"status_drift": drift, "pruned_buckets": int(cur.rowcount or 0)}
+
+
+def _reconcile_queue_users() -> Dict[str, Any]:
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                # Same pattern as the ops counters: one reconciler, snapshot drift applied as a delta.
+                cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('queue-users-reconcile')) AS locked")
+                if not cur.fetchone()["locked"]:
+                    return {"queue_user_drift": 0, "skipped": True}
+                cur.execute(
+                    """
+                    INSERT INTO job_queue_users (user_id, running, ready_at, pass, weight, max_running, updated_at)
+                    SELECT u.id, 0, NULL,
+                      COALESCE((SELECT MIN(pass) FROM job_queue_users WHERE ready_at IS NOT NULL), 0),
+                      COALESCE(p.priority_weight, 1), COALESCE(p.max_running_jobs, %s), now()
+                    FROM users u
+                    LEFT JOIN plans p ON p.id = u.plan_id
+                    WHERE u.id IN (SELECT DISTINCT user_id FROM jobs WHERE status IN ('queued', 'running'))
+                    ON CONFLICT (user_id) DO NOTHING
+                    """,
+                    (_user_max_running_default(),),
+                )
+                # running moves by the drift seen in this statement's snapshot, which commutes with
+                # claims and releases committed meanwhile. ready_at only moves earlier: a later or
+                # stale value is corrected by the next claim, an earlier one could hide new work.
+                # Plan weight and cap are refreshed too, for plans edited in place.
+                cur.execute(
+                    """
+                    WITH actual AS (
+                      SELECT user_id,
+                        COUNT(*) FILTER (WHERE status = 'running')::int AS running,
+                        MIN(available_at) FILTER (WHERE status = 'queued') AS ready_at
+                      FROM jobs
+                      WHERE status IN ('queued', 'running')
+                      GROUP BY user_id
+                    ),
+                    drift AS (
+                      SELECT q.user_id,
+                        COALESCE(a.running, 0) - q.running AS running,
+                        a.ready_at,
+                        COALESCE(p.priority_weight, 1) AS weight,
+                        COALESCE(p.max_running_jobs, %s) AS max_running
+                      FROM job_queue_users q
+                      JOIN users u ON u.id = q.user_id
+                      LEFT JOIN plans p ON p.id = u.plan_id
+                      LEFT JOIN actual a ON a.user_id = q.user_id
+                      WHERE q.running <> COALESCE(a.running, 0)
+                        OR a.ready_at < q.ready_at
+                        OR (q.ready_at IS NULL AND a.ready_at IS NOT NULL)
+                        OR q.weight <> COALESCE(p.priority_weight, 1)
+                        OR q.max_running <> COALESCE(p.max_running_jobs, %s)
+                    )
+                    UPDATE job_queue_users AS q
+                    SET running = GREATEST(q.running + d.running, 0),
+                        ready_at = LEAST(q.ready_at, d.ready_at),
+                        weight = d.weight,
+                        max_running = d.max_running,
+                        updated_at = now()
+                    FROM drift d
+                    WHERE q.user_id = d.user_id
+                    RETURNING q.user_id
+                    """,
+                    (_user_max_running_default(), _user_max_running_default()),
+                )
+                return {"queue_user_drift": len(cur.fetchall() or [])}
+
+
+def _prune_result_cache() -> int:
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM job_result_cache WHERE expires_at <= now()")
+                return int(cur.rowcount or 0)
+
+
+def _cached_job_result(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # Retries and batch-created jobs are only checked here, right before the provider call.
+    input_hash = str(job.get("input_hash") or "")
+    if not input_hash:
+        return None
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                return _result_cache_get(cur, input_hash)
+
+
+async def _process_claimed_job(executor: ThreadPoolExecutor, job: Dict[str, Any]) -> None:
+    # Provider calls are awaited on the loop; only the short DB transitions use threads.
+    loop = asyncio.get_running_loop()
+    provider = str(job.get("provider") or "unknown").strip().lower() or "unknown"
+    claimed = time.perf_counter()
+    outcome = "succeeded"
     try:
-        provider_job_id, result = _run_provider(job)
-        _mark_job_succeeded(job, provider_job_id, result)
+        cached = await loop.run_in_executor(executor, _cached_job_result, job)
+        if cached:
+            result = dict(cached.get("result_json") or {})
+            result.update({"cache_hit": True, "cached_from_job_id": str(cached.get("source_job_id") or "")})
+            metrics.inc("mvp_result_cache_hits_total", source="worker")
+            await loop.run_in_executor(executor, _mark_job_succeeded, job, str(cached.get("provider_job_id") or ""), result)
+            return
+        try:
+            provider_job_id, result = await _run_provider(job)
+        except Exception:
+            metrics.observe("mvp_provider_seconds", time.perf_counter() - claimed, provider=provider, outcome="error")
+            raise
+        metrics.observe("mvp_provider_seconds", time.perf_counter() - claimed, provider=provider, outcome="ok")
+        await loop.run_in_executor(executor, _mark_job_succeeded, job, provider_job_id, result)
     except Exception as exc:
-        _mark_job_failed_or_retry(job, str(exc))
-    return True
+        outcome = "failed"
+        await loop.run_in_executor(executor, _mark_job_failed_or_retry, job, str(exc))
+    finally:
+        metrics.observe("mvp_job_claim_to_finish_seconds", time.perf_counter() - claimed, provider=provider, outcome=outcome)
 
 
-async def _mvp_worker_loop() -> None:
-    logger.info("mvp worker started")
-    recovered: Dict[str, Any] = {"queued": 0, "failed": 0}
+async def _run_claimed_job(executor: ThreadPoolExecutor, job: Dict[str, Any]) -> None:
+    job_id = str(job["id"])
+    attempt = int(job.get("attempt_count") or 0)
+    _JOB_LEASES[job_id] = attempt
     try:
-        recovered = await asyncio.to_thread(_recover_stale_running_jobs)
-        if int(recovered.get("queued") or 0) > 0 or int(recovered.get("failed") or 0) > 0:
-            logger.info("mvp worker recovery summary: %s", json.dumps(recovered, ensure_ascii=True))
+        await _process_claimed_job(executor, job)
+        _WORKER_STATE["processed_total"] = int(_WORKER_STATE.get("processed_total") or 0) + 1
+        metrics.inc("mvp_worker_processed_total")
     except Exception as exc:
         _WORKER_STATE["failures_total"] = int(_WORKER_STATE.get("failures_total") or 0) + 1
-        recovered = {"queued": 0, "failed": 0, "error": str(exc)}
-        logger.exception("mvp worker recovery pass failed: %s", exc)
-    _WORKER_STATE["recovered_total"] = int(_WORKER_STATE.get("recovered_total") or 0) + int(
-        recovered.get("queued") or 0
-    ) + int(recovered.get("failed") or 0)
-    _WORKER_STATE["recovered_last_at"] = _now_iso()
-    _WORKER_STATE["recovered_last_summary"] = recovered
+        logger.exception("mvp job %s crashed: %s", job.get("id"), exc)
+    finally:
+        if _JOB_LEASES.get(job_id) == attempt:
+            _JOB_LEASES.pop(job_id, None)
+
+
+def _wake_worker(delay_seconds: float = 0.0) -> None:
+    loop = _JOB_WAKEUP.get("loop")
+    event = _JOB_WAKEUP.get("event")
+    if loop is None or event is None:
+        return
+    try:
+        if delay_seconds > 0:
+            loop.call_soon_threadsafe(loop.call_later, delay_seconds, event.set)
+        else:
+            loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        pass
+
+
+def _job_listener(dsn: str, stop: threading.Event) -> None:
+    import psycopg
+
+    backoff = 1.0
+    while not stop.is_set():
+        try:
+            with psycopg.connect(dsn, autocommit=True) as lconn:
+                lconn.execute(f"LISTEN {_JOBS_CHANNEL}")
+                lconn.execute(f"LISTEN {_PREDICTIONS_CHANNEL}")
+                _JOB_WAKEUP["listening"] = True
+                backoff = 1.0
+                # Anything queued while we were not listening.
+                _wake_worker()
+                while not stop.is_set():
+                    for note in lconn.notifies(timeout=1.0):
+                        if note.channel == _PREDICTIONS_CHANNEL:
+                            _poke_prediction_poller()
+                            continue
+                        try:
+                            delay = float(note.payload or 0)
+                        except ValueError:
+                            delay = 0.0
+                        _wake_worker(delay)
+        except Exception as exc:
+            logger.warning("mvp job listener disconnected: %s", exc)
+        finally:
+            _JOB_WAKEUP["listening"] = False
+        stop.wait(backoff)
+        backoff = min(30.0, backoff * 2)
+
+
+def _job_stream_keepalive_seconds() -> float:
+    raw = (os.getenv("MVP_JOB_STREAM_KEEPALIVE_SECONDS") or "15").strip()
+    try:
+        value = float(raw)
+    except Exception:
+        value = 15.0
+    return max(1.0, min(60.0, value))
+
+
+def _job_stream_delta(job_id: str, after_id: int, user_id: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    with _connect_postgres() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, status, attempt_count, max_attempts, last_error, result_json,
+                  updated_at, started_at, finished_at
+                FROM jobs
+                WHERE id = %s AND (%s::uuid IS NULL OR user_id = %s::uuid)
+                LIMIT 1
+                """,
+                (job_id, user_id, user_id),
+            )
+            job = cur.fetchone()
+            if not job:
+                return None, []
+            cur.execute(
+                """
+                SELECT id, event_type, payload, created_at
+                FROM job_events
+                WHERE job_id = %s AND id > %s
+                ORDER BY id ASC
+                """,
+                (job_id, int(after_id)),
+            )
+            events = cur.fetchall() or []
+    for row in [job, *events]:
+        for key in ("created_at", "updated_at", "started_at", "finished_at"):
+            if row.get(key):
+                row[key] = row[key].isoformat()
+    job["id"] = str(job["id"])
+    return job, events
+
+
+def _job_stream_subscribe(job_id: str, last_id: int) -> Dict[str, Any]:
+    sub = {"queue": asyncio.Queue(), "last_id": int(last_id)}
+    _JOB_STREAM["subscribers"].setdefault(job_id, []).append(sub)
+    return sub
+
+
+def _job_stream_unsubscribe(job_id: str, sub: Dict[str, Any]) -> None:
+    subs = _JOB_STREAM["subscribers"].get(job_id) or []
+    if sub in subs:
+        subs.remove(sub)
+    if not subs:
+        _JOB_STREAM["subscribers"].pop(job_id, None)
+
+
+def _job_stream_poke(job_id: str) -> None:
+    # Runs on the hub loop. Notifications that land mid-refresh coalesce into one more pass.
+    if job_id not in _JOB_STREAM["subscribers"]:
+        return
+    if job_id in _JOB_STREAM["refreshing"]:
+        _JOB_STREAM["dirty"].add(job_id)
+        return
+    _JOB_STREAM["refreshing"].add(job_id)
+    asyncio.get_running_loop().create_task(_job_stream_refresh(job_id))
+
+
+async def _job_stream_refresh(job_id: str) -> None:
+    try:
+        while True:
+            _JOB_STREAM["dirty"].discard(job_id)
+            subs = _JOB_STREAM["subscribers"].get(job_id)
+            if not subs:
+                return
+            after_id = min(int(sub["last_id"]) for sub in subs)
+            _JOB_STREAM["refreshes"] = int(_JOB_STREAM.get("refreshes") or 0) + 1
+            try:
+                job, events = await asyncio.to_thread(_job_stream_delta, job_id, after_id)
+            except Exception as exc:
+                logger.warning("job stream refresh failed for %s: %s", job_id, exc)
+                return
+            for sub in list(_JOB_STREAM["subscribers"].get(job_id) or []):
+                fresh = [event for event in events if int(event["id"]) > int(sub["last_id"])]
+                if fresh:
+                    sub["last_id"] = int(fresh[-1]["id"])
+                sub["queue"].put_nowait((job, fresh))
+            if job_id not in _JOB_STREAM["dirty"]:
+                return
+    finally:
+        _JOB_STREAM["refreshing"].discard(job_id)
+
+
+def _job_stream_dispatch(job_id: str) -> None:
+    loop = _JOB_STREAM.get("loop")
+    if loop is None:
+        return
+    try:
+        loop.call_soon_threadsafe(_job_stream_poke, job_id)
+    except RuntimeError:
+        pass
+
+
+def _job_stream_listener(dsn: str, stop: threading.Event) -> None:
+    import psycopg
+
+    backoff = 1.0
+    while not stop.is_set():
+        try:
+            with psycopg.connect(dsn, autocommit=True) as lconn:
+                lconn.execute(f"LISTEN {_JOB_EVENTS_CHANNEL}")
+                _JOB_STREAM["listening"] = True
+                backoff = 1.0
+                # Catch up on anything committed while we were not listening.
+                for job_id in list(_JOB_STREAM["subscribers"]):
+                    _job_stream_dispatch(job_id)
+                while not stop.is_set():
+                    for note in lconn.notifies(timeout=1.0):
+                        _job_stream_dispatch(str(note.payload or ""))
+        except Exception as exc:
+            logger.warning("job stream listener disconnected: %s", exc)
+        finally:
+            _JOB_STREAM["listening"] = False
+        stop.wait(backoff)
+        backoff = min(30.0, backoff * 2)
+
+
+def _ensure_job_stream_hub() -> None:
+    thread = _JOB_STREAM.get("thread")
+    _JOB_STREAM["loop"] = asyncio.get_running_loop()
+    if thread is not None and thread.is_alive():
+        return
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_job_stream_listener,
+        args=(_require_env("DATABASE_URL"), stop),
+        name="mvp-job-stream",
+        daemon=True,
+    )
+    _JOB_STREAM["thread"] = thread
+    _JOB_STREAM["stop"] = stop
+    thread.start()
+
+
+def stop_job_stream_hub() -> None:
+    stop = _JOB_STREAM.get("stop")
+    thread = _JOB_STREAM.get("thread")
+    if stop is not None:
+        stop.set()
+    if thread is not None:
+        thread.join(timeout=3.0)
+    _JOB_STREAM["thread"] = None
+    _JOB_STREAM["stop"] = None
+    _JOB_STREAM["loop"] = None
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=True, default=str)}\n\n"
+
+
+async def _job_lease_heartbeat() -> None:
+    while True:
+        await asyncio.sleep(max(1.0, _job_lease_seconds() / 3.0))
+        leases = dict(_JOB_LEASES)
+        try:
+            lost = await asyncio.to_thread(_renew_job_leases, leases)
+        except Exception as exc:
+            # A missed beat is fine as long as the next one lands before the lease runs out.
+            logger.warning("mvp job lease renewal failed: %s", exc)
+            continue
+        for job_id in lost:
+            # Jobs that finished while the renewal ran are no longer tracked; anything else was reaped.
+            if _JOB_LEASES.get(job_id) != leases[job_id]:
+                continue
+            _WORKER_STATE["leases_lost_total"] = int(_WORKER_STATE.get("leases_lost_total") or 0) + 1
+            metrics.inc("mvp_job_leases_lost_total")
+            # The attempt keeps running, but its outcome is dropped by the attempt_count fence.
+            logger.warning("mvp job %s lost its lease on attempt %s", job_id, leases[job_id])
+
+
+async def _job_reaper() -> None:
+    while True:
+        recovered: Dict[str, Any] = {"queued": 0, "failed": 0}
+        try:
+            recovered = await asyncio.to_thread(_recover_stale_running_jobs)
+            if int(recovered.get("queued") or 0) > 0 or int(recovered.get("failed") or 0) > 0:
+                metrics.inc("mvp_jobs_reaped_total", int(recovered.get("queued") or 0), outcome="requeued")
+                metrics.inc("mvp_jobs_reaped_total", int(recovered.get("failed") or 0), outcome="failed")
+                logger.info("mvp worker recovery summary: %s", json.dumps(recovered, ensure_ascii=True))
+        except Exception as exc:
+            _WORKER_STATE["failures_total"] = int(_WORKER_STATE.get("failures_total") or 0) + 1
+            recovered = {"queued": 0, "failed": 0, "error": str(exc)}
+            logger.exception("mvp worker recovery pass failed: %s", exc)
+        _WORKER_STATE["recovered_total"] = int(_WORKER_STATE.get("recovered_total") or 0) + int(
+            recovered.get("queued") or 0
+        ) + int(recovered.get("failed") or 0)
+        _WORKER_STATE["recovered_last_at"] = _now_iso()
+        if recovered.get("candidates") != 0:
+            _WORKER_STATE["recovered_last_summary"] = recovered
+        # A full batch means more expired leases may be waiting; go again right away.
+        if int(recovered.get("candidates") or 0) < _JOB_REAPER_BATCH:
+            await asyncio.sleep(_job_reaper_seconds())
+
+
+async def _mvp_worker_loop() -> None:
+    logger.info("mvp worker started")
+    reconcile_every = _balance_reconcile_seconds()
+    next_reconcile_at = time.monotonic() + min(60, reconcile_every)
+    concurrency = _worker_concurrency()
+    _WORKER_STATE["concurrency"] = concurrency
+    executor = ThreadPoolExecutor(max_workers=min(16, concurrency), thread_name_prefix="mvp-job")
+    in_flight: set = set()
+    _JOB_WAKEUP["loop"] = asyncio.get_running_loop()
+    _JOB_WAKEUP["event"] = asyncio.Event()
+    listener_stop = threading.Event()
+    listener = threading.Thread(
+        target=_job_listener,
+        args=(_require_env("DATABASE_URL"), listener_stop),
+        name="mvp-job-listener",
+        daemon=True,
+    )
+    listener.start()
+    lease_tasks = [asyncio.create_task(_job_lease_heartbeat()), asyncio.create_task(_job_reaper())]
+    try:
+        await _mvp_worker_poll(executor, in_flight, concurrency, reconcile_every, next_reconcile_at)
+    finally:
+        for task in lease_tasks:
+            task.cancel()
+        listener_stop.set()
+        _JOB_WAKEUP["loop"] = None
+        _JOB_WAKEUP["event"] = None
+        if in_flight:
+            # Give running jobs a moment to record their outcome; stragglers are reaped when their lease expires.
+            await asyncio.wait(in_flight, timeout=10.0)
+        executor.shutdown(wait=False)
+        _WORKER_STATE["in_flight"] = 0
+        await asyncio.to_thread(listener.join, 3.0)
+
+
+async def _mvp_worker_poll(
+    executor: ThreadPoolExecutor,
+    in_flight: set,
+    concurrency: int,
+    reconcile_every: int,
+    next_reconcile_at: float,
+) -> None:
+    wakeup: asyncio.Event = _JOB_WAKEUP["event"]
+    fallback_poll = _worker_fallback_poll_seconds()
     while True:
         _WORKER_STATE["last_heartbeat"] = _now_iso()
+        # Cleared before claiming so a NOTIFY that lands mid-claim still wakes the next wait.
+        wakeup.clear()
         try:
-            processed = await asyncio.to_thread(_process_one_job)
-            if processed:
-                _WORKER_STATE["processed_total"] = int(_WORKER_STATE.get("processed_total") or 0) + 1
+            if reconcile_every and time.monotonic() >= next_reconcile_at:
+                next_reconcile_at = time.monotonic() + reconcile_every
+                reconciled = await asyncio.to_thread(_reconcile_user_balances)
+                _WORKER_STATE["balance_reconciled_last_at"] = _now_iso()
+                if reconciled["drifted"]:
+                    _WORKER_STATE["balance_drift_total"] = int(_WORKER_STATE.get("balance_drift_total") or 0) + int(
+                        reconciled["drifted"]
+                    )
+                    logger.warning("user_balances drift corrected: %s", json.dumps(reconciled, ensure_ascii=True))
+                ops_fix = await asyncio.to_thread(_reconcile_ops_rollup)
+                if ops_fix["status_drift"]:
+                    logger.warning("ops job status counts corrected: %s", json.dumps(ops_fix, ensure_ascii=True))
+                queue_fix = await asyncio.to_thread(_reconcile_queue_users)
+                if queue_fix["queue_user_drift"]:
+                    logger.warning("job queue user state corrected: %s", json.dumps(queue_fix, ensure_ascii=True))
+                await asyncio.to_thread(_prune_result_cache)
+            free = concurrency - len(in_flight)
+            claimed: List[Dict[str, Any]] = []
+            if free > 0:
+                claimed = await asyncio.to_thread(_claim_jobs, free)
+                for job in claimed:
+                    task = asyncio.create_task(_run_claimed_job(executor, job))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+            _WORKER_STATE["in_flight"] = len(in_flight)
+            if len(in_flight) >= concurrency:
+                # Claim again as soon as a slot frees up; the timeout keeps the heartbeat fresh.
+                await asyncio.wait(in_flight, timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
                 continue
-            await asyncio.sleep(1.0)
+            # Queue drained: sleep until NOTIFY, a finished job, or the fallback poll for due retries.
+            timeout = fallback_poll if _JOB_WAKEUP.get("listening") else 1.0
+            waiter = asyncio.ensure_future(wakeup.wait())
+            try:
+                await asyncio.wait({waiter, *in_flight}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
         except asyncio.CancelledError:
             logger.info("mvp worker cancelled")
             raise
@@ -1197,6 +3113,20 @@ async def stop_mvp_worker() -> None:
         pass
     _WORKER_TASK = None
     _WORKER_STATE["running"] = False
+    await close_provider_client()
+
+
+def _observe_request(request: Request, status_code: int, elapsed_s: float) -> None:
+    # Label by route template, not raw path, so ids in URLs don't explode series cardinality.
+    route = request.scope.get("route")
+    path = str(getattr(route, "path", "") or "unmatched")
+    metrics.observe(
+        "http_request_duration_seconds",
+        elapsed_s,
+        method=request.method,
+        route=path,
+        status=str(status_code),
+    )
 
 
 def install_mvp_observability(app: FastAPI) -> None:
@@ -1205,10 +3135,12 @@ def install_mvp_observability(app: FastAPI) -> None:
 
     @app.middleware("http")
     async def _request_logger(request: Request, call_next):
+        started = time.perf_counter()
         if not request.url.path.startswith("/api/"):
-            return await call_next(request)
+            response = await call_next(request)
+            _observe_request(request, int(response.status_code), time.perf_counter() - started)
+            return response
 
-        started = time.perf_counter()
         request_id = (request.headers.get("x-request-id") or "").strip() or uuid.uuid4().hex
         request.state.request_id = request_id
 
@@ -1219,6 +3151,7 @@ def install_mvp_observability(app: FastAPI) -> None:
             response.headers["x-request-id"] = request_id
             return response
         finally:
+            _observe_request(request, status_code, time.perf_counter() - started)
             elapsed_ms = int((time.perf_counter() - started) * 1000.0)
             payload = {
                 "event": "api_request",
@@ -1257,7 +3190,7 @@ def init_mvp_sentry() -> None:
 
 
 @router.post("/api/auth/register")
-def register(req: Request, data: RegisterIn) -> Dict[str, Any]:
+async def register(req: Request, data: RegisterIn) -> Dict[str, Any]:
     _auth_origin_check(req)
     email = (data.email or "").strip().lower()
     if "@" not in email:
@@ -1266,10 +3199,13 @@ def register(req: Request, data: RegisterIn) -> Dict[str, Any]:
         raise HTTPException(status_code=400, detail="password must be at least 8 chars with letters and digits")
 
     user_id = str(uuid.uuid4())
-    password_hash = _hash_password(data.password)
+    password_hash = await _run_password_work(_hash_password, data.password)
+    return await asyncio.to_thread(_register_user, user_id, email, password_hash)
 
+
+def _register_user(user_id: str, email: str, password_hash: str) -> Dict[str, Any]:
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -1296,38 +3232,63 @@ def register(req: Request, data: RegisterIn) -> Dict[str, Any]:
                 }
 
 
+def _load_login_user(email: str) -> Optional[Dict[str, Any]]:
+    with _connect_postgres() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, email, password_hash, is_active
+                FROM users
+                WHERE lower(email) = lower(%s)
+                LIMIT 1
+                """,
+                (email,),
+            )
+            return cur.fetchone()
+
+
+def _login_issue_session(user_id: str, old_hash: str, new_hash: str) -> Tuple[str, str]:
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                if new_hash:
+                    # Transparent upgrade to the current hash parameters; skipped if the password changed meanwhile.
+                    cur.execute(
+                        "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                        (new_hash, user_id, old_hash),
+                    )
+                return _issue_session(cur, user_id)
+
+
 @router.post("/api/auth/login")
-def login(req: Request, data: LoginIn) -> Dict[str, Any]:
+async def login(req: Request, data: LoginIn) -> Dict[str, Any]:
     _auth_origin_check(req)
     email = (data.email or "").strip().lower()
     ip = _client_ip(req)
-    _assert_login_allowed(email, ip)
-    with _connect_postgres() as conn:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT id, email, password_hash, is_active
-                    FROM users
-                    WHERE lower(email) = lower(%s)
-                    LIMIT 1
-                    """,
-                    (email,),
-                )
-                row = cur.fetchone()
-                if not row or not _verify_password(data.password, str(row.get("password_hash") or "")):
-                    _register_login_failure(email, ip)
-                    raise HTTPException(status_code=401, detail="invalid credentials")
-                if not bool(row.get("is_active")):
-                    raise HTTPException(status_code=403, detail="user is disabled")
-                _register_login_success(email, ip)
-                token, expires_at = _issue_session(cur, str(row["id"]))
-                return {
-                    "ok": True,
-                    "user": {"id": str(row["id"]), "email": str(row["email"])},
-                    "token": token,
-                    "expires_at": expires_at,
-                }
+    await asyncio.to_thread(_assert_login_allowed, email, ip)
+    row = await asyncio.to_thread(_load_login_user, email)
+    password_hash = str((row or {}).get("password_hash") or "")
+    if not row or not await _run_password_work(_verify_password, data.password, password_hash):
+        await asyncio.to_thread(_register_login_failure, email, ip)
+        raise HTTPException(status_code=401, detail="invalid credentials")
+    if not bool(row.get("is_active")):
+        raise HTTPException(status_code=403, detail="user is disabled")
+    await asyncio.to_thread(_register_login_success, email, ip)
+    new_hash = ""
+    if _password_needs_rehash(password_hash):
+        try:
+            new_hash = await _run_password_work(_hash_password, data.password)
+        except HTTPException as exc:
+            # The password is already verified; a shed upgrade just waits for the next login.
+            if exc.status_code != 503:
+                raise
+    token, expires_at = await asyncio.to_thread(_login_issue_session, str(row["id"]), password_hash, new_hash)
+    return {
+        "ok": True,
+        "user": {"id": str(row["id"]), "email": str(row["email"])},
+        "token": token,
+        "expires_at": expires_at,
+    }
 
 
 @router.post("/api/auth/logout")
@@ -1335,8 +3296,9 @@ def logout(req: Request) -> Dict[str, Any]:
     _auth_origin_check(req)
     token = _parse_bearer_token(req)
     token_hash = _hash_token(token)
+    _session_cache_invalidate(token_hash)
     with _connect_postgres() as conn:
-        with conn:
+        with conn.transaction():
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -1347,7 +3309,9 @@ def logout(req: Request) -> Dict[str, Any]:
                     (token_hash,),
                 )
                 changed = int(cur.rowcount or 0)
-                return {"ok": True, "revoked": changed}
+    # Again after commit, in case a concurrent request re-cached the session meanwhile.
+    _session_cache_invalidate(token_hash)
+    return {"ok": True, "revoked": changed}
 
 
 @router.get("/api/auth/me")
@@ -1460,6 +3424,35 @@ async def stripe_webhook(req: Request) -> Dict[str, Any]:
     return {"ok": True, **outcome}
 
 
+@router.post("/api/providers/replicate/webhook")
+async def replicate_webhook(req: Request) -> Dict[str, Any]:
+    expected = (os.getenv("REPLICATE_WEBHOOK_TOKEN") or "").strip()
+    supplied = (req.query_params.get("token") or "").strip()
+    if not expected or not supplied or not secrets.compare_digest(supplied, expected):
+        raise HTTPException(status_code=401, detail="invalid webhook token")
+    try:
+        prediction = json.loads((await req.body()).decode("utf-8") or "{}")
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="invalid JSON body") from exc
+    if not isinstance(prediction, dict) or not str(prediction.get("id") or "").strip():
+        raise HTTPException(status_code=400, detail="missing prediction id")
+    # The body is only a wake-up: the poller re-fetches the prediction from the API, so an
+    # unsigned payload can never complete a job or consume credits.
+    prediction_id = str(prediction["id"]).strip()[:200]
+    if _prediction_pending(prediction_id):
+        _poke_prediction_poller()
+        return {"ok": True, "delivered": "local"}
+
+    # Worker runs in another process: wake its poller through the LISTEN connection.
+    def _notify() -> None:
+        with _connect_postgres() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (_PREDICTIONS_CHANNEL, prediction_id))
+
+    await asyncio.to_thread(_notify)
+    return {"ok": True, "delivered": "notify"}
+
+
 @router.post("/api/jobs")
 def create_job_with_hold(req: Request, data: JobCreateIn) -> Dict[str, Any]:
     user = _auth_user_from_token(req)
@@ -1470,6 +3463,15 @@ def create_job_with_hold(req: Request, data: JobCreateIn) -> Dict[str, Any]:
     return {"ok": True, "job": row}
 
 
+@router.post("/api/jobs/batch")
+def create_jobs_batch(req: Request, data: JobBatchCreateIn) -> Dict[str, Any]:
+    user = _auth_user_from_token(req)
+    request_idempotency_key = _resolve_idempotency_key(req.headers.get("idempotency-key"))
+    out = _create_jobs_batch(user["id"], data.jobs, request_idempotency_key=request_idempotency_key)
+    req.state.user_id = user["id"]
+    return {"ok": True, **out}
+
+
 @router.get("/api/jobs")
 def jobs_list(req: Request, limit: int = 50) -> Dict[str, Any]:
     user = _auth_user_from_token(req)
@@ -1536,6 +3538,78 @@ def job_details(req: Request, job_id: str) -> Dict[str, Any]:
             return {"ok": True, "job": row, "events": events}
 
 
+@router.get("/api/jobs/{job_id}/stream")
+async def job_stream(req: Request, job_id: str) -> StreamingResponse:
+    user = await asyncio.to_thread(_auth_user_from_token, req, True)
+    req.state.job_id = job_id
+    try:
+        last_id = max(0, int((req.headers.get("last-event-id") or "0").strip() or 0))
+    except ValueError:
+        last_id = 0
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="job not found")
+    active = sum(len(subs) for subs in _JOB_STREAM["subscribers"].values())
+    if active >= _env_int("MVP_JOB_STREAM_MAX_SUBSCRIBERS", 1000, 1, 100000):
+        raise HTTPException(status_code=503, detail="too many job streams", headers={"Retry-After": "5"})
+
+    _ensure_job_stream_hub()
+    # Subscribe before the snapshot so nothing committed in between is missed.
+    sub = _job_stream_subscribe(job_id, last_id)
+    try:
+        job, events = await asyncio.to_thread(_job_stream_delta, job_id, last_id, user["id"])
+    except BaseException:
+        _job_stream_unsubscribe(job_id, sub)
+        raise
+    if not job:
+        _job_stream_unsubscribe(job_id, sub)
+        raise HTTPException(status_code=404, detail="job not found")
+    if events:
+        sub["last_id"] = max(int(sub["last_id"]), int(events[-1]["id"]))
+    keepalive_s = _job_stream_keepalive_seconds()
+
+    async def _events():
+        delivered = last_id
+        last_state: Optional[Tuple[Any, ...]] = None
+        pending = [(job, events)]
+        try:
+            while True:
+                for snap, rows in pending:
+                    for event in rows:
+                        if int(event["id"]) <= delivered:
+                            continue
+                        delivered = int(event["id"])
+                        yield _sse("job_event", event, delivered)
+                    state = (snap.get("status"), snap.get("attempt_count"))
+                    if state != last_state:
+                        last_state = state
+                        yield _sse("status", snap)
+                    if str(snap.get("status") or "") in _JOB_TERMINAL_STATUSES:
+                        return
+                pending = []
+                if await req.is_disconnected():
+                    return
+                try:
+                    pending.append(await asyncio.wait_for(sub["queue"].get(), timeout=keepalive_s))
+                except asyncio.TimeoutError:
+                    if not _JOB_STREAM.get("listening"):
+                        # LISTEN connection is down; fall back to one shared refresh per keepalive.
+                        _job_stream_poke(job_id)
+                    yield ": keepalive\n\n"
+                    continue
+                while not sub["queue"].empty():
+                    pending.append(sub["queue"].get_nowait())
+        finally:
+            _job_stream_unsubscribe(job_id, sub)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/api/ready")
 def ready() -> Dict[str, Any]:
     db_ok = False
@@ -1581,6 +3655,63 @@ def ops_credit_adjust(req: Request, data: CreditAdjustmentIn) -> Dict[str, Any]:
     return {"ok": True, "result": result}
 
 
+@router.post("/api/ops/users/plan")
+def ops_assign_plan(req: Request, data: PlanAssignIn) -> Dict[str, Any]:
+    if not _admin_token_ok(req):
+        raise HTTPException(status_code=401, detail="admin unauthorized")
+    plan_id = data.plan_id.strip()
+    with _connect_postgres() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                error_text = _assign_user_plan(cur, data.user_id, plan_id)
+                if error_text:
+                    raise HTTPException(status_code=404, detail=error_text)
+    return {"ok": True, "user_id": data.user_id, "plan_id": plan_id or None}
+
+
+def _histogram_quantile(histogram: Dict[str, int], q: float) -> Optional[float]:
+    # Linear interpolation inside the bucket that crosses the quantile (Prometheus-style).
+    total = sum(histogram.values())
+    if total <= 0:
+        return None
+    target = q * total
+    seen = 0
+    lower = 0.0
+    for bound in _JOB_DURATION_BUCKETS:
+        n = int(histogram.get(str(bound), 0))
+        if n and seen + n >= target:
+            return lower + (float(bound) - lower) * ((target - seen) / n)
+        seen += n
+        lower = float(bound)
+    return lower
+
+
+def _collect_runtime_gauges() -> None:
+    metrics.set_gauge("mvp_worker_in_flight", int(_WORKER_STATE.get("in_flight") or 0))
+    metrics.set_gauge("mvp_predictions_pending", len(_REPLICATE_POLL.get("pending") or {}))
+    metrics.set_gauge("mvp_auth_hash_queue_depth", int(_HASH_STATE.get("depth") or 0))
+    metrics.set_gauge("mvp_session_cache_entries", len(_SESSION_CACHE))
+    pool = _PG_POOL_STATE.get("pool")
+    if pool is not None:
+        stats = pool.get_stats()
+        metrics.set_gauge("mvp_pg_pool_size", int(stats.get("pool_size") or 0), state="open")
+        metrics.set_gauge("mvp_pg_pool_size", int(stats.get("pool_available") or 0), state="idle")
+
+
+metrics.register_collector(_collect_runtime_gauges)
+
+
+@router.get("/metrics", include_in_schema=False)
+def prometheus_metrics(req: Request) -> PlainTextResponse:
+    # Fails closed like the admin endpoints: no METRICS_TOKEN, no metrics.
+    expected = (os.getenv("METRICS_TOKEN") or "").strip()
+    auth = (req.headers.get("authorization") or "").strip()
+    supplied = auth[7:].strip() if auth.lower().startswith("bearer ") else (req.query_params.get("token") or "").strip()
+    if not expected or not supplied or not secrets.compare_digest(supplied, expected):
+        raise HTTPException(status_code=401, detail="metrics unauthorized")
+    return PlainTextResponse(metrics.metrics_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @router.get("/api/ops/metrics")
 def ops_metrics(req: Request) -> Dict[str, Any]:
     if not _admin_token_ok(req):
@@ -1590,49 +3721,36 @@ def ops_metrics(req: Request) -> Dict[str, Any]:
         with conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT status, COUNT(*)::int AS n
-                FROM jobs
+                SELECT status, SUM(n)::bigint AS n
+                FROM ops_job_status_counts
                 GROUP BY status
                 """
             )
             by_status = {str(row["status"]): int(row["n"]) for row in (cur.fetchall() or [])}
             cur.execute(
                 """
-                SELECT COUNT(*)::int AS n
-                FROM webhook_events
-                WHERE status = 'failed' AND received_at >= (now() - INTERVAL '1 hour')
+                SELECT metric, label, SUM(count)::bigint AS n,
+                  SUM(count) FILTER (WHERE bucket_start >= now() - INTERVAL '1 hour')::bigint AS n_1h
+                FROM ops_metrics_rollup
+                WHERE bucket_start >= now() - INTERVAL '24 hours'
+                  AND metric IN ('webhook_failed', 'job_failed', 'dead_letter', 'job_duration')
+                GROUP BY metric, label
                 """
             )
-            webhook_failed_last_hour = int((cur.fetchone() or {}).get("n") or 0)
-            cur.execute(
-                """
-                SELECT COUNT(*)::int AS n
-                FROM jobs
-                WHERE status = 'failed' AND finished_at >= (now() - INTERVAL '1 hour')
-                """
-            )
-            jobs_failed_last_hour = int((cur.fetchone() or {}).get("n") or 0)
-            cur.execute(
-                """
-                SELECT COUNT(*)::int AS n
-                FROM job_dead_letters
-                WHERE created_at >= (now() - INTERVAL '24 hours')
-                """
-            )
-            dead_letters_last_24h = int((cur.fetchone() or {}).get("n") or 0)
-            cur.execute(
-                """
-                SELECT percentile_cont(0.95)
-                  WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM (finished_at - started_at)))
-                AS p95_seconds
-                FROM jobs
-                WHERE status IN ('succeeded', 'failed')
-                  AND started_at IS NOT NULL
-                  AND finished_at IS NOT NULL
-                  AND finished_at >= (now() - INTERVAL '24 hours')
-                """
-            )
-            p95_seconds = (cur.fetchone() or {}).get("p95_seconds")
+            rollup = cur.fetchall() or []
+            totals_1h: Dict[str, int] = {}
+            totals_24h: Dict[str, int] = {}
+            histogram: Dict[str, int] = {}
+            for row in rollup:
+                metric = str(row["metric"])
+                totals_1h[metric] = totals_1h.get(metric, 0) + int(row.get("n_1h") or 0)
+                totals_24h[metric] = totals_24h.get(metric, 0) + int(row.get("n") or 0)
+                if metric == "job_duration":
+                    histogram[str(row["label"])] = int(row.get("n") or 0)
+            webhook_failed_last_hour = int(totals_1h.get("webhook_failed", 0))
+            jobs_failed_last_hour = int(totals_1h.get("job_failed", 0))
+            dead_letters_last_24h = int(totals_24h.get("dead_letter", 0))
+            p95_seconds = _histogram_quantile(histogram, 0.95)
             return {
                 "ok": True,
                 "queue_depth": {
@@ -1640,6 +3758,7 @@ def ops_metrics(req: Request) -> Dict[str, Any]:
                     "running": int(by_status.get("running", 0)),
                     "succeeded": int(by_status.get("succeeded", 0)),
                     "failed": int(by_status.get("failed", 0)),
+                    "attached": int(by_status.get("attached", 0)),
                 },
                 "webhook_failed_last_hour": webhook_failed_last_hour,
                 "jobs_failed_last_hour": jobs_failed_last_hour,
@@ -1649,10 +3768,21 @@ def ops_metrics(req: Request) -> Dict[str, Any]:
                     "running": bool(_WORKER_STATE.get("running")),
                     "last_heartbeat": _WORKER_STATE.get("last_heartbeat"),
                     "processed_total": int(_WORKER_STATE.get("processed_total") or 0),
+                    "concurrency": int(_WORKER_STATE.get("concurrency") or 0),
+                    "in_flight": int(_WORKER_STATE.get("in_flight") or 0),
+                    "listening": bool(_JOB_WAKEUP.get("listening")),
+                    "predictions_in_flight": len(_REPLICATE_POLL["pending"]),
                     "failures_total": int(_WORKER_STATE.get("failures_total") or 0),
                     "recovered_total": int(_WORKER_STATE.get("recovered_total") or 0),
                     "recovered_last_at": _WORKER_STATE.get("recovered_last_at"),
                     "recovered_last_summary": _WORKER_STATE.get("recovered_last_summary"),
+                    "leases_lost_total": int(_WORKER_STATE.get("leases_lost_total") or 0),
+                    "balance_reconciled_last_at": _WORKER_STATE.get("balance_reconciled_last_at"),
+                    "balance_drift_total": int(_WORKER_STATE.get("balance_drift_total") or 0),
+                },
+                "auth_hash": {
+                    "queue_depth": int(_HASH_STATE.get("depth") or 0),
+                    "shed_total": int(_HASH_STATE.get("shed_total") or 0),
                 },
             }
 
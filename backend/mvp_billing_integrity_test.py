@@ -12,9 +12,25 @@ import psycopg
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
+from backend import mvp_billing
 from backend.app import app
 from backend.migrate_postgres import apply_migrations
-from backend.mvp_billing import JobCreateIn, _create_job_with_credit_hold, _recover_stale_running_jobs
+from backend.mvp_billing import (
+    JobCreateIn,
+    _claim_jobs,
+    _connect_postgres,
+    _create_job_with_credit_hold,
+    _create_jobs_batch,
+    _flush_session_touches,
+    _job_stream_delta,
+    _mark_job_failed_or_retry,
+    _mark_job_succeeded,
+    _reconcile_ops_rollup,
+    _reconcile_queue_users,
+    _reconcile_user_balances,
+    _recover_stale_running_jobs,
+    _renew_job_leases,
+)
 
 
 def _sign(payload_raw: str, secret: str) -> str:
@@ -263,6 +279,30 @@ class MVPBillingIntegrityTest(unittest.TestCase):
             self.assertEqual(bad2.status_code, 401, bad2.text)
             self.assertEqual(bad3.status_code, 429, bad3.text)
 
+    def test_login_succeeds_when_rehash_is_shed(self) -> None:
+        email = f"rehash-shed-{uuid.uuid4().hex[:8]}@example.com"
+        weak = mvp_billing._hash_password("StrongPass123", iterations=100000)
+        self._create_user(email, weak)
+        needs_rehash = mvp_billing._password_needs_rehash
+
+        def _fill_queue(password_hash: str) -> bool:
+            # Verification is done; saturate the hash pool so the upgrade is shed.
+            mvp_billing._HASH_STATE["depth"] = mvp_billing._hash_max_queue()
+            return needs_rehash(password_hash)
+
+        mvp_billing._password_needs_rehash = _fill_queue
+        try:
+            with TestClient(app) as client:
+                res = client.post("/api/auth/login", json={"email": email, "password": "StrongPass123"})
+        finally:
+            mvp_billing._password_needs_rehash = needs_rehash
+            mvp_billing._HASH_STATE["depth"] = 0
+        self.assertEqual(res.status_code, 200, res.text)
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT password_hash FROM users WHERE email = %s", (email,))
+                self.assertEqual(cur.fetchone()[0], weak)
+
     def test_recover_stale_running_jobs(self) -> None:
         user_retry = self._create_user(f"recover-retry-{int(time.time())}@example.com")
         user_fail = self._create_user(f"recover-fail-{int(time.time())}@example.com")
@@ -350,6 +390,519 @@ class MVPBillingIntegrityTest(unittest.TestCase):
         self.assertEqual(dead_letters, 1)
         self.assertGreaterEqual(recovered_events, 1)
 
+    def test_pooled_connection_reused_and_rolled_back(self) -> None:
+        pids = set()
+        for _ in range(5):
+            with _connect_postgres() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_backend_pid() AS pid")
+                    pids.add(int(cur.fetchone()["pid"]))
+        self.assertLess(len(pids), 5, pids)
+
+        email = f"pool-{uuid.uuid4().hex[:8]}@example.com"
+        with self.assertRaises(RuntimeError):
+            with _connect_postgres() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "INSERT INTO users (id,email,password_hash,is_active) VALUES (%s,%s,'x',true)",
+                        (str(uuid.uuid4()), email),
+                    )
+                raise RuntimeError("boom")
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM users WHERE email = %s", (email,))
+                self.assertEqual(int(cur.fetchone()[0]), 0)
+
+    def test_user_balance_tracks_ledger_and_reconciles(self) -> None:
+        user_id = self._create_user(f"balance-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 10, f"seed-balance-{uuid.uuid4().hex}")
+        job = _create_job_with_credit_hold(
+            user_id,
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=4, input={"prompt": "b"}),
+        )
+        self.assertEqual(int(job["balance_after"]), 6)
+
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT balance FROM user_balances WHERE user_id = %s", (user_id,))
+                self.assertEqual(int(cur.fetchone()[0]), 6)
+                cur.execute("UPDATE user_balances SET balance = 999 WHERE user_id = %s", (user_id,))
+            conn.commit()
+
+        # Another worker holding the reconcile lock makes this round a no-op.
+        with psycopg.connect(self.dsn) as holder:
+            with holder.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(hashtext('user-balance-reconcile'))")
+            self.assertTrue(_reconcile_user_balances().get("skipped"))
+            with holder.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtext('user-balance-reconcile'))")
+
+        summary = _reconcile_user_balances()
+        self.assertIn(user_id, [row["user_id"] for row in summary["fixed"]], summary)
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT balance, reconciled_at IS NOT NULL FROM user_balances WHERE user_id = %s", (user_id,))
+                self.assertEqual(cur.fetchone(), (6, True))
+
+        # Checked rows are skipped until the next ledger write touches them.
+        self.assertEqual(_reconcile_user_balances()["checked"], 0)
+        _create_job_with_credit_hold(
+            user_id,
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, input={"prompt": "c"}),
+        )
+        summary = _reconcile_user_balances()
+        self.assertEqual((summary["checked"], summary["drifted"]), (1, 0), summary)
+
+    def test_session_cache_invalidated_on_logout_and_touches_flushed(self) -> None:
+        with TestClient(app) as client:
+            email = f"session-cache-{uuid.uuid4().hex[:8]}@example.com"
+            reg = client.post("/api/auth/register", json={"email": email, "password": "StrongPass123"})
+            self.assertEqual(reg.status_code, 200, reg.text)
+            headers = {"Authorization": f"Bearer {reg.json()['token']}"}
+            with psycopg.connect(self.dsn) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE auth_sessions SET last_used_at = now() - INTERVAL '1 day' "
+                        "WHERE user_id = %s RETURNING last_used_at",
+                        (reg.json()["user"]["id"],),
+                    )
+                    stale = cur.fetchone()[0]
+                conn.commit()
+
+            for _ in range(3):
+                me = client.get("/api/auth/me", headers=headers)
+                self.assertEqual(me.status_code, 200, me.text)
+            self.assertGreaterEqual(_flush_session_touches(), 1)
+            with psycopg.connect(self.dsn) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT last_used_at FROM auth_sessions WHERE user_id = %s", (reg.json()["user"]["id"],))
+                    self.assertGreater(cur.fetchone()[0], stale)
+
+            out = client.post("/api/auth/logout", headers=headers)
+            self.assertEqual(out.status_code, 200, out.text)
+            me = client.get("/api/auth/me", headers=headers)
+            self.assertEqual(me.status_code, 401, me.text)
+
+    def test_batch_claim_skips_locked_and_returns_distinct_jobs(self) -> None:
+        user_id = self._create_user(f"batch-claim-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 30, f"seed-batch-claim-{uuid.uuid4().hex}")
+        # The per-user running cap is cached on job_queue_users at enqueue time; lift it for this user.
+        os.environ["MVP_USER_MAX_RUNNING"] = "50"
+        try:
+            created = {
+                str(
+                    _create_job_with_credit_hold(
+                        user_id,
+                        JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, input={"n": i}),
+                    )["id"]
+                )
+                for i in range(6)
+            }
+        finally:
+            os.environ.pop("MVP_USER_MAX_RUNNING", None)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            batches = list(pool.map(lambda _: _claim_jobs(50), range(3)))
+        claimed = [str(row["id"]) for batch in batches for row in batch]
+        self.assertEqual(len(claimed), len(set(claimed)))
+        self.assertTrue(created.issubset(set(claimed)), (created, claimed))
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT COUNT(*) FROM job_events WHERE job_id = ANY(%s::uuid[]) AND event_type = 'started'",
+                    (list(created),),
+                )
+                self.assertEqual(int(cur.fetchone()[0]), len(created))
+
+    def test_fair_claim_caps_heavy_user_and_honours_plan_weight(self) -> None:
+        while _claim_jobs(1000):
+            pass
+        heavy = self._create_user(f"fair-heavy-{uuid.uuid4().hex[:8]}@example.com")
+        light = self._create_user(f"fair-light-{uuid.uuid4().hex[:8]}@example.com")
+        for user_id in (heavy, light):
+            self._seed_credits(user_id, 20, f"seed-fair-{uuid.uuid4().hex}")
+        os.environ["MVP_USER_MAX_RUNNING"] = "2"
+        try:
+            for i in range(8):
+                _create_job_with_credit_hold(heavy, JobCreateIn(provider="mock", operation="image.generate", input={"n": i}))
+            _create_job_with_credit_hold(light, JobCreateIn(provider="mock", operation="image.generate", input={"n": 0}))
+        finally:
+            os.environ.pop("MVP_USER_MAX_RUNNING", None)
+
+        claimed = _claim_jobs(50)
+        per_user: dict = {}
+        for row in claimed:
+            per_user[str(row["user_id"])] = per_user.get(str(row["user_id"]), 0) + 1
+        self.assertEqual(per_user.get(heavy), 2)
+        self.assertEqual(per_user.get(light), 1)
+        self.assertEqual(_claim_jobs(50), [])
+
+        plan_id = f"fair-{uuid.uuid4().hex[:8]}"
+        gold = self._create_user(f"fair-gold-{uuid.uuid4().hex[:8]}@example.com")
+        basic = self._create_user(f"fair-basic-{uuid.uuid4().hex[:8]}@example.com")
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO plans (id, name, monthly_price_cents, monthly_credits, priority_weight, max_running_jobs)
+                    VALUES (%s, 'gold', 0, 0, 3, 10)
+                    """,
+                    (plan_id,),
+                )
+                cur.execute("UPDATE users SET plan_id = %s WHERE id = %s", (plan_id, gold))
+                conn.commit()
+        os.environ["MVP_USER_MAX_RUNNING"] = "10"
+        try:
+            for user_id in (gold, basic):
+                self._seed_credits(user_id, 20, f"seed-fair-{uuid.uuid4().hex}")
+                for i in range(8):
+                    _create_job_with_credit_hold(user_id, JobCreateIn(provider="mock", operation="image.generate", input={"n": i}))
+        finally:
+            os.environ.pop("MVP_USER_MAX_RUNNING", None)
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pass FROM job_queue_users WHERE user_id = ANY(%s::uuid[])", ([gold, basic],))
+                self.assertEqual(len({float(r[0]) for r in cur.fetchall()}), 1)
+        claimed = _claim_jobs(4)
+        counts = [sum(1 for r in claimed if str(r["user_id"]) == u) for u in (gold, basic)]
+        self.assertEqual(counts, [3, 1])
+
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE job_queue_users SET running = 0 WHERE user_id = %s", (heavy,))
+                conn.commit()
+        self.assertGreaterEqual(_reconcile_queue_users()["queue_user_drift"], 1)
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT running FROM job_queue_users WHERE user_id = %s", (heavy,))
+                self.assertEqual(int(cur.fetchone()[0]), 2)
+
+    def test_plan_assignment_updates_queue_weight_and_cap(self) -> None:
+        plan_id = f"plan-{uuid.uuid4().hex[:8]}"
+        user_id = self._create_user(f"plan-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 5, f"seed-plan-{uuid.uuid4().hex}")
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO plans (id, name, monthly_price_cents, monthly_credits, priority_weight, max_running_jobs)
+                    VALUES (%s, 'pro', 0, 0, 4, 7)
+                    """,
+                    (plan_id,),
+                )
+                conn.commit()
+        _create_job_with_credit_hold(user_id, JobCreateIn(provider="mock", operation="image.generate", input={"plan": 1}))
+
+        event = {
+            "id": f"evt_plan_{uuid.uuid4().hex}",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": f"cs_plan_{uuid.uuid4().hex}", "metadata": {"user_id": user_id, "credits": "3", "plan_id": plan_id}}},
+        }
+        self.assertEqual(mvp_billing._process_event_in_tx(event)["status"], "processed")
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT u.plan_id, q.weight, q.max_running
+                    FROM users u JOIN job_queue_users q ON q.user_id = u.id
+                    WHERE u.id = %s
+                    """,
+                    (user_id,),
+                )
+                self.assertEqual(cur.fetchone(), (plan_id, 4, 7))
+
+        old_worker = os.environ.get("MVP_WORKER_ENABLED")
+        os.environ["MVP_WORKER_ENABLED"] = "false"
+        try:
+            with TestClient(app) as client:
+                headers = {"x-admin-token": "admin-test-token"}
+                missing = client.post("/api/ops/users/plan", json={"user_id": user_id, "plan_id": "no-such-plan"}, headers=headers)
+                self.assertEqual(missing.status_code, 404, missing.text)
+                cleared = client.post("/api/ops/users/plan", json={"user_id": user_id, "plan_id": ""}, headers=headers)
+                self.assertEqual(cleared.status_code, 200, cleared.text)
+        finally:
+            if old_worker is None:
+                os.environ.pop("MVP_WORKER_ENABLED", None)
+            else:
+                os.environ["MVP_WORKER_ENABLED"] = old_worker
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT u.plan_id, q.weight, q.max_running
+                    FROM users u JOIN job_queue_users q ON q.user_id = u.id
+                    WHERE u.id = %s
+                    """,
+                    (user_id,),
+                )
+                self.assertEqual(cur.fetchone(), (None, 1, mvp_billing._user_max_running_default()))
+
+    def test_job_creation_notifies_listeners(self) -> None:
+        user_id = self._create_user(f"notify-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 5, f"seed-notify-{uuid.uuid4().hex}")
+        with psycopg.connect(self.dsn, autocommit=True) as listener:
+            listener.execute("LISTEN mvp_jobs")
+            _create_job_with_credit_hold(
+                user_id,
+                JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, input={"prompt": "n"}),
+            )
+            notes = list(listener.notifies(timeout=5.0, stop_after=1))
+        self.assertEqual(len(notes), 1)
+        self.assertEqual(notes[0].channel, "mvp_jobs")
+        self.assertEqual(notes[0].payload, "0")
+
+    def test_job_events_notify_stream_hub_with_delta(self) -> None:
+        user_id = self._create_user(f"stream-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 5, f"seed-stream-{uuid.uuid4().hex}")
+        while _claim_jobs(1000):
+            pass
+        job = _create_job_with_credit_hold(
+            user_id,
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, input={"prompt": "s"}),
+        )
+        with psycopg.connect(self.dsn, autocommit=True) as listener:
+            listener.execute("LISTEN mvp_job_events")
+            claimed = _claim_jobs(1000)
+            notes = list(listener.notifies(timeout=5.0, stop_after=len(claimed)))
+        self.assertIn(str(job["id"]), [str(row["id"]) for row in claimed])
+        self.assertIn(str(job["id"]), [n.payload for n in notes])
+
+        snap, events = _job_stream_delta(str(job["id"]), 0, user_id)
+        self.assertEqual(snap["status"], "running")
+        self.assertEqual([e["event_type"] for e in events], ["queued", "started"])
+        _, none_after = _job_stream_delta(str(job["id"]), int(events[-1]["id"]))
+        self.assertEqual(none_after, [])
+        other, _ = _job_stream_delta(str(job["id"]), 0, str(uuid.uuid4()))
+        self.assertIsNone(other)
+
+    def test_job_batch_single_hold_cycle_with_item_idempotency(self) -> None:
+        user_id = self._create_user(f"batch-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 10, f"seed-batch-{uuid.uuid4().hex}")
+        prior = _create_job_with_credit_hold(
+            user_id,
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=2),
+            request_idempotency_key="b-0",
+        )
+        items = [
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=2, idempotency_key="b-0"),
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=3, idempotency_key="b-1"),
+            JobCreateIn(provider="mock", operation="image.upscale", credits_cost=1),
+        ]
+        out = _create_jobs_batch(user_id, items)
+        self.assertEqual(out["created"], 2)
+        self.assertEqual(out["balance_after"], 4)
+        self.assertEqual(out["jobs"][0]["id"], prior["id"])
+        self.assertTrue(out["jobs"][0]["idempotent_replay"])
+        self.assertEqual([j["balance_after"] for j in out["jobs"]], [8, 5, 4])
+
+        replay = _create_jobs_batch(user_id, items[:2])
+        self.assertEqual(replay["created"], 0)
+        self.assertEqual([j["id"] for j in replay["jobs"]], [j["id"] for j in out["jobs"][:2]])
+        self.assertEqual([j["balance_after"] for j in replay["jobs"]], [8, 5])
+
+        with self.assertRaises(HTTPException) as ctx:
+            _create_jobs_batch(user_id, [JobCreateIn(provider="mock", operation="x.y", credits_cost=5)])
+        self.assertEqual(ctx.exception.status_code, 402)
+
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM credit_ledger WHERE user_id=%s AND entry_type='hold'",
+                    (user_id,),
+                )
+                holds = cur.fetchone()
+                cur.execute("SELECT balance FROM user_balances WHERE user_id=%s", (user_id,))
+                balance = int(cur.fetchone()[0])
+                cur.execute(
+                    "SELECT COUNT(*) FROM job_events e JOIN jobs j ON j.id = e.job_id WHERE j.user_id=%s AND e.event_type='queued'",
+                    (user_id,),
+                )
+                queued_events = int(cur.fetchone()[0])
+        self.assertEqual((int(holds[0]), int(holds[1])), (3, -6))
+        self.assertEqual(balance, 4)
+        self.assertEqual(queued_events, 3)
+
+    def test_single_and_batch_create_with_same_key_race_to_one_job(self) -> None:
+        user_id = self._create_user(f"idem-race-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 100, f"seed-idem-race-{uuid.uuid4().hex}")
+        for i in range(10):
+            key = f"race-{i}-{uuid.uuid4().hex[:8]}"
+            data = JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, input={"race": i})
+            batch_item = JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, idempotency_key=key)
+            start = threading.Barrier(2)
+
+            def single() -> dict:
+                start.wait()
+                return _create_job_with_credit_hold(user_id, data, key)
+
+            def batch() -> dict:
+                start.wait()
+                return _create_jobs_batch(user_id, [batch_item])["jobs"][0]
+
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                futures = [pool.submit(single), pool.submit(batch)]
+                results = [f.result() for f in futures]
+            self.assertEqual(results[0]["id"], results[1]["id"])
+            self.assertEqual(sorted(r["idempotent_replay"] for r in results), [False, True])
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT COUNT(*) FROM credit_ledger WHERE user_id = %s AND entry_type = 'hold'",
+                    (user_id,),
+                )
+                self.assertEqual(int(cur.fetchone()[0]), 10)
+                cur.execute("SELECT balance FROM user_balances WHERE user_id = %s", (user_id,))
+                self.assertEqual(int(cur.fetchone()[0]), 90)
+
+    def test_ops_status_counts_track_transitions(self) -> None:
+        _reconcile_ops_rollup()
+        user_id = self._create_user(f"ops-rollup-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 5, f"seed-ops-rollup-{uuid.uuid4().hex}")
+        _create_job_with_credit_hold(
+            user_id,
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=1, input={"prompt": "ops"}),
+        )
+        _claim_jobs(1)
+        self.assertEqual(_reconcile_ops_rollup()["status_drift"], {})
+        old_worker = os.environ.get("MVP_WORKER_ENABLED")
+        os.environ["MVP_WORKER_ENABLED"] = "false"
+        try:
+            with TestClient(app) as client:
+                res = client.get("/api/ops/metrics", headers={"x-admin-token": "admin-test-token"})
+                self.assertEqual(res.status_code, 200, res.text)
+        finally:
+            if old_worker is None:
+                os.environ.pop("MVP_WORKER_ENABLED", None)
+            else:
+                os.environ["MVP_WORKER_ENABLED"] = old_worker
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+                actual = {str(r[0]): int(r[1]) for r in cur.fetchall()}
+        depth = res.json()["queue_depth"]
+        for status in ("queued", "running", "succeeded", "failed"):
+            self.assertEqual(depth[status], actual.get(status, 0), (depth, actual))
+
+    def test_result_cache_attaches_in_flight_and_completes_from_cache(self) -> None:
+        operation = f"cache.{uuid.uuid4().hex[:8]}"
+        os.environ["MVP_RESULT_CACHE_OPERATIONS"] = operation
+        try:
+            while _claim_jobs(1000):
+                pass
+            _reconcile_ops_rollup()
+            users = [self._create_user(f"cache-{i}-{uuid.uuid4().hex[:8]}@example.com") for i in range(3)]
+            for user_id in users:
+                self._seed_credits(user_id, 10, f"seed-cache-{uuid.uuid4().hex}")
+            same = {"prompt": "lighthouse", "size": 512}
+            leader = _create_job_with_credit_hold(users[0], JobCreateIn(provider="mock", operation=operation, credits_cost=2, input=same))
+            self.assertEqual(leader["status"], "queued")
+            claimed = [row for row in _claim_jobs(1000) if str(row["id"]) == leader["id"]]
+            self.assertEqual(len(claimed), 1)
+            attached = _create_job_with_credit_hold(
+                users[1],
+                JobCreateIn(provider="mock", operation=operation, credits_cost=2, input={"size": 512, "prompt": "lighthouse"}),
+            )
+            self.assertEqual((attached["status"], attached["attached_to"]), ("attached", leader["id"]))
+            self.assertEqual(attached["balance_after"], 8)
+
+            _mark_job_succeeded(claimed[0], "prov-cache-1", {"url": "https://example.test/a.png"})
+
+            hit_data = JobCreateIn(provider="mock", operation=operation, credits_cost=2, input=same)
+            hit = _create_job_with_credit_hold(users[2], hit_data, "cache-hit")
+            self.assertEqual((hit["status"], hit["cache_hit"]), ("succeeded", True))
+            replay = _create_job_with_credit_hold(users[2], hit_data, "cache-hit")
+            self.assertEqual((replay["id"], replay["idempotent_replay"]), (hit["id"], True))
+
+            with psycopg.connect(self.dsn) as conn:
+                with conn.cursor() as cur:
+                    for job_id, user_id in ((attached["id"], users[1]), (hit["id"], users[2])):
+                        cur.execute("SELECT status, result_json, provider_job_id FROM jobs WHERE id = %s", (job_id,))
+                        status, result, provider_job_id = cur.fetchone()
+                        self.assertEqual((status, provider_job_id), ("succeeded", "prov-cache-1"))
+                        self.assertEqual(result["cached_from_job_id"], leader["id"])
+                        self.assertEqual(result["url"], "https://example.test/a.png")
+                        cur.execute(
+                            "SELECT entry_type, amount FROM credit_ledger WHERE source_id = %s ORDER BY created_at, entry_type",
+                            (job_id,),
+                        )
+                        self.assertEqual(sorted(cur.fetchall()), [("consume", -2), ("hold", -2), ("release", 2)])
+                        cur.execute("SELECT balance FROM user_balances WHERE user_id = %s", (user_id,))
+                        self.assertEqual(int(cur.fetchone()[0]), 8)
+                    cur.execute("SELECT hits FROM job_result_cache WHERE source_job_id = %s", (leader["id"],))
+                    self.assertEqual(int(cur.fetchone()[0]), 1)
+            self.assertEqual(_reconcile_ops_rollup()["status_drift"], {})
+        finally:
+            os.environ.pop("MVP_RESULT_CACHE_OPERATIONS", None)
+
+    def test_result_cache_leader_failure_requeues_attached_jobs(self) -> None:
+        operation = f"cache.{uuid.uuid4().hex[:8]}"
+        os.environ["MVP_RESULT_CACHE_OPERATIONS"] = operation
+        try:
+            while _claim_jobs(1000):
+                pass
+            _reconcile_ops_rollup()
+            leader_user = self._create_user(f"cache-lead-{uuid.uuid4().hex[:8]}@example.com")
+            follower = self._create_user(f"cache-follow-{uuid.uuid4().hex[:8]}@example.com")
+            for user_id in (leader_user, follower):
+                self._seed_credits(user_id, 5, f"seed-cache-{uuid.uuid4().hex}")
+            data = JobCreateIn(provider="mock", operation=operation, credits_cost=1, max_attempts=1, input={"prompt": "x"})
+            leader = _create_job_with_credit_hold(leader_user, data)
+            claimed = [row for row in _claim_jobs(1000) if str(row["id"]) == leader["id"]]
+            attached = _create_job_with_credit_hold(follower, data)
+            self.assertEqual(attached["status"], "attached")
+
+            _mark_job_failed_or_retry(claimed[0], "provider exploded")
+
+            with psycopg.connect(self.dsn) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT status, cache_parent_job_id FROM jobs WHERE id = %s", (attached["id"],))
+                    self.assertEqual(cur.fetchone(), ("queued", None))
+                    cur.execute("SELECT COUNT(*) FROM job_result_cache WHERE source_job_id = %s", (leader["id"],))
+                    self.assertEqual(int(cur.fetchone()[0]), 0)
+            self.assertIn(attached["id"], [str(row["id"]) for row in _claim_jobs(1000)])
+            self.assertEqual(_reconcile_ops_rollup()["status_drift"], {})
+            self.assertEqual(_reconcile_queue_users()["queue_user_drift"], 0)
+        finally:
+            os.environ.pop("MVP_RESULT_CACHE_OPERATIONS", None)
+
+    def test_expired_lease_is_reaped_and_late_outcome_fenced(self) -> None:
+        while _claim_jobs(1000):
+            pass
+        user_id = self._create_user(f"lease-{uuid.uuid4().hex[:8]}@example.com")
+        self._seed_credits(user_id, 5, f"seed-lease-{uuid.uuid4().hex}")
+        created = _create_job_with_credit_hold(
+            user_id,
+            JobCreateIn(provider="mock", operation="image.generate", credits_cost=2, max_attempts=2, input={"lease": 1}),
+        )
+        first = [row for row in _claim_jobs(1000) if str(row["id"]) == created["id"]][0]
+        self.assertEqual(_renew_job_leases({created["id"]: 1}), [])
+
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT lease_expires_at > now() FROM jobs WHERE id = %s", (created["id"],))
+                self.assertTrue(cur.fetchone()[0])
+                cur.execute("UPDATE jobs SET lease_expires_at = now() - INTERVAL '1 second' WHERE id = %s", (created["id"],))
+            conn.commit()
+
+        # Expired leases left over by other tests may fill a default-sized batch ahead of this job.
+        summary = _recover_stale_running_jobs(100000)
+        self.assertGreaterEqual(int(summary["queued"]), 1, summary)
+        self.assertEqual(_renew_job_leases({created["id"]: 1}), [created["id"]])
+
+        second = [row for row in _claim_jobs(1000) if str(row["id"]) == created["id"]][0]
+        self.assertEqual(int(second["attempt_count"]), 2)
+        _mark_job_succeeded(first, "late-worker", {"stale": True})
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT status FROM jobs WHERE id = %s", (created["id"],))
+                self.assertEqual(cur.fetchone()[0], "running")
+        _mark_job_succeeded(second, "live-worker", {"ok": True})
+        with psycopg.connect(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT status, provider_job_id FROM jobs WHERE id = %s", (created["id"],))
+                self.assertEqual(cur.fetchone(), ("succeeded", "live-worker"))
+                cur.execute("SELECT balance FROM user_balances WHERE user_id = %s", (user_id,))
+                self.assertEqual(int(cur.fetchone()[0]), 3)
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
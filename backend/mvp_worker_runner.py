@@ -2,12 +2,15 @@ import asyncio
 import os
 import signal
 
-from backend.mvp_billing import start_mvp_worker, stop_mvp_worker
+from backend.metrics import start_metrics_dumper, stop_metrics_dumper
+from backend.mvp_billing import close_postgres_pool, start_mvp_worker, stop_mvp_worker
 
 
 async def _run() -> None:
     os.environ["MVP_WORKER_ENABLED"] = "true"
+    os.environ.setdefault("METRICS_PROCESS_ROLE", "worker")
     start_mvp_worker()
+    start_metrics_dumper()
     stop_event = asyncio.Event()
 
     loop = asyncio.get_running_loop()
@@ -19,6 +22,8 @@ async def _run() -> None:
 
     await stop_event.wait()
     await stop_mvp_worker()
+    close_postgres_pool()
+    stop_metrics_dumper()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,4 @@
+﻿$ErrorActionPreference = "Stop"
+
+. .\backend-task-bootstrap.ps1 -EnsureDeps
+& $BackendPython ".\backend\analytics_retention.py"